@@ -5,9 +5,6 @@ import warnings
 from pathlib import Path
 
 from src.config import PayloadSetting, settings
-from src.parsers import MainParser, WikiParser, run_drop_rate_update, run_mapping_update
-from src.parsers.core.aa_export import update_exported_files
-from src.wiki import FANDOM, MOONCELL  # noqa
 
 
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -52,6 +49,16 @@ def should_run_wiki_parser(payload: PayloadSetting):
 
 # %%
 if __name__ == "__main__":
+    # not at module level: spawned workers import this module as __mp_main__
+    from src.parsers import (
+        MainParser,
+        WikiParser,
+        run_drop_rate_update,
+        run_mapping_update,
+    )
+    from src.parsers.core.aa_export import update_exported_files
+    from src.wiki import FANDOM, MOONCELL  # noqa
+
     arg_parser = argparse.ArgumentParser()
     arg_parser.add_argument(
         "task", nargs="?", choices=("atlas", "wiki", "trywiki", "mapping", "domus")
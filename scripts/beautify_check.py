@@ -0,0 +1,120 @@
+# %%
+"""
+Check `beautify_json` against js-beautify.
+
+Usage:
+    python -m scripts.beautify_check --fixtures [--update]
+    python -m scripts.beautify_check [folder=../chaldea-data/dist]
+
+--fixtures: every `scripts/fixtures/beautify/<name>.json` is formatted and
+compared with `<name>.golden.json`. If js-beautify is installed, its output of
+the fixture must match the golden file as well, `--update` rewrites the golden
+files from js-beautify.
+
+folder: every json file in folder is treated as golden output of
+`js-beautify -s=2 -n`. The save phase of the minified files is timed like
+`MainParser._normal_dump` does it: formatted in process, written and hashed. If
+js-beautify is installed, the save phase before is timed as well: minified
+bytes written, formatted by a js-beautify subprocess, read back and hashed.
+"""
+import hashlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import orjson
+
+from src.utils.helper import beautify_json
+
+
+FIXTURES = Path(__file__).parent / "fixtures" / "beautify"
+
+
+def js_beautify(data: bytes) -> bytes:
+    with tempfile.TemporaryDirectory() as tmp:
+        fp = Path(tmp) / "data.json"
+        fp.write_bytes(data)
+        subprocess.run(["js-beautify", "-r", "-s=2", "-n", str(fp)], check=True)
+        return fp.read_bytes()
+
+
+def check_fixtures(update: bool) -> bool:
+    has_js = shutil.which("js-beautify") is not None
+    if update and not has_js:
+        raise RuntimeError("js-beautify is required to update golden files")
+    if not has_js:
+        print("js-beautify not found, golden files are not verified")
+    passed = True
+    for fp in sorted(FIXTURES.glob("*.json")):
+        if fp.name.endswith(".golden.json"):
+            continue
+        fp_golden = fp.with_name(f"{fp.stem}.golden.json")
+        data = fp.read_bytes()
+        if update:
+            fp_golden.write_bytes(js_beautify(data))
+        golden = fp_golden.read_bytes()
+        results = {"beautify_json": beautify_json(data)}
+        if has_js:
+            results["js-beautify"] = js_beautify(data)
+        for name, result in results.items():
+            if result != golden:
+                passed = False
+                print(f"  mismatch: {fp.name}, {name}")
+    print(f"fixtures: {'passed' if passed else 'failed'}")
+    return passed
+
+
+def save_in_process(folder: Path, minified: dict[str, bytes]) -> float:
+    t0 = time.perf_counter()
+    for name, compact in minified.items():
+        _bytes = beautify_json(compact)
+        folder.joinpath(name).write_bytes(_bytes)
+        hashlib.md5(_bytes).hexdigest()
+    return time.perf_counter() - t0
+
+
+def save_subprocess(folder: Path, minified: dict[str, bytes]) -> float:
+    t0 = time.perf_counter()
+    for name, compact in minified.items():
+        fp = folder / name
+        fp.write_bytes(compact)
+        subprocess.run(["js-beautify", "-r", "-s=2", "-n", str(fp)], check=True)
+        _bytes = fp.read_bytes()
+        hashlib.md5(_bytes).hexdigest()
+    return time.perf_counter() - t0
+
+
+def main(folder: Path):
+    files = sorted(folder.glob("*.json"))
+    mismatched: list[str] = []
+    minified: dict[str, bytes] = {}
+    for fp in files:
+        golden = fp.read_bytes()
+        compact = orjson.dumps(orjson.loads(golden))
+        minified[fp.name] = compact
+        if beautify_json(compact) != golden:
+            mismatched.append(fp.name)
+    print(f"{len(files) - len(mismatched)}/{len(files)} files identical")
+    for name in mismatched:
+        print(f"  mismatch: {name}")
+
+    size = sum(len(v) for v in minified.values()) / 1024 / 1024
+    print(f"save phase of {len(minified)} files, {size:.1f}MB minified:")
+    with tempfile.TemporaryDirectory() as tmp:
+        dt = save_in_process(Path(tmp), minified)
+        print(f"  in process:  {dt:.3f} secs")
+        if not shutil.which("js-beautify"):
+            print("  js-beautify not found, skip subprocess timing")
+            return
+        dt_js = save_subprocess(Path(tmp), minified)
+        print(f"  js-beautify: {dt_js:.3f} secs, speedup {dt_js / dt:.2f}x")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--fixtures" in args:
+        sys.exit(0 if check_fixtures("--update" in args) else 1)
+    main(Path(args[0] if args else "../chaldea-data/dist"))
@@ -0,0 +1,82 @@
+# %%
+"""
+Compare DataEncoder with the one of an older revision on JP servants.
+
+Usage: python -m scripts.bench_encoder <git_rev>
+
+git_rev: a revision before the change to compare, e.g. the parent of the commit
+which added the per-type encoder plans.
+
+Both encoders dump `nice_servant_lore` in chunks of 100 like save_data does,
+the outputs must be byte-for-byte equal.
+"""
+import importlib.util
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from app.schemas.common import Region
+
+from src.parsers.core import dump
+from src.parsers.core.dump import DataEncoder
+from src.parsers.main_parser import MainParser
+from src.schemas.gamedata import MasterData
+from src.utils.helper import dump_json
+
+
+def load_ref_encoder(rev: str) -> type[DataEncoder]:
+    source = subprocess.check_output(["git", "show", f"{rev}:src/parsers/core/dump.py"])
+    if source == Path(dump.__file__).read_bytes():
+        raise ValueError(f"dump.py of {rev} is the same as the current one")
+    spec = importlib.util.spec_from_loader("src.parsers.core._dump_ref", loader=None)
+    assert spec
+    module = importlib.util.module_from_spec(spec)
+    module.__package__ = "src.parsers.core"
+    exec(compile(source, f"dump.py@{rev}", "exec"), module.__dict__)
+    return module.DataEncoder
+
+
+def encode_servants(
+    encoder: DataEncoder, data: MasterData
+) -> tuple[list[bytes], float]:
+    data.base_skills.clear()
+    data.base_tds.clear()
+    data.base_functions.clear()
+    encoder.item = encoder.basic_svt = encoder.bgm = True
+    servants = data.nice_servant_lore
+    t0 = time.perf_counter()
+    outputs = [
+        dump_json(
+            servants[i : i + 100],
+            default=encoder.default,
+            indent2=False,
+            new_line=False,
+        ).encode()
+        for i in range(0, len(servants), 100)
+    ]
+    return outputs, time.perf_counter() - t0
+
+
+def main(rev: str):
+    data = MainParser().load_master_data(Region.JP)
+    ref_encoder = load_ref_encoder(rev)(data)
+    encoder = DataEncoder(data)
+    # the first round trims servants in place, time the second one
+    encode_servants(ref_encoder, data)
+    ref_outputs, ref_dt = encode_servants(ref_encoder, data)
+    outputs, dt = encode_servants(encoder, data)
+    assert len(outputs) == len(ref_outputs)
+    mismatched = [i for i, (a, b) in enumerate(zip(outputs, ref_outputs)) if a != b]
+    print(f"{len(data.nice_servant_lore)} servants, {len(outputs)} chunks")
+    print(f"mismatched chunks: {mismatched}")
+    print(f"{rev}: {ref_dt:.3f} secs")
+    print(f"current: {dt:.3f} secs, speedup {ref_dt / dt:.2f}x")
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    main(sys.argv[1])
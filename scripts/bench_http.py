@@ -0,0 +1,87 @@
+# %%
+"""
+Benchmark HttpApiUtil against a local stub server.
+
+Usage: python -m scripts.bench_http [requests=200] [latency_ms=50]
+
+Compares Worker threads calling `api_model` with the batch `api_models`.
+Both use a fresh cache, so every request hits the stub server.
+"""
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from src.utils import HttpApiUtil, Worker
+
+
+class _Item(BaseModel):
+    id: int
+    name: str
+
+
+def start_stub_server(latency: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            time.sleep(latency)
+            item_id = self.path.rstrip("/").split("/")[-1]
+            body = f'{{"id":{item_id},"name":"item {item_id}"}}'.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def new_api(server: ThreadingHTTPServer, folder: str, name: str) -> HttpApiUtil:
+    host, port = server.server_address[:2]
+    return HttpApiUtil(
+        api_server=f"http://{host}:{port}",
+        rate_calls=100,
+        rate_period=1,
+        db_path=str(Path(folder) / name),
+    )
+
+
+def main(count: int, latency: float):
+    server = start_stub_server(latency)
+    urls = [f"/item/{i}" for i in range(count)]
+    with tempfile.TemporaryDirectory() as folder:
+        api = new_api(server, folder, "worker")
+        t0 = time.perf_counter()
+        worker = Worker("bench_http")
+        for url in urls:
+            worker.add(api.api_model, url, _Item)
+        worker.wait(show_progress=False)
+        dt_worker = time.perf_counter() - t0
+
+        api = new_api(server, folder, "batch")
+        t0 = time.perf_counter()
+        items = api.api_models(urls, _Item)
+        dt_batch = time.perf_counter() - t0
+        assert [x.id for x in items if x] == list(range(count))
+    server.shutdown()
+    print(f"{count} requests, {latency * 1000:.0f}ms latency, 100 calls/s")
+    print(f"Worker + api_model: {dt_worker:.3f} secs")
+    print(f"api_models:         {dt_batch:.3f} secs")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(
+        int(args[0]) if args else 200,
+        (float(args[1]) if len(args) > 1 else 50) / 1000,
+    )
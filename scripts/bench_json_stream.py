@@ -0,0 +1,84 @@
+# %%
+"""
+Compare peak RSS of loading atlas export files whole and streamed.
+
+Usage: python -m scripts.bench_json_stream [region=JP] [export names...]
+
+Every loader runs in a fresh process, so ru_maxrss is the peak of that loader:
+- json: load_json + parse_json_obj_as, like load_master_data did
+- file: parse_json_file_as, like _WikiTemp._load_svts did
+- stream: iter_json_file_as, validating one array element at a time
+"""
+import resource
+import subprocess
+import sys
+import time
+
+from app.schemas.common import Region
+from app.schemas.nice import NiceEquip, NiceItem, NiceServant, NiceWar
+
+from src.config import settings
+from src.utils.helper import (
+    iter_json_file_as,
+    load_json,
+    parse_json_file_as,
+    parse_json_obj_as,
+)
+
+
+EXPORT_MODELS = {
+    "nice_servant_lore": NiceServant,
+    "nice_equip_lore": NiceEquip,
+    "nice_war": NiceWar,
+    "nice_item": NiceItem,
+}
+MODES = ("json", "file", "stream")
+
+
+def _peak_rss_mb() -> float:
+    # kilobytes on linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def run_one(mode: str, name: str, region: str):
+    model = EXPORT_MODELS[name]
+    fp = settings.atlas_export_dir / region / f"{name}.json"
+    base = _peak_rss_mb()
+    t0 = time.perf_counter()
+    if mode == "json":
+        items = parse_json_obj_as(list[model], load_json(fp))
+    elif mode == "file":
+        items = parse_json_file_as(list[model], fp)
+    else:
+        items = list(iter_json_file_as(model, fp))
+    dt = time.perf_counter() - t0
+    print(f"{len(items)} {dt:.3f} {base:.1f} {_peak_rss_mb():.1f}")
+
+
+def main(region: str, names: list[str]):
+    for name in names:
+        fp = settings.atlas_export_dir / region / f"{name}.json"
+        print(f"{fp}: {fp.stat().st_size / 1024 / 1024:.1f} MB")
+        for mode in MODES:
+            output = subprocess.check_output(
+                [sys.executable, "-m", "scripts.bench_json_stream"]
+                + ["--run", mode, name, region],
+                text=True,
+            )
+            count, dt, base, peak = output.split()[-4:]
+            print(
+                f"  {mode:<6s}: {count} items, {float(dt):.3f} secs, "
+                f"peak RSS {float(peak):.1f} MB (+{float(peak) - float(base):.1f} MB)"
+            )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if args[:1] == ["--run"]:
+        run_one(*args[1:4])
+    else:
+        main(
+            Region(args[0]).value if args else Region.JP.value,
+            args[1:] or list(EXPORT_MODELS),
+        )
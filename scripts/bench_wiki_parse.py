@@ -0,0 +1,63 @@
+# %%
+"""
+Time parse_pages on cached Mooncell servant pages, serial vs a PagePool.
+
+Usage: python -m scripts.bench_wiki_parse [processes=0] [max_pages=0]
+
+Params memos are not used, so both runs parse every page. The pool run includes
+spawning the workers, the second pool run shows the cost once they are warm as
+for the later `parse_pages` calls of WikiParser. Results must be equal.
+"""
+import sys
+import time
+
+from src.parsers.wiki.pages import PagePool, parse_mc_svt, parse_pages
+from src.wiki import MOONCELL
+
+
+class _NoMemo:
+    """Page texts of a WikiTool without its params memo"""
+
+    def __init__(self, wiki):
+        self.wiki = wiki
+
+    def get_page_text(self, name: str) -> str:
+        return self.wiki.get_page_text(name)
+
+    def get_params_memo(self, name: str, text: str) -> dict:
+        return {}
+
+    def set_params_memo(self, name: str, text: str, matches: str, values: list):
+        pass
+
+
+def main(processes: int, max_pages: int):
+    MOONCELL.load()
+    keys = [key for key in MOONCELL.cache.pages.keys() if "/" not in key]
+    if max_pages > 0:
+        keys = keys[:max_pages]
+    names = [(key,) for key in keys]
+    wiki = _NoMemo(MOONCELL)
+
+    t0 = time.perf_counter()
+    serial = parse_pages(parse_mc_svt, wiki, names, None, "serial")  # type: ignore
+    serial_dt = time.perf_counter() - t0
+    with PagePool(processes) as pool:
+        t0 = time.perf_counter()
+        cold = parse_pages(parse_mc_svt, wiki, names, pool, "cold")  # type: ignore
+        cold_dt = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        warm = parse_pages(parse_mc_svt, wiki, names, pool, "warm")  # type: ignore
+        warm_dt = time.perf_counter() - t0
+    assert serial == cold == warm
+    print(f"{len(names)} pages, {pool.processes} processes")
+    print(f"serial: {serial_dt:.2f} secs")
+    print(f"pool, spawning: {cold_dt:.2f} secs, speedup {serial_dt / cold_dt:.2f}x")
+    print(f"pool, warm: {warm_dt:.2f} secs, speedup {serial_dt / warm_dt:.2f}x")
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 0,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 0,
+    )
@@ -0,0 +1,183 @@
+# %%
+"""
+Check fail-fast and retry semantics against a local stub server returning errors.
+
+Usage: python -m scripts.check_fail_fast [requests=500]
+
+- Worker: a flaky server is retried until success, 404 is not retried, a down
+  server cancels the pending tasks once the error budget is exceeded.
+- api_models: a down server raises ErrorBudgetExceeded after a few requests
+  instead of retrying every url.
+- export downloads: a cut json body is retried instead of failing the run.
+
+Run by the workflows before parsing, exits non-zero on failure.
+"""
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+from src.parsers.core.aa_export import _download_export, _DownloadStats
+from src.utils import Worker
+from src.utils.worker import ErrorBudget, ErrorBudgetExceeded
+
+from .bench_http import _Item, new_api
+
+
+class _Stub:
+    def __init__(self, fail_first: int | None, status: int = 503, cut: bool = False):
+        """Fail the first n requests of every path, None to always fail.
+
+        Failed requests get `status`, or a cut json body with 200 if `cut`.
+        """
+        self.fail_first = fail_first
+        self.status = status
+        self.cut = cut
+        self.hits: dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.server = self._start()
+
+    @property
+    def total_hits(self) -> int:
+        return sum(self.hits.values())
+
+    def _start(self) -> ThreadingHTTPServer:
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with stub.lock:
+                    n = stub.hits[self.path] = stub.hits.get(self.path, 0) + 1
+                time.sleep(0.01)
+                item_id = self.path.rstrip("/").split("/")[-1]
+                body = f'{{"id":{item_id},"name":"item {item_id}"}}'.encode()
+                status = 200
+                if stub.fail_first is None or n <= stub.fail_first:
+                    if stub.cut:
+                        # no Content-Length, the body ends when the connection closes
+                        self.send_response(200)
+                        self.send_header("Connection", "close")
+                        self.end_headers()
+                        self.wfile.write(body[: len(body) // 2])
+                        self.close_connection = True
+                        return
+                    status, body = stub.status, b"Error"
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def url(self, path: str) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{path}"
+
+
+def _fetch(url: str):
+    resp = requests.get(url, timeout=5)
+    resp.raise_for_status()
+
+
+def check_worker_retry(count: int):
+    stub = _Stub(fail_first=1)
+    worker = Worker("flaky", pool="network", retries=2, retry_delay=0.05)
+    for i in range(count):
+        worker.add(_fetch, stub.url(f"/item/{i}"))
+    worker.wait(show_progress=False)
+    stub.server.shutdown()
+    assert stub.total_hits == count * 2, stub.total_hits
+    print(f"worker retry: {count} tasks, {stub.total_hits} requests")
+
+
+def check_worker_no_retry(count: int):
+    stub = _Stub(fail_first=None, status=404)
+    worker = Worker("not_found", pool="network", retries=2, retry_delay=0.05)
+    for i in range(count):
+        worker.add(_fetch, stub.url(f"/item/{i}"))
+    try:
+        worker.wait(show_progress=False)
+        raise AssertionError("404 errors not raised")
+    except RuntimeError as e:
+        print(f"worker no retry: {e}")
+    stub.server.shutdown()
+    assert stub.total_hits == count, stub.total_hits
+
+
+def check_worker_fail_fast(count: int):
+    stub = _Stub(fail_first=None)
+    worker = Worker("down", pool="network", max_in_flight=8, max_errors=10)
+    t0 = time.perf_counter()
+    try:
+        # raised by `add` once enough tasks failed, or by `wait`
+        for i in range(count):
+            worker.add(_fetch, stub.url(f"/item/{i}"))
+        worker.wait(show_progress=False)
+        raise AssertionError("ErrorBudgetExceeded not raised")
+    except ErrorBudgetExceeded as e:
+        print(f"worker fail fast: {e}")
+    dt = time.perf_counter() - t0
+    stub.server.shutdown()
+    assert stub.total_hits < count, stub.total_hits
+    print(f"  {stub.total_hits}/{count} requests sent, {dt:.3f} secs")
+
+
+def check_api_models_fail_fast(count: int):
+    stub = _Stub(fail_first=None)
+    with tempfile.TemporaryDirectory() as folder:
+        api = new_api(stub.server, folder, "down")
+        t0 = time.perf_counter()
+        try:
+            api.api_models(
+                [f"/item/{i}" for i in range(count)],
+                _Item,
+                error_budget=ErrorBudget(max_errors=10),
+            )
+            raise AssertionError("ErrorBudgetExceeded not raised")
+        except ErrorBudgetExceeded as e:
+            print(f"api_models fail fast: {e}")
+        dt = time.perf_counter() - t0
+    stub.server.shutdown()
+    assert stub.total_hits < count, stub.total_hits
+    print(f"  {stub.total_hits}/{count} requests sent, {dt:.3f} secs")
+
+
+def check_export_retry(count: int):
+    stub = _Stub(fail_first=1, cut=True)
+    # same settings as update_exported_files
+    worker = Worker(
+        "exports", pool="network", retries=2, retry_delay=0.05, max_error_rate=0.5
+    )
+    stats = _DownloadStats()
+    with tempfile.TemporaryDirectory() as folder, requests.Session() as session:
+        for i in range(count):
+            fp = Path(folder) / f"{i}.json"
+            worker.add(_download_export, session, stub.url(f"/item/{i}"), fp, {}, stats)
+        worker.wait(show_progress=False)
+    stub.server.shutdown()
+    assert stub.total_hits == count * 2, stub.total_hits
+    assert stats.files == count, stats.files
+    print(f"export retry: {count} files, {stub.total_hits} requests")
+
+
+def main(count: int):
+    check_worker_retry(min(count, 100))
+    check_worker_no_retry(min(count, 100))
+    check_worker_fail_fast(count)
+    check_api_models_fail_fast(count)
+    check_export_retry(min(count, 20))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,53 @@
+# %%
+"""
+Compare the trigger skills and tds of projected and fully loaded master data.
+
+Usage: python -m scripts.check_projection [region=NA]
+
+The exported files of the region must be downloaded already. Projected master
+data is used for the mappings of other regions, a field needed by trigger
+collection but pruned by `prune_export` drops trigger skills silently.
+"""
+import sys
+import time
+
+from app.schemas.common import Region
+
+from src.parsers.core.export_store import EXPORTS
+from src.parsers.main_parser import MainParser
+from src.schemas.gamedata import MasterData
+
+
+def load(region: Region, projection: bool) -> tuple[MasterData, float]:
+    parser = MainParser()
+    parser.payload.cache_master_data = False
+    # a full entry would serve the projection as well
+    EXPORTS.clear(region)
+    t0 = time.perf_counter()
+    data = parser.load_master_data(region, projection=projection)
+    return data, time.perf_counter() - t0
+
+
+def _diff(name: str, full: set[int], projected: set[int]) -> bool:
+    missing, extra = full - projected, projected - full
+    print(f"{name}: {len(full)} full, {len(projected)} projected")
+    if missing:
+        print(f"  missing in projection: {sorted(missing)}")
+    if extra:
+        print(f"  extra in projection: {sorted(extra)}")
+    return bool(missing or extra)
+
+
+def main(region: Region):
+    assert region != Region.JP, "JP is never projected"
+    projected, projected_dt = load(region, True)
+    full, full_dt = load(region, False)
+    failed = _diff("trigger skills", set(full.base_skills), set(projected.base_skills))
+    failed |= _diff("trigger tds", set(full.base_tds), set(projected.base_tds))
+    print(f"full: {full_dt:.2f} secs, projected: {projected_dt:.2f} secs")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(Region(sys.argv[1]) if len(sys.argv) > 1 else Region.NA)
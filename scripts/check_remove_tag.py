@@ -0,0 +1,74 @@
+# %%
+"""
+Compare remove_tag with the one of an older revision on cached wiki pages.
+
+Usage: python -m scripts.check_remove_tag <git_rev> [max_pages=0]
+
+git_rev: a revision before the change to compare, e.g. the parent of the commit
+which changed remove_tag.
+
+Every template param of every cached Mooncell and Fandom page is cleaned with
+all tags by both implementations, the outputs must be equal.
+"""
+import importlib.util
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from src.wiki import FANDOM, MOONCELL, template
+from src.wiki.template import kAllTags, parse_template_list, remove_tag
+
+
+def load_ref_remove_tag(rev: str):
+    source = subprocess.check_output(["git", "show", f"{rev}:src/wiki/template.py"])
+    if source == Path(template.__file__).read_bytes():
+        raise ValueError(f"template.py of {rev} is the same as the current one")
+    spec = importlib.util.spec_from_loader("src.wiki._template_ref", loader=None)
+    assert spec
+    module = importlib.util.module_from_spec(spec)
+    module.__package__ = "src.wiki"
+    exec(compile(source, f"template.py@{rev}", "exec"), module.__dict__)
+    return module.remove_tag
+
+
+def collect_values(max_pages: int) -> list[str]:
+    values: list[str] = []
+    for wiki in (MOONCELL, FANDOM):
+        keys = list(wiki.cache.pages.keys())
+        if max_pages > 0:
+            keys = keys[:max_pages]
+        for key in keys:
+            for params in parse_template_list(wiki.get_page_text(key)):
+                values.extend(v for v in params.values() if isinstance(v, str))
+    return values
+
+
+def main(rev: str, max_pages: int):
+    ref_remove_tag = load_ref_remove_tag(rev)
+    values = collect_values(max_pages)
+    t0 = time.perf_counter()
+    ref_results = [ref_remove_tag(v, kAllTags) for v in values]
+    ref_dt = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    results = [remove_tag(v, kAllTags) for v in values]
+    dt = time.perf_counter() - t0
+
+    mismatched = [
+        (value, old, new)
+        for value, old, new in zip(values, ref_results, results)
+        if old != new
+    ]
+    for value, old, new in mismatched[:50]:
+        print(f"{value!r}\n  {rev}: {old!r}\n  current: {new!r}")
+    print(f"{len(values)} values, {len(mismatched)} mismatched")
+    print(f"{rev}: {ref_dt:.3f} secs")
+    print(f"current: {dt:.3f} secs, speedup {ref_dt / dt:.2f}x")
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        sys.exit(__doc__)
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 0)
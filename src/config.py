@@ -66,6 +66,14 @@ class Settings(BaseSettings):
     def cache_wiki(self) -> Path:
         return Path(self.cache_dir) / "wiki"
 
+    @property
+    def cache_dist(self) -> Path:
+        return Path(self.cache_dir) / "dist"
+
+    @property
+    def cache_master_data(self) -> Path:
+        return Path(self.cache_dir) / "master_data"
+
     @property
     def commit_msg(self) -> Path:
         return Path(self.output_dir) / "commit-msg.txt"
@@ -83,15 +91,26 @@ class PayloadSetting(BaseSettings):
     run_wiki_parser: bool | None = None
     run_atlas_parser: bool | None = None
     force_update_export: bool = False
+    incremental_dist: bool = False  # reuse dist files whose inputs are unchanged
+    cache_master_data: bool = True  # pickle validated MasterData of each region
+    # load CN/NA/TW/KR in spawned processes. Off by default, no benchmark shows a
+    # gain: with master data snapshots loading is mostly unpickling, which has to
+    # pay for spawning and importing the parsers, api misses share the Atlas rate
+    # limit and all processes write to the same sqlite http cache.
+    concurrent_mapping_load: bool = False
     enable_wiki_threading: bool = False
+    wiki_parse_processes: int = 0  # parse wiki pages in processes, 0=cpu count, 1=off
     clear_cache_http: bool = False
+    sweep_cache_http: bool = True  # delete expired http cache before parsing
     clear_cache_wiki: bool = False
     clear_cache_mc: bool = False
     clear_cache_fandom: bool = False
     clear_wiki_changed: float | None = None  # -101: clear all image caches
     clear_wiki_moved: float | None = None
     clear_wiki_deleted: float | None = None
+    clear_wiki_by_revid: bool = False  # compare revids instead of recent changes
     clear_wiki_empty: bool = False
+    wiki_checkpoint_every: int = 200  # save wiki cache every N changes, 0=at the end
     skip_mapping: bool = False
     skip_quests: bool = False
     use_prev_drops: bool = True
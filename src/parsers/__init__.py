@@ -1,12 +1,38 @@
-from .domus_aurea import run_drop_rate_update
-from .main_parser import MainParser
-from .update_mapping import run_mapping_update
-from .wiki_parser import WikiParser
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from .domus_aurea import run_drop_rate_update
+    from .main_parser import MainParser
+    from .update_mapping import run_mapping_update
+    from .wiki_parser import WikiParser
+
+
+# imported on first access, spawned workers of `wiki.pages` only import what
+# they need instead of every parser
+_LAZY_NAMES = {
+    "run_drop_rate_update": ".domus_aurea",
+    "MainParser": ".main_parser",
+    "run_mapping_update": ".update_mapping",
+    "WikiParser": ".wiki_parser",
+}
+
+
+def __getattr__(name: str):
+    module = _LAZY_NAMES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(import_module(module, __name__), name)
 
 
 def run_main_parser():
+    from .main_parser import MainParser
+
     MainParser().start()
 
 
 def run_wiki_parser():
+    from .wiki_parser import WikiParser
+
     WikiParser().start()
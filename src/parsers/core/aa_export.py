@@ -1,60 +1,297 @@
+import threading
+import time
 from pathlib import Path
+from typing import NamedTuple
 
+import orjson
 import requests
+import requests.adapters
 from app.schemas.common import Region
+from urllib3.util import make_headers
 
 from ...config import settings
 from ...schemas.common import AtlasExportFile, OpenApiInfo
 from ...utils import AtlasApi
-from ...utils.helper import dump_json, load_json, parse_json_obj_as
+from ...utils.helper import dump_json, iter_json_array, load_json, parse_json_obj_as
 from ...utils.log import logger
 from ...utils.url import DownUrl
-from ...utils.worker import Worker
+from ...utils.worker import ErrorBudgetExceeded, Worker
 
 
-def update_exported_files(regions: list[Region], force_update: bool):
-    if not regions:
-        regions = [r for r in Region]
+# gzip/deflate, and br/zstd if their decoders are installed
+_ACCEPT_ENCODING = make_headers(accept_encoding=True)["accept-encoding"]
+
+
+class _DownloadStats:
+    def __init__(self):
+        self.files = 0
+        self.downloaded = 0  # bytes written
+        self.transferred = 0  # bytes received, compressed
+        self.saved = 0  # bytes of unchanged files, not downloaded
+        self.not_modified = 0
+        self.busy = 0.0  # sum of download secs
+        self.started: float | None = None
+        self.finished: float | None = None
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        t0: float,
+        downloaded: int = 0,
+        transferred: int = 0,
+        saved: int = 0,
+    ):
+        t1 = time.monotonic()
+        with self._lock:
+            self.files += 1
+            self.downloaded += downloaded
+            self.transferred += transferred
+            self.saved += saved
+            if saved:
+                self.not_modified += 1
+            self.busy += t1 - t0
+            self.started = t0 if self.started is None else min(self.started, t0)
+            self.finished = t1 if self.finished is None else max(self.finished, t1)
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0
+        return self.finished - self.started
+
+
+class _ExportDownload(NamedTuple):
+    region: Region
+    file: AtlasExportFile
+    url: str
+    fp: Path
+    force: bool
+
+
+class IncompleteDownload(requests.RequestException):
+    """The body is shorter than Content-Length or not complete json"""
+
+
+def _new_session(max_per_host: int) -> requests.Session:
+    """Keep-alive connections, at most `max_per_host` to every host"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_per_host, pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _check_json(fp: Path):
+    """Raise ValueError if fp is not a complete json file"""
+    with fp.open("rb") as f:
+        head = f.read(64).lstrip()
+    if head.startswith(b"["):
+        for _ in iter_json_array(fp):
+            pass
+    else:
+        orjson.loads(fp.read_bytes())
+
+
+def _download_export(
+    session: requests.Session,
+    url: str,
+    fp: Path,
+    validators: dict[str, dict],
+    stats: _DownloadStats,
+    force: bool = False,
+):
+    """Conditional GET with the saved ETag/Last-Modified of fp, 304 keeps fp.
+
+    `force` always downloads the body, fp may be damaged with the same size.
 
-    def _add_download_task(_url, _fp):
-        resp = requests.get(_url, headers={"cache-control": "no-cache"})
+    The body is streamed to a temp file, checked and then replaces fp, so an
+    interrupted download never leaves a truncated export file.
+    """
+    t0 = time.monotonic()
+    headers = {"cache-control": "no-cache", "Accept-Encoding": _ACCEPT_ENCODING}
+    validator = validators.get(fp.name)
+    # the local file may be modified or broken, then download it again
+    if (
+        not force
+        and validator
+        and fp.exists()
+        and fp.stat().st_size == validator.get("size")
+    ):
+        if validator.get("etag"):
+            headers["If-None-Match"] = validator["etag"]
+        if validator.get("lastModified"):
+            headers["If-Modified-Since"] = validator["lastModified"]
+    with session.get(url, headers=headers, stream=True, timeout=60) as resp:
+        if resp.status_code == 304:
+            stats.add(t0, saved=fp.stat().st_size)
+            logger.debug(f"{fp}: not modified")
+            return
         resp.raise_for_status()
-        Path(_fp).write_bytes(resp.content)
-        logger.info(f"{_fp}: update exported file from {_url}")
+        tmp_fp = fp.with_name(fp.name + ".tmp")
+        size = 0
+        try:
+            with tmp_fp.open("wb") as f:
+                for chunk in resp.iter_content(chunk_size=1 << 20):
+                    f.write(chunk)
+                    size += len(chunk)
+            # Content-Length is the size before decoding
+            transferred = resp.raw.tell()
+            declared = resp.headers.get("Content-Length")
+            if declared is not None:
+                if int(declared) != transferred:
+                    raise IncompleteDownload(
+                        f"{url}: incomplete, {transferred}/{declared} bytes"
+                    )
+            else:
+                try:
+                    _check_json(tmp_fp)
+                except ValueError as e:
+                    raise IncompleteDownload(f"{url}: incomplete json, {e}") from e
+            tmp_fp.replace(fp)
+        finally:
+            tmp_fp.unlink(missing_ok=True)
+        validators[fp.name] = {
+            "etag": resp.headers.get("ETag"),
+            "lastModified": resp.headers.get("Last-Modified"),
+            "size": size,
+        }
+    stats.add(t0, downloaded=size, transferred=transferred)
+    logger.info(f"{fp}: update exported file from {url}")
+
 
+def update_exported_files(
+    regions: list[Region],
+    force_update: bool,
+    max_downloads: int = 8,
+    max_per_host: int = 6,
+):
+    """
+    All files of all regions are planned up front and downloaded by one worker.
+
+    :param max_downloads: concurrent downloads of all regions
+    :param max_per_host: connections to the same host
+    """
+    if not regions:
+        regions = [r for r in Region]
+    all_regions = list(Region.__members__.values())
     fp_openapi = settings.atlas_export_dir / "openapi.json"
 
-    openapi_remote = requests.get(AtlasApi.full_url("openapi.json")).json()
-    openapi_local = load_json(fp_openapi)
+    # openapi.json and info.json of all regions
+    openapi_remote: dict = {}
+    region_infos: dict[Region, dict] = {}
+
+    def _fetch_openapi():
+        openapi_remote.update(requests.get(AtlasApi.full_url("openapi.json")).json())
+
+    def _fetch_info(region: Region):
+        region_infos[region] = DownUrl.export("info.json", region)
 
+    worker = Worker("export_infos", fake_mode=False, pool="network")
+    worker.add(_fetch_openapi)
+    for region in all_regions:
+        worker.add(_fetch_info, region)
+    worker.wait(show_progress=False)
+
+    openapi_local = load_json(fp_openapi)
     api_changed = not openapi_local or parse_json_obj_as(
         OpenApiInfo, openapi_remote["info"]
     ) != parse_json_obj_as(OpenApiInfo, openapi_local["info"])
     if api_changed:
         logger.info(f"API changed:\n{dict(openapi_remote['info'], description='')}")
 
-    for region in Region.__members__.values():
-        worker = Worker(f"exported_file_{region}", fake_mode=False)
-        fp_info = settings.atlas_export_dir / region.value / "info.json"
-        info_local = load_json(fp_info) or {}
-        info_remote = DownUrl.export("info.json", region)
-        region_changed = (
-            region in regions and force_update
-        ) or info_local != info_remote
-
+    plan: list[_ExportDownload] = []
+    for region in all_regions:
+        info_local = load_json(settings.atlas_export_dir / region.value / "info.json")
+        force = region in regions and force_update
+        region_changed = force or (info_local or {}) != region_infos[region]
         for f in AtlasExportFile.__members__.values():
             fp_export = f.cache_path(region)
-            fp_export.parent.mkdir(parents=True, exist_ok=True)
             if api_changed or region_changed or not fp_export.exists():
-                if region not in regions:
-                    regions.append(region)
                 url = f.resolve_link(region)
-                worker.add(_add_download_task, url, fp_export)
-            else:
-                # logger.info(f'{fp_export}: already updated')
-                pass
+                plan.append(_ExportDownload(region, f, url, fp_export, force))
+    logger.info(
+        f"exported files to check: {len(plan)}, "
+        f"{len({task.region for task in plan})} regions"
+    )
+
+    region_validators: dict[Region, dict[str, dict]] = {}
+    region_stats = {region: _DownloadStats() for region in all_regions}
+    for region in all_regions:
+        (settings.atlas_export_dir / region.value).mkdir(parents=True, exist_ok=True)
+        region_validators[region] = (
+            load_json(settings.atlas_export_dir / region.value / "validators.json")
+            or {}
+        )
+    session = _new_session(max_per_host)
+    # a failed file only skips info.json of its region, a down server fails fast
+    worker = Worker(
+        "exported_files",
+        fake_mode=False,
+        pool="network",
+        max_in_flight=max_downloads,
+        retries=2,
+        max_error_rate=0.5,
+    )
+    # files failed in their last attempt, retries run the same task again
+    failed: set[_ExportDownload] = set()
+
+    def _download(task: _ExportDownload):
+        try:
+            _download_export(
+                session,
+                task.url,
+                task.fp,
+                region_validators[task.region],
+                region_stats[task.region],
+                task.force,
+            )
+        except BaseException:
+            failed.add(task)
+            raise
+        failed.discard(task)
+
+    t0 = time.monotonic()
+    try:
+        # interleave regions, so that they finish at about the same time
+        plan.sort(key=lambda task: list(AtlasExportFile).index(task.file))
+        for task in plan:
+            worker.add(_download, task)
         worker.wait()
-        dump_json(info_remote, fp_info)
+    except RuntimeError as e:
+        # errors of single files are logged by the worker already
+        if isinstance(e, ErrorBudgetExceeded) or not failed:
+            raise
+    finally:
+        session.close()
+        for region, validators in region_validators.items():
+            dump_json(
+                validators, settings.atlas_export_dir / region.value / "validators.json"
+            )
+
+    failed_regions = {task.region for task in failed}
+    for region in all_regions:
+        stats = region_stats[region]
+        if region in failed_regions:
+            files = sorted(task.file.value for task in failed if task.region == region)
+            logger.error(
+                f"[{region}] exported files failed: {files}, info.json not updated"
+            )
+            continue
+        # unchanged files (304) don't need to be parsed again
+        if stats.downloaded and region not in regions:
+            regions.append(region)
+        if stats.files:
+            logger.info(
+                f"[{region}] exported files: {stats.files} files in "
+                f"{stats.elapsed:.1f}s (busy {stats.busy:.1f}s), "
+                f"{stats.downloaded / 1024 / 1024:.1f}MB downloaded "
+                f"({stats.transferred / 1024 / 1024:.1f}MB transferred), "
+                f"{stats.not_modified} not modified, "
+                f"{stats.saved / 1024 / 1024:.1f}MB saved"
+            )
+        info_remote = region_infos[region]
+        dump_json(info_remote, settings.atlas_export_dir / region.value / "info.json")
         logger.debug(f"Exported files updated:\n{info_remote}")
+    logger.info(f"exported files updated in {time.monotonic() - t0:.1f}s")
     dump_json(openapi_remote, fp_openapi)
     return regions
@@ -0,0 +1,115 @@
+"""
+Fingerprints of dist files, used by incremental builds.
+
+A fingerprint covers everything that goes into a dist file: the object to be
+encoded, its key/filename, the encoder state (including the registered base
+tds) and the code producing the bytes: `dump.py`, the custom encoders and
+`_replace_dw_chars` of `main_parser.py`, `dump_json`/`beautify_json` of
+`helper.py`, the schemas of fgo-game-data-api and the versions of pydantic and
+orjson. If the fingerprint of a file equals the one saved by the previous build
+and the file still has the hash of the previous FileVersion, the previous bytes
+and FileVersion are reused.
+"""
+
+import hashlib
+from pathlib import Path
+from typing import Any
+
+import orjson
+from pydantic import BaseModel
+
+from ...config import settings
+from ...schemas.common import DataVersion, FileVersion
+from ...schemas.data import MIN_APP
+from ...utils import helper
+from ...utils.helper import dump_json, load_json, pydantic_encoder
+from ...utils.log import logger
+from . import dump
+from .master_cache import get_schema_hash
+
+
+# sources of the dist bytes, main_parser imports this module
+_SOURCES = (
+    Path(dump.__file__),
+    Path(__file__).parents[1] / "main_parser.py",
+    Path(helper.__file__),
+)
+
+
+def _get_salt() -> bytes:
+    h = hashlib.md5(f"{MIN_APP},{orjson.__version__}".encode())
+    # app schemas, local schemas, pydantic and python version
+    h.update(get_schema_hash().encode())
+    for fp in _SOURCES:
+        h.update(fp.read_bytes())
+    return h.digest()
+
+
+def _fingerprint_default(obj):
+    if isinstance(obj, BaseModel):
+        # orjson walks the field values itself, much cheaper than model_dump
+        return [obj.__class__.__name__, obj.__dict__, obj.__pydantic_extra__]
+    return pydantic_encoder(obj)
+
+
+class DistFingerprints:
+    def __init__(self, enabled: bool, fp: Path | None = None) -> None:
+        self.enabled = enabled
+        self.fp = fp or settings.cache_dist / "fingerprints.json"
+        # extra inputs which are not part of the dumped object
+        self.context: dict[str, Any] = {}
+        self._prev: dict[str, str] = {}
+        self._cur: dict[str, str] = {}
+        self._salt = _get_salt() if enabled else b""
+        self.reused = 0
+
+    def load(self):
+        self._cur.clear()
+        self.reused = 0
+        self._prev = (load_json(self.fp) or {}) if self.enabled else {}
+
+    def compute(self, obj, key: str, filename: str, encoder_state: str) -> str:
+        h = hashlib.md5(self._salt)
+        h.update(
+            orjson.dumps(
+                [key, filename, encoder_state, self.context],
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS,
+            )
+        )
+        h.update(
+            orjson.dumps(
+                obj, default=_fingerprint_default, option=orjson.OPT_NON_STR_KEYS
+            )
+        )
+        return h.hexdigest()
+
+    def reuse(
+        self, filename: str, fingerprint: str, last_version: DataVersion
+    ) -> FileVersion | None:
+        if not self.enabled or self._prev.get(filename) != fingerprint:
+            return None
+        last_fv = last_version.files.get(filename)
+        fp = settings.output_dist.joinpath(filename)
+        if not last_fv or not fp.exists():
+            return None
+        _bytes = fp.read_bytes()
+        if (len(_bytes), hashlib.md5(_bytes).hexdigest()[:6]) != (
+            last_fv.size,
+            last_fv.hash,
+        ):
+            logger.warning(f"[version] {filename} changed since last build")
+            return None
+        return last_fv.model_copy()
+
+    def update(self, filename: str, fingerprint: str, reused: bool = False):
+        self._cur[filename] = fingerprint
+        if reused:
+            self.reused += 1
+
+    def save(self):
+        if not self.enabled:
+            return
+        logger.info(
+            f"[version] incremental build: reused {self.reused}/{len(self._cur)} files"
+        )
+        dump_json(self._cur, self.fp, indent2=False)
@@ -1,5 +1,7 @@
+import hashlib
 from typing import Any
 
+import orjson
 from app.schemas.common import NiceTrait
 from app.schemas.gameenums import (
     PAY_TYPE_NAME,
@@ -57,7 +59,7 @@ from app.schemas.nice import (
 from pydantic import BaseModel
 
 from ...schemas.gamedata import MasterData, NiceBaseSkill, NiceBaseTd, NiceEquipSort
-from ...utils.helper import iter_model, parse_json_obj_as, pydantic_encoder
+from ...utils.helper import parse_json_obj_as, pydantic_encoder
 
 
 PAY_TYPE_NAME_REVERSE: dict[NicePayType, int] = {v: k for k, v in PAY_TYPE_NAME.items()}
@@ -270,6 +272,70 @@ def _clean_dict_empty(d: dict):
             d.pop(k)
 
 
+_PRIMITIVE_TYPES = (str, int, float, bool)
+
+
+class _EncodePlan:
+    """Per-type rules of `DataEncoder.default` which don't depend on instance"""
+
+    def __init__(self, _type: type[BaseModel]) -> None:
+        excludes = {"originalName"}
+        excludes.update(_excluded_fields.get(_type, []))
+        self.excludes = frozenset(excludes)
+        self.empty_fields = tuple(_exclude_empty_fields.get(_type, []))
+        self.defaults: dict[str, Any] = {
+            key: field.get_default(call_default_factory=True)
+            for key, field in _type.model_fields.items()
+        }
+
+        self.bgm_excludes: frozenset[str] | None = None
+        self.item_excludes: frozenset[str] | None = None
+        if _type in (NiceBgm, NiceBgmEntity):
+            self.bgm_excludes = frozenset(
+                (excludes | NiceBgmEntity.model_fields.keys()) - {"id"}
+            )
+        elif _type == NiceItem:
+            self.item_excludes = frozenset(
+                (excludes | NiceItem.model_fields.keys()) - {"id"}
+            )
+
+        self.skill_or_td = issubclass(_type, (NiceSkill, NiceTd))
+        self.is_skill = _type == NiceSkill
+        self.is_td = _type == NiceTd
+        self.dump_func = issubclass(_type, NiceFunction)
+        # the first matched per-instance hook, same order as isinstance checks
+        self.hook: type | None = None
+        if _type == NiceFunction:
+            self.hook = NiceFunction
+        else:
+            for hook in (
+                NiceItemAmount,
+                ExtraAssets,
+                AscensionAdd,
+                NiceVoiceLine,
+                NiceBuff,
+                NiceQuest,
+                BasicServant,
+                NiceServant,
+                NiceShop,
+                NiceGacha,
+            ):
+                if issubclass(_type, hook):
+                    self.hook = hook
+                    break
+        self.dynamic = self.skill_or_td or self.hook is not None
+
+
+_encode_plans: dict[type, _EncodePlan] = {}
+
+
+def _get_plan(_type: type[BaseModel]) -> _EncodePlan:
+    plan = _encode_plans.get(_type)
+    if plan is None:
+        plan = _encode_plans[_type] = _EncodePlan(_type)
+    return plan
+
+
 class DataEncoder:
     def __init__(self, jp_data: MasterData) -> None:
         self.item = False
@@ -277,48 +343,81 @@ class DataEncoder:
         self.basic_svt = False
 
         self.jp_data = jp_data
+        self._base_tds_version: tuple[int, int] | None = None
+        self._base_tds_hash = ""
 
     def default(self, obj):
         if not isinstance(obj, BaseModel):
             return common_pydantic_encoder(obj)
 
-        _type = type(obj)
-        excludes = {"originalName"}
-        type_excludes = _excluded_fields.get(_type, [])
-        excludes.update(type_excludes)
+        plan = _get_plan(type(obj))
+        excludes: set[str] | frozenset[str] = plan.excludes
+        if plan.bgm_excludes and self.bgm:
+            excludes = plan.bgm_excludes
+        elif plan.item_excludes and self.item:
+            excludes = plan.item_excludes
 
-        if _type in (NiceBgm, NiceBgmEntity) and self.bgm:
-            excludes.update(NiceBgmEntity.model_fields.keys())
-            excludes.discard("id")
-        elif _type == NiceItem and self.item:
-            excludes.update(NiceItem.model_fields.keys())
-            excludes.discard("id")
+        if plan.dynamic:
+            excludes = set(excludes)
+            obj = self._apply_hooks(plan, obj, excludes)
+            if not isinstance(obj, BaseModel):
+                return obj
 
-        if isinstance(obj, (NiceSkill, NiceTd)):
+        if plan.dump_func:
+            data = obj.model_dump(
+                exclude_none=True,
+                exclude_defaults=True,
+                exclude=set(excludes),
+            )
+            _trim_func_vals(data)
+        else:
+            defaults = plan.defaults
+            data = {}
+            for key, value in obj:
+                if value is None or key in excludes:
+                    continue
+                if key in defaults and value == defaults[key]:
+                    continue
+                data[key] = value
+        for key, value in data.items():
+            if value.__class__ not in _PRIMITIVE_TYPES:
+                data[key] = self.default(value)
+        for field in plan.empty_fields:
+            if field in data and (data[field] == {} or data[field] == []):
+                data.pop(field)
+        return data
+
+    def _apply_hooks(self, plan: _EncodePlan, obj: BaseModel, excludes: set[str]):
+        """Per-instance rules, return a dict if the model is already encoded"""
+        if plan.skill_or_td:
+            assert isinstance(obj, (NiceSkill, NiceTd))
             excludes.update(_exclude_skill(obj))
-            if _type == NiceSkill and isinstance(obj, NiceSkill):
+            if plan.is_skill and isinstance(obj, NiceSkill):
                 self._save_basic_skill(excludes, obj)
-            elif _type == NiceTd and isinstance(obj, NiceTd):
+            elif plan.is_td and isinstance(obj, NiceTd):
                 self._save_basic_td(excludes, obj)
-        if _type == NiceFunction and isinstance(obj, NiceFunction):
+
+        hook = plan.hook
+        if hook is NiceFunction and isinstance(obj, NiceFunction):
             self._save_basic_func(excludes, obj)
-        elif isinstance(obj, NiceItemAmount):
+        elif hook is NiceItemAmount and isinstance(obj, NiceItemAmount):
             return {"itemId": obj.item.id, "amount": obj.amount}
-        elif isinstance(obj, (ExtraAssets, AscensionAdd)):
-            obj = obj.model_dump(
+        elif hook in (ExtraAssets, AscensionAdd):
+            data = obj.model_dump(
                 exclude_none=True, exclude_defaults=True, exclude=excludes
             )
-            _clean_dict_empty(obj)
-        elif isinstance(obj, NiceVoiceLine):
+            _clean_dict_empty(data)
+            return data
+        elif hook is NiceVoiceLine and isinstance(obj, NiceVoiceLine):
             if not "".join(obj.text):
                 excludes.add("text")
             if not [x for x in obj.form if x != 0]:
                 excludes.add("form")
-        elif isinstance(obj, NiceBuff):
-            for key in type_excludes:
+        elif hook is NiceBuff and isinstance(obj, NiceBuff):
+            for key in _excluded_fields.get(type(obj), []):
                 setattr(obj.script, key, None)
             obj.originalScript.pop("relationOverwrite", None)
-        elif isinstance(obj, NiceQuest):
+        elif hook is NiceQuest and isinstance(obj, NiceQuest):
             if isinstance(obj, NiceQuestPhase):
                 if len(obj.availableEnemyHashes) > 100:
                     hashes = obj.availableEnemyHashes[-100:]
@@ -335,45 +434,97 @@ class DataEncoder:
                             and release.condType == NiceCondType.weekdays
                         )
                     ]
-        elif isinstance(obj, BasicServant):
+        elif hook is BasicServant and isinstance(obj, BasicServant):
             self._save_basic_svt(excludes, obj)
-        elif isinstance(obj, NiceServant):
+        elif hook is NiceServant and isinstance(obj, NiceServant):
             self._trim_nice_svt(obj)
-        elif isinstance(obj, NiceShop):
+        elif hook is NiceShop and isinstance(obj, NiceShop):
             if obj.purchaseType == NicePurchaseType.partsSkill:
                 excludes.discard("detail")
-        elif isinstance(obj, NiceGacha):
+        elif hook is NiceGacha and isinstance(obj, NiceGacha):
             if obj.type == NicePayType.stone:
                 excludes.add("type")
             if isinstance(obj.type, NicePayType):
                 obj.type = PAY_TYPE_NAME_REVERSE[obj.type]
+        return obj
 
-        if isinstance(obj, BaseModel):
-            if isinstance(obj, NiceFunction):
-                data = obj.model_dump(
-                    exclude_none=True,
-                    exclude_defaults=True,
-                    exclude=excludes,
-                )
+    def state_key(self) -> str:
+        return (
+            f"item={self.item},basic_svt={self.basic_svt},bgm={self.bgm},"
+            f"base_tds={self._base_tds_digest()}"
+        )
 
-                _trim_func_vals(data)
-            else:
-                data = dict(
-                    iter_model(
-                        obj,
-                        exclude_none=True,
-                        exclude_defaults=True,
-                        exclude=excludes,
+    def _base_tds_digest(self) -> str:
+        """Encoded tds drop the fields equal to the first registered base td.
+
+        Base skills and functions don't change how later files are encoded.
+        Registered tds are never replaced, so the digest is only recomputed
+        when tds are added.
+        """
+        base_tds = self.jp_data.base_tds
+        version = (id(base_tds), len(base_tds))
+        if self._base_tds_version != version:
+            h = hashlib.md5()
+            for td_id in sorted(base_tds):
+                td = base_tds[td_id]
+                h.update(
+                    orjson.dumps(
+                        [td_id, td.card, td.icon, td.npDistribution],
+                        default=common_pydantic_encoder,
                     )
                 )
-            data = {k: self.default(v) for k, v in data.items()}
-            for field in _exclude_empty_fields.get(_type, []):
-                if field in data and (data[field] == {} or data[field] == []):
-                    data.pop(field)
-            return data
-        elif isinstance(obj, (list, dict)):
-            return obj
-        return common_pydantic_encoder(obj)
+            self._base_tds_version = version
+            self._base_tds_hash = h.hexdigest()
+        return self._base_tds_hash
+
+    def collect_bases(self, obj):
+        """Register base skills/tds/functions like `default` does, without encoding.
+
+        Used when a dist file is reused. The first registered base td decides
+        the excluded fields of later tds, so models are visited in the same
+        order as orjson calls `default`: direct model fields when the parent is
+        encoded, models inside lists/dicts when the encoded dict is serialized.
+        """
+        if isinstance(obj, (list, tuple)):
+            for v in obj:
+                self.collect_bases(v)
+        elif isinstance(obj, dict):
+            for v in obj.values():
+                self.collect_bases(v)
+        elif isinstance(obj, BaseModel):
+            self._collect_serialized(self._collect_model(obj))
+
+    def _collect_model(self, obj: BaseModel) -> list[tuple[bool, Any]]:
+        """Visit like `default`, return what orjson serializes afterwards.
+
+        Items are (True, pending of a direct model field) or (False, list/dict).
+        """
+        plan = _get_plan(type(obj))
+        if plan.is_skill and isinstance(obj, NiceSkill):
+            self._save_basic_skill(set(), obj)
+        elif plan.is_td and isinstance(obj, NiceTd):
+            self._save_basic_td(set(), obj)
+        if plan.hook is NiceFunction and isinstance(obj, NiceFunction):
+            self._save_basic_func(set(), obj)
+        # dumped as plain dicts, nothing is registered inside
+        if plan.dump_func or plan.hook in (NiceItemAmount, ExtraAssets, AscensionAdd):
+            return []
+        pending = []
+        for key, value in obj:
+            if value is None or key in plan.excludes:
+                continue
+            if isinstance(value, BaseModel):
+                pending.append((True, self._collect_model(value)))
+            elif isinstance(value, (list, tuple, dict)):
+                pending.append((False, value))
+        return pending
+
+    def _collect_serialized(self, pending: list[tuple[bool, Any]]):
+        for is_model, value in pending:
+            if is_model:
+                self._collect_serialized(value)
+            else:
+                self.collect_bases(value)
 
     def _save_basic_skill(self, excludes: set[str], skill: NiceSkill):
         if skill.id not in self.jp_data.base_skills:
@@ -0,0 +1,168 @@
+"""
+Validated atlas export files shared by all parsers of one process.
+
+Entries are keyed by region, export file and the json annotation, and are valid
+as long as size and mtime of the file are unchanged. Array exports are streamed
+and validated element by element.
+
+Every caller gets a deep copy, consumers are free to modify the returned models,
+e.g. `load_master_data` patches servants and `DataEncoder` trims them in place.
+Loads of different entries run concurrently, one entry is loaded only once.
+"""
+
+import threading
+import time
+from collections.abc import Iterable
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, TypeVar, get_args, get_origin
+
+from app.schemas.common import Region
+from pydantic import TypeAdapter
+
+from ...schemas.common import AtlasExportFile
+from ...schemas.gamedata import MasterData
+from ...utils.helper import iter_json_array, load_json
+from ...utils.log import logger
+from .projection import prune_export
+
+
+_T = TypeVar("_T")
+# (region, file, annotation, projection)
+_Key = tuple[str, AtlasExportFile, Any, bool]
+
+
+def _file_version(fp: Path) -> tuple[int, int] | None:
+    if not fp.exists():
+        return None
+    stat = fp.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_export_file(fp: Path, annotation, region: Region, projection: bool) -> Any:
+    """Array exports are validated element by element, others are loaded whole"""
+    if get_origin(annotation) is not list:
+        value = load_json(fp)
+        if value is None:
+            return None
+        if projection:
+            prune_export(value, annotation, region)
+        return TypeAdapter(annotation).validate_python(value)
+    item_type = get_args(annotation)[0]
+    adapter = TypeAdapter(item_type)
+    items = []
+    for obj in iter_json_array(fp):
+        if projection:
+            prune_export(obj, item_type, region)
+        items.append(adapter.validate_python(obj))
+    return items
+
+
+class ExportStore:
+    def __init__(self):
+        # key -> (file version, value)
+        self._entries: dict[_Key, tuple] = {}
+        # guards `_entries`, `_key_locks` and the stats, never held while loading
+        self._lock = threading.Lock()
+        self._key_locks: dict[_Key, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def annotation_of(file: AtlasExportFile):
+        field = MasterData.model_fields.get(file.value)
+        if field is None:
+            raise KeyError(f"{file} is not a MasterData field, annotation required")
+        return field.annotation
+
+    def _key_lock(self, key: _Key) -> threading.Lock:
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _lookup(self, keys: Iterable[_Key], version) -> tuple[bool, Any]:
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] == version:
+                    self.hits += 1
+                    return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def get(
+        self,
+        region: Region,
+        file: AtlasExportFile,
+        annotation=None,
+        projection: bool = False,  # pruned by `prune_export` if not loaded fully
+    ) -> Any:
+        """Validated value of the export file, None if the file doesn't exist"""
+        if annotation is None:
+            annotation = self.annotation_of(file)
+        version = _file_version(file.cache_path(region))
+        if version is None:
+            return None
+        full_key = (region.value, file, annotation, False)
+        key = (region.value, file, annotation, projection)
+        with self._key_lock(key):
+            # a full entry serves projections as well
+            found, value = self._lookup(dict.fromkeys((full_key, key)), version)
+            if not found:
+                t0 = time.perf_counter()
+                value = load_export_file(
+                    file.cache_path(region), annotation, region, projection
+                )
+                with self._lock:
+                    self._entries[key] = (version, value)
+                logger.debug(
+                    f"ExportStore: loaded [{region}] {file.value} in {time.perf_counter() - t0:.2f}s"
+                )
+        # stored values are never handed out, so copying needs no lock
+        return deepcopy(value)
+
+    def get_list(
+        self, region: Region, file: AtlasExportFile, model: type[_T]
+    ) -> list[_T]:
+        return self.get(region, file, list[model]) or []
+
+    def put(
+        self,
+        region: Region,
+        file: AtlasExportFile,
+        value: Any,
+        annotation=None,
+        projection: bool = False,
+    ):
+        """Add a value validated elsewhere, e.g. from a master data snapshot"""
+        if annotation is None:
+            annotation = self.annotation_of(file)
+        version = _file_version(file.cache_path(region))
+        if version is None:
+            return
+        # the caller may keep modifying its value
+        value = deepcopy(value)
+        with self._lock:
+            self._entries[(region.value, file, annotation, projection)] = (
+                version,
+                value,
+            )
+
+    def clear(self, region: Region | None = None):
+        with self._lock:
+            if region is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == region.value]:
+                    self._entries.pop(key)
+
+    def log_stats(self):
+        logger.info(
+            f"ExportStore: {self.hits} hits, {self.misses} misses, "
+            f"{len(self._entries)} entries"
+        )
+
+
+EXPORTS = ExportStore()
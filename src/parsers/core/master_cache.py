@@ -0,0 +1,113 @@
+"""
+Validated snapshots of MasterData, so unchanged exports skip pydantic validation.
+
+A snapshot is pickled right after validation and is keyed by:
+- info.json of the region and the OpenApiInfo of the atlas api
+- size and mtime of every export file
+- source of fgo-game-data-api and local schemas, pydantic and python version
+- source of the projection rules for mapping projections
+"""
+
+import hashlib
+import pickle
+import platform
+import sys
+from pathlib import Path
+
+import app.schemas
+import pydantic
+from app.schemas.common import Region
+
+from ...config import settings
+from ...schemas.common import OpenApiInfo
+from ...schemas.gamedata import MasterData
+from ...utils.helper import load_json, parse_json_obj_as
+from ...utils.log import logger
+from . import projection as projection_module
+
+
+_schema_hash: str | None = None
+
+
+def get_schema_hash() -> str:
+    global _schema_hash
+    if _schema_hash is None:
+        h = hashlib.md5(
+            f"{sys.version_info[:2]},{platform.python_implementation()},"
+            f"{pydantic.VERSION}".encode()
+        )
+        folders = [
+            Path(next(iter(app.schemas.__path__))),
+            Path(__file__).parents[2] / "schemas",
+        ]
+        for folder in folders:
+            for fp in sorted(folder.glob("**/*.py")):
+                h.update(fp.name.encode())
+                h.update(fp.read_bytes())
+        _schema_hash = h.hexdigest()
+    return _schema_hash
+
+
+def _get_cache_key(region: Region, projection: bool) -> str | None:
+    folder = settings.atlas_export_dir / region.value
+    info = load_json(folder / "info.json")
+    openapi = load_json(settings.atlas_export_dir / "openapi.json")
+    if not info or not openapi:
+        return None
+    api_info = parse_json_obj_as(OpenApiInfo, openapi["info"])
+    h = hashlib.md5(get_schema_hash().encode())
+    if projection:
+        h.update(Path(projection_module.__file__).read_bytes())
+    h.update(api_info.model_dump_json().encode())
+    h.update((folder / "info.json").read_bytes())
+    for key in MasterData.model_fields:
+        fp = folder / f"{key}.json"
+        if fp.exists():
+            stat = fp.stat()
+            h.update(f"{key}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return h.hexdigest()
+
+
+def _cache_path(region: Region, projection: bool) -> Path:
+    suffix = ".mapping" if projection else ""
+    return settings.cache_master_data / f"{region.value}{suffix}.pickle"
+
+
+def load_master_data_snapshot(
+    region: Region, projection: bool = False
+) -> MasterData | None:
+    fp = _cache_path(region, projection)
+    if not fp.exists():
+        return None
+    key = _get_cache_key(region, projection)
+    if key is None:
+        return None
+    try:
+        with fp.open("rb") as f:
+            cached_key = pickle.load(f)
+            if cached_key != key:
+                logger.info(f"[{region}] master data snapshot outdated")
+                return None
+            data = pickle.load(f)
+    except Exception as e:  # noqa: BLE001
+        logger.warning(f"[{region}] failed to load master data snapshot: {e!r}")
+        return None
+    if not isinstance(data, MasterData):
+        return None
+    logger.info(f"[{region}] loaded master data snapshot")
+    return data
+
+
+def save_master_data_snapshot(
+    region: Region, data: MasterData, projection: bool = False
+):
+    key = _get_cache_key(region, projection)
+    if key is None:
+        return
+    fp = _cache_path(region, projection)
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    tmp_fp = fp.with_suffix(".tmp")
+    with tmp_fp.open("wb") as f:
+        pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_fp.replace(fp)
@@ -0,0 +1,178 @@
+"""
+Mapping projection of non-JP exports.
+
+`merge_official_mappings` only reads names, ids, release times and a few nested
+fields of other regions. Raw export json is pruned to those fields before
+validation, so much less is validated and kept in memory.
+
+Required fields are always kept to keep the models valid. Skills, tds,
+functions and buffs are kept as a whole since trigger skills are resolved
+from them.
+"""
+
+from types import UnionType
+from typing import Annotated, Any, Union, get_args, get_origin
+
+from app.schemas.basic import BasicServant
+from app.schemas.common import Region
+from app.schemas.nice import (
+    ExtraAssets,
+    NiceBattlePoint,
+    NiceBgmEntity,
+    NiceClassBoard,
+    NiceCommandCode,
+    NiceEquip,
+    NiceEvent,
+    NiceItem,
+    NiceLore,
+    NiceMasterMission,
+    NiceMysticCode,
+    NiceQuest,
+    NiceServant,
+    NiceSpot,
+    NiceWar,
+)
+from pydantic import BaseModel
+
+
+# export files used by merge_official_mappings and load_master_data
+MAPPING_EXPORT_FILES = {
+    "basic_svt",
+    "nice_command_code",
+    "nice_cv",
+    "nice_bgm",
+    "nice_equip_lore",
+    "nice_illustrator",
+    "nice_item",
+    "nice_master_mission",
+    "nice_mystic_code",
+    "nice_servant_lore",
+    "nice_war",
+    "nice_event",
+    "nice_class_board",
+    "nice_battle_point",
+}
+
+# optional fields to keep, other types are kept as a whole
+_KEPT_FIELDS: dict[type[BaseModel], set[str]] = {
+    BasicServant: {"id", "name"},
+    NiceServant: {
+        "id",
+        "collectionNo",
+        "name",
+        "battleName",
+        "ascensionAdd",
+        "svtChange",
+        "traits",
+        "traitAdd",
+        "profile",
+        "skills",
+        "classPassive",
+        "extraPassive",
+        "appendPassive",
+        "noblePhantasms",
+        "relateQuestIds",
+        "trialQuestIds",
+        # SkillRankUp, trigger skills of load_master_data
+        "script",
+    },
+    NiceLore: {"costume", "comments"},
+    ExtraAssets: set(),
+    NiceEquip: {"id", "collectionNo", "name", "profile", "skills"},
+    NiceCommandCode: {"id", "collectionNo", "name", "comment", "skills"},
+    NiceMysticCode: {"id", "name", "detail", "skills"},
+    NiceItem: {"id", "name", "priority"},
+    NiceBgmEntity: {"id", "name"},
+    NiceMasterMission: {"id", "script"},
+    NiceEvent: {
+        "id",
+        "name",
+        "shortName",
+        "startedAt",
+        "endedAt",
+        "pointGroups",
+        "towers",
+        "recipes",
+        "tradeGoods",
+        "commandAssists",
+    },
+    NiceWar: {"id", "name", "longName", "eventId", "lastQuestId", "spots"},
+    NiceSpot: {"id", "name", "spotAdds", "quests"},
+    NiceQuest: {"id", "name", "openedAt", "closedAt"},
+    NiceClassBoard: {"id", "squares"},
+    NiceBattlePoint: {"id", "name"},
+}
+
+_field_aliases: dict[type[BaseModel], dict[str, str]] = {}
+
+
+def _get_field_names(cls: type[BaseModel]) -> dict[str, str]:
+    names = _field_aliases.get(cls)
+    if names is None:
+        names = {}
+        for name, field in cls.model_fields.items():
+            alias = field.validation_alias or field.alias
+            names[alias if isinstance(alias, str) else name] = name
+            names[name] = name
+        _field_aliases[cls] = names
+    return names
+
+
+def _is_model(annotation) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def _prune(value: Any, annotation, kept: dict[type[BaseModel], set[str]]):
+    origin = get_origin(annotation)
+    if origin is Annotated:
+        _prune(value, get_args(annotation)[0], kept)
+    elif origin in (Union, UnionType):
+        args = [arg for arg in get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            _prune(value, args[0], kept)
+    elif origin in (list, set, frozenset, tuple) and isinstance(value, list):
+        args = get_args(annotation)
+        if len(args) == 1 or (len(args) == 2 and args[1] is Ellipsis):
+            for item in value:
+                _prune(item, args[0], kept)
+    elif origin is dict and isinstance(value, dict):
+        args = get_args(annotation)
+        if len(args) == 2:
+            for item in value.values():
+                _prune(item, args[1], kept)
+    elif _is_model(annotation) and isinstance(value, dict):
+        _prune_model(value, annotation, kept)
+
+
+def _prune_model(
+    data: dict[str, Any],
+    cls: type[BaseModel],
+    kept: dict[type[BaseModel], set[str]],
+):
+    kept_fields = kept.get(cls)
+    names = _get_field_names(cls)
+    for key in list(data.keys()):
+        name = names.get(key)
+        field = cls.model_fields.get(name) if name else None
+        if field is None:
+            if kept_fields is not None:
+                data.pop(key)
+            continue
+        if (
+            kept_fields is not None
+            and name not in kept_fields
+            and not field.is_required()
+        ):
+            data.pop(key)
+            continue
+        _prune(data[key], field.annotation, kept)
+
+
+def prune_export(value: Any, annotation, region: Region) -> Any:
+    """Drop fields not needed by mapping merging from raw export json in place"""
+    kept = _KEPT_FIELDS
+    if region == Region.NA:
+        # NA quests are used by quest parser
+        kept = {k: v for k, v in kept.items() if k is not NiceQuest}
+    _prune(value, annotation, kept)
+    return value
@@ -1,7 +1,11 @@
+import math
 import time
 from collections import defaultdict
+from collections.abc import Iterator
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from typing import Callable
 
 import pytz
 from app.schemas.common import Region
@@ -14,6 +18,7 @@ from app.schemas.gameenums import (
 )
 from app.schemas.nice import NiceGift, NiceQuest, NiceQuestPhase
 from app.schemas.raw import MstQuestPhase, MstQuestPhaseDetail
+from requests_cache.cache_control import ExpirationTime
 
 from ...config import PayloadSetting, settings
 from ...schemas.common import NEVER_CLOSED_TIMESTAMP, MstQuestPhaseBasic
@@ -22,12 +27,17 @@ from ...schemas.drop_data import DropData, QuestDropData
 from ...schemas.gamedata import MasterData
 from ...utils import SECS_PER_DAY, AtlasApi
 from ...utils.helper import parse_json_file_as, sort_dict
+from ...utils.http_cache import QuestPhaseKey
 from ...utils.log import logger
-from ...utils.worker import Worker
 from ...wiki.wiki_tool import KnownTimeZone
 from ..helper import is_quest_in_expired_wars
 
 
+_PhaseRequest = tuple[QuestPhaseKey, ExpirationTime]
+# tasks per prefetch, only phases of one batch are kept in memory
+_PREFETCH_BATCH = 500
+
+
 @dataclass
 class _QuestParser:
     jp_data: MasterData
@@ -38,8 +48,9 @@ class _QuestParser:
         logger.info("processing quest data")
         self._now = int(time.time())
         self.used_prev: set[int] = set()
+        self._phases: dict[QuestPhaseKey, NiceQuestPhase | None] = {}
 
-        worker = Worker("quest")
+        tasks: list[tuple[Callable[[NiceQuest], None], NiceQuest]] = []
 
         for war in self.jp_data.nice_war:
             # if war.id == 9999:  # Chaldea Gate
@@ -72,12 +83,12 @@ class _QuestParser:
                     and NiceQuestFlag.forceToNoDrop not in _quest.flags
                     and NiceQuestFlag.dropFirstTimeOnly not in _quest.flags
                 ):
-                    worker.add(self._save_main_free, _quest)
+                    tasks.append((self._save_main_free, _quest))
                     # continue
                 # 宝物庫の扉を開け 初級&極級
                 if _quest.warId == 1002:
                     if _quest.id in (94061636, 94061640):
-                        worker.add(self._save_main_free, _quest)
+                        tasks.append((self._save_main_free, _quest))
                     continue
                 # free drop : event free + hunting free
                 # fixed drop: one-off quests, event/main story, high-diff
@@ -111,30 +122,89 @@ class _QuestParser:
                     else:
                         continue
                 if add_fixed:
-                    worker.add(self._save_fixed_drops, _quest)
+                    tasks.append((self._save_fixed_drops, _quest))
                 if add_free:
-                    worker.add(self._save_free_drops, _quest)
+                    tasks.append((self._save_free_drops, _quest))
 
-        worker.wait()
+        for batch in _task_batches(tasks, _PREFETCH_BATCH):
+            self._prefetch_phases(batch)
+            for func, quest in batch:
+                func(quest)
+            self._phases.clear()
         logger.debug(
             f"used {len(self.used_prev)} quest phases' fixed drop from previous build"
         )
         logger.info("finished checking quests")
 
-    def _save_main_free(self, quest: NiceQuest):
-        phase = quest.phases[-1]
-        phase_data = AtlasApi.quest_phase(
-            quest.id,
-            phase,
+    def _prefetch_phases(self, tasks: list[tuple[Callable, NiceQuest]]):
+        """Fetch every quest phase needed by tasks before processing them.
+
+        Keys shared by main free, fixed drop and free drop are fetched once with
+        the strictest expiration. Rare enemy variants of free drops depend on the
+        first response, so they are prefetched in a second round.
+        """
+        requests: dict[QuestPhaseKey, ExpirationTime] = {}
+
+        def _add(key: QuestPhaseKey, expire: ExpirationTime):
+            if key in requests:
+                expire = _stricter_expire(requests[key], expire)
+            requests[key] = expire
+
+        free_requests: list[_PhaseRequest] = []
+        for func, quest in tasks:
+            if func == self._save_main_free:
+                _add(*self._main_free_request(quest))
+            elif func == self._save_fixed_drops:
+                for _, request in self._fixed_drop_requests(quest):
+                    if request:
+                        _add(*request)
+            elif func == self._save_free_drops:
+                free = self._free_drop_request(quest)
+                if free and free[1]:
+                    _add(*free[1])
+                    free_requests.append(free[1])
+        self._phases.update(
+            AtlasApi.prefetch_quest_phases(requests.keys(), requests.__getitem__)
+        )
+
+        rare_requests: dict[QuestPhaseKey, ExpirationTime] = {}
+        for key, expire in free_requests:
+            rare_key = _rare_enemy_key(self._phases.get(key), key)
+            if rare_key and rare_key not in self._phases:
+                rare_requests[rare_key] = expire
+        if rare_requests:
+            self._phases.update(
+                AtlasApi.prefetch_quest_phases(
+                    rare_requests.keys(), rare_requests.__getitem__
+                )
+            )
+        logger.debug(f"prefetched {len(self._phases)} quest phases")
+
+    def _get_phase(
+        self, key: QuestPhaseKey, expire_after: ExpirationTime
+    ) -> NiceQuestPhase | None:
+        if key in self._phases:
+            return self._phases[key]
+        return _fetch_quest_phase(key, expire_after)
+
+    def _main_free_request(self, quest: NiceQuest) -> "_PhaseRequest":
+        return (
+            QuestPhaseKey(quest.id, quest.phases[-1]),
             # enemyHash=MAIN_FREE_ENEMY_HASH.get(quest.id),
             # filter_fn=_check_quest_phase_in_recent,
-            expire_after=self._get_expire(quest, self.payload.main_story_quest_expire),
+            self._get_expire(quest, self.payload.main_story_quest_expire),
         )
+
+    def _save_main_free(self, quest: NiceQuest):
+        key, expire = self._main_free_request(quest)
+        phase_data = self._get_phase(key, expire)
         assert phase_data
-        self.jp_data.cachedQuestPhases[quest.id * 100 + phase] = phase_data
+        self.jp_data.cachedQuestPhases[quest.id * 100 + key.phase] = phase_data
 
-    def _save_fixed_drops(self, quest: NiceQuest):
-        """always pass jp quest to here"""
+    def _fixed_drop_requests(
+        self, quest: NiceQuest
+    ) -> list[tuple[int, "_PhaseRequest | None"]]:
+        """phase -> request, request is None if previous fixed drop is reused"""
         quest_na = self.jp_data.all_quests_na.get(quest.id)
         close_at_limit = int(self._now - 3 * SECS_PER_DAY)
         open_at_limit = int(self._now - self.payload.recent_quest_expire * SECS_PER_DAY)
@@ -153,30 +223,33 @@ class _QuestParser:
             or retry_na
         )
 
+        requests: list[tuple[int, _PhaseRequest | None]] = []
         for phase in quest.phases:
             phase_key = quest.id * 100 + phase
             prev_fixed = (
                 self.prev_data.fixedDrops.get(phase_key) if self.prev_data else None
             )
             if prev_fixed and not retry:
-                self.jp_data.dropData.fixedDrops[phase_key] = prev_fixed
+                requests.append((phase, None))
+            elif phase in quest.phasesWithEnemies:
+                key = QuestPhaseKey(quest.id, phase, Region.JP)
+                requests.append((phase, (key, self._get_expire(quest))))
+            elif quest_na and phase in quest_na.phasesWithEnemies:
+                key = QuestPhaseKey(quest_na.id, phase, Region.NA)
+                requests.append((phase, (key, self._get_expire(quest))))
+        return requests
+
+    def _save_fixed_drops(self, quest: NiceQuest):
+        """always pass jp quest to here"""
+        for phase, request in self._fixed_drop_requests(quest):
+            phase_key = quest.id * 100 + phase
+            if request is None:
+                assert self.prev_data
+                prev_drops = self.prev_data.fixedDrops[phase_key]
+                self.jp_data.dropData.fixedDrops[phase_key] = prev_drops
                 self.used_prev.add(phase_key)
                 continue
-            phase_data = None
-            if phase in quest.phasesWithEnemies:
-                phase_data = AtlasApi.quest_phase(
-                    quest.id,
-                    phase,
-                    region=Region.JP,
-                    expire_after=self._get_expire(quest),
-                )
-            elif quest_na and phase in quest_na.phasesWithEnemies:
-                phase_data = AtlasApi.quest_phase(
-                    quest_na.id,
-                    phase,
-                    region=Region.NA,
-                    expire_after=self._get_expire(quest),
-                )
+            phase_data = self._get_phase(*request)
             if not phase_data:
                 continue
             phase_drops: dict[int, int] = {}
@@ -201,9 +274,12 @@ class _QuestParser:
                 runs=runs, items=sort_dict(phase_drops)
             )
 
-    def _save_free_drops(self, quest: NiceQuest):
+    def _free_drop_request(
+        self, quest: NiceQuest
+    ) -> tuple[int, "_PhaseRequest | None"] | None:
+        """(phase, request), request is None if previous free drop is reused"""
         if not quest.phases:
-            return
+            return None
         quest_na = self.jp_data.all_quests_na.get(quest.id)
         close_at_limit = int(self._now - 3 * SECS_PER_DAY)
         open_at_limit = int(self._now - self.payload.recent_quest_expire * SECS_PER_DAY)
@@ -220,22 +296,36 @@ class _QuestParser:
 
         phase = quest.phases[-1]
         if phase in quest.phasesNoBattle:
-            return
+            return None
         phase_key = quest.id * 100 + phase
         prev_free = self.prev_data.freeDrops.get(phase_key) if self.prev_data else None
         if prev_free and not retry:
-            self.jp_data.dropData.freeDrops[phase_key] = prev_free
-            self.used_prev.add(phase_key)
-            return
-        phase_data = None
+            return phase, None
         if phase in quest.phasesWithEnemies or quest.closedAt > self._now:
-            phase_data = get_quest_phase_check_rare_enemy(
-                quest, phase, Region.JP, self._get_expire(quest)
-            )
+            key = QuestPhaseKey(quest.id, phase, Region.JP)
+            return phase, (key, self._get_expire(quest))
         elif quest_na and phase in quest_na.phasesWithEnemies:
-            phase_data = get_quest_phase_check_rare_enemy(
-                quest_na, phase, Region.NA, self._get_expire(quest_na)
-            )
+            key = QuestPhaseKey(quest_na.id, phase, Region.NA)
+            return phase, (key, self._get_expire(quest_na))
+        return None
+
+    def _save_free_drops(self, quest: NiceQuest):
+        free = self._free_drop_request(quest)
+        if not free:
+            return
+        phase, request = free
+        phase_key = quest.id * 100 + phase
+        if request is None:
+            assert self.prev_data
+            self.jp_data.dropData.freeDrops[phase_key] = self.prev_data.freeDrops[
+                phase_key
+            ]
+            self.used_prev.add(phase_key)
+            return
+        key, expire = request
+        phase_data = get_quest_phase_check_rare_enemy(
+            quest, key.phase, key.region, expire, fetch=self._get_phase
+        )
 
         if not phase_data:
             return
@@ -298,26 +388,75 @@ def parse_quest_drops(jp_data: MasterData, payload: PayloadSetting):
     parser.parse()
 
 
+def _fetch_quest_phase(
+    key: QuestPhaseKey, expire_after: ExpirationTime
+) -> NiceQuestPhase | None:
+    return AtlasApi.quest_phase(
+        key.quest_id,
+        key.phase,
+        enemyHash=key.enemyHash,
+        region=key.region,
+        expire_after=expire_after,
+    )
+
+
+def _rare_enemy_key(
+    phase_data: NiceQuestPhase | None, key: QuestPhaseKey
+) -> QuestPhaseKey | None:
+    if phase_data and has_guaranteed_rare_enemy(phase_data):
+        return key._replace(enemyHash=phase_data.availableEnemyHashes[-1])
+    return None
+
+
+def _task_batches(
+    tasks: list[tuple[Callable, NiceQuest]], size: int
+) -> Iterator[list[tuple[Callable, NiceQuest]]]:
+    """Tasks of the same quest are kept in one batch, they share phases"""
+    batch: list[tuple[Callable, NiceQuest]] = []
+    for task in tasks:
+        if len(batch) >= size and batch[-1][1] is not task[1]:
+            yield batch
+            batch = []
+        batch.append(task)
+    if batch:
+        yield batch
+
+
+def _expire_at(expire: ExpirationTime) -> float:
+    """Absolute expiration timestamp, inf if never expires"""
+    if isinstance(expire, datetime):
+        return expire.timestamp()
+    if isinstance(expire, str):
+        return parsedate_to_datetime(expire).timestamp()
+    if isinstance(expire, timedelta):
+        expire = expire.total_seconds()
+    if expire is None or expire < 0:
+        return math.inf
+    return time.time() + expire
+
+
+def _stricter_expire(a: ExpirationTime, b: ExpirationTime) -> ExpirationTime:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return b if _expire_at(b) < _expire_at(a) else a
+
+
 def get_quest_phase_check_rare_enemy(
     quest: NiceQuest,
     phase: int,
     region: Region,
     expire_after,
+    fetch: Callable[
+        [QuestPhaseKey, ExpirationTime], NiceQuestPhase | None
+    ] = _fetch_quest_phase,
 ) -> NiceQuestPhase | None:
-    phase_data = AtlasApi.quest_phase(
-        quest.id,
-        phase,
-        region=region,
-        expire_after=expire_after,
-    )
-    if phase_data and has_guaranteed_rare_enemy(phase_data):
-        phase_data2 = AtlasApi.quest_phase(
-            quest.id,
-            phase,
-            region=region,
-            enemyHash=phase_data.availableEnemyHashes[-1],
-            expire_after=expire_after,
-        )
+    key = QuestPhaseKey(quest.id, phase, region)
+    phase_data = fetch(key, expire_after)
+    rare_key = _rare_enemy_key(phase_data, key)
+    if phase_data and rare_key:
+        phase_data2 = fetch(rare_key, expire_after)
         if (
             phase_data2
             and phase_data2.drops
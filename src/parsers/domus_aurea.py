@@ -5,10 +5,12 @@ Drop data from fgo domus aurea
 import csv
 import time
 from collections import defaultdict
+from collections.abc import Iterable
 from dataclasses import dataclass
 from io import StringIO
 
 import requests
+from app.schemas.common import Region
 from app.schemas.gameenums import (
     NiceGiftType,
     NiceQuestAfterClearType,
@@ -20,13 +22,15 @@ from app.schemas.raw import MstQuestPhase
 
 from src.config import settings
 from src.parsers.core.aa_export import update_exported_files
+from src.parsers.core.export_store import EXPORTS
 from src.parsers.domus_aurea_data import FIX_SPOT_QUEST_MAPPING, ITEM_NAME_MAPPING
-from src.schemas.common import NEVER_CLOSED_TIMESTAMP
+from src.schemas.common import NEVER_CLOSED_TIMESTAMP, AtlasExportFile
 from src.schemas.drop_data import DomusAureaData, DropRateSheet
 from src.utils import logger
 from src.utils.helper import (
     LocalProxy,
     dump_json_beautify,
+    iter_json_file_as,
     parse_json_file_as,
     parse_json_obj_as,
 )
@@ -53,10 +57,10 @@ class _MasterData:
 
 def get_master_data():
     # check item id and name
-    items = parse_json_file_as(
-        list[NiceItem], settings.atlas_export_dir / "JP/nice_item.json"
-    )
-    items = {item.id: item for item in items}
+    items = {
+        item.id: item
+        for item in EXPORTS.get_list(Region.JP, AtlasExportFile.nice_item, NiceItem)
+    }
     for item_name, (item_id, raw_name) in ITEM_NAME_MAPPING.items():
         assert items[item_id].name == raw_name, (
             item_name,
@@ -69,12 +73,13 @@ def get_master_data():
 
     # wars: main story and daily(1002)
     extra_quest_ids = set(FIX_SPOT_QUEST_MAPPING.values())
-    wars = parse_json_file_as(
-        list[NiceWar], settings.atlas_export_dir / "JP/nice_war.json"
-    )
+    wars = {
+        war.id: war
+        for war in EXPORTS.get_list(Region.JP, AtlasExportFile.nice_war, NiceWar)
+    }
     valid_quests: dict[int, NiceQuest] = {}
 
-    for war in wars:
+    for war in wars.values():
         if war.id != 1002 and war.id >= 1000:
             if war.parentWarId != GRAND_BOARD_WAR_ID:
                 continue
@@ -87,9 +92,10 @@ def get_master_data():
         valid_quests[quest_id]
         assert quest_id in valid_quests, f"quest {quest_id} not found"
 
+    mst_phases: Iterable[MstQuestPhase]
     if LOCAL_MODE:
-        mst_phases = parse_json_file_as(
-            list[MstQuestPhase],
+        mst_phases = iter_json_file_as(
+            MstQuestPhase,
             "../../atlas/fgo-game-data-jp/master/mstQuestPhase.json",
         )
     else:
@@ -107,7 +113,7 @@ def get_master_data():
     }
 
     return _MasterData(
-        wars={w.id: w for w in wars},
+        wars=wars,
         quests=valid_quests,
         questPhases=quest_phases,
     )
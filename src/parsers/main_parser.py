@@ -1,9 +1,11 @@
 import hashlib
+import multiprocessing
 import re
 import shutil
 import time
 from collections import defaultdict
 from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Any
@@ -28,6 +30,7 @@ from pydantic import BaseModel
 
 from ..config import PayloadSetting, settings
 from ..schemas.common import (
+    AtlasExportFile,
     DataVersion,
     FileVersion,
     GameTopRegionInfo,
@@ -55,7 +58,6 @@ from ..utils import (
     AtlasApi,
     DownUrl,
     McApi,
-    Worker,
     count_time,
     discord,
     dump_json,
@@ -64,7 +66,7 @@ from ..utils import (
     sort_dict,
 )
 from ..utils.helper import (
-    beautify_file,
+    beautify_json,
     describe_regions,
     iter_model,
     parse_json_file_as,
@@ -77,7 +79,9 @@ from ..wiki.wiki_tool import KnownTimeZone
 from . import svt_release_time
 from .core.aa_export import update_exported_files
 from .core.const_data import get_const_data
+from .core.dist_cache import DistFingerprints
 from .core.dump import DataEncoder
+from .core.export_store import EXPORTS
 from .core.mapping.autofill import autofill_mapping
 from .core.mapping.common import _KT, _T
 from .core.mapping.official import (
@@ -86,7 +90,9 @@ from .core.mapping.official import (
     merge_official_mappings,
 )
 from .core.mapping.wiki import merge_atlas_na_mapping, merge_wiki_translation
+from .core.master_cache import load_master_data_snapshot, save_master_data_snapshot
 from .core.mm import load_mm_with_gifts
+from .core.projection import MAPPING_EXPORT_FILES
 from .core.quest import get_quest_phase_basic, parse_quest_drops
 from .core.ticket import parse_exchange_tickets
 from .domus_aurea import run_drop_rate_update
@@ -105,6 +111,7 @@ class MainParser:
         self.stopwatch = Stopwatch("MainParser")
         self.now = timestamp2datetime(None)
         self.encoder = DataEncoder(self.jp_data)
+        self.dist_fingerprints = DistFingerprints(self.payload.incremental_dist)
 
     @count_time
     def start(self):
@@ -137,6 +144,9 @@ class MainParser:
             logger.warning("clear all http_cache")
             AtlasApi.cache_storage.clear()
             McApi.cache_storage.clear()
+        elif self.payload.sweep_cache_http:
+            AtlasApi.sweep_expired()
+            McApi.sweep_expired()
 
         logger.info("update_exported_files")
         update_exported_files(self.payload.regions, self.payload.force_update_export)
@@ -163,6 +173,7 @@ class MainParser:
         self.jp_data.constData = get_const_data(self.jp_data)
         self.update_svt_release_time()
         self.save_data()
+        EXPORTS.log_stats()
         print(self.stopwatch.output())
 
     def add_changes_only(self):
@@ -262,17 +273,37 @@ class MainParser:
         )
         settings.commit_msg.write_text(msg)
 
-    def load_master_data(self, region: Region, add_trigger: bool = True) -> MasterData:
+    def load_master_data(
+        self, region: Region, add_trigger: bool = True, projection: bool = False
+    ) -> MasterData:
+        """projection: only load fields used by `merge_official_mappings`"""
         logger.info(f"loading {region} master data")
-        data = {}
-        for k in MasterData.model_fields:
-            fp = settings.atlas_export_dir / region.value / f"{k}.json"
-            v = load_json(fp)
-            if v:
-                data[k] = v
-            # print(f'loading {k}: {fp}: {None if v is None else len(data[k])} items')
-        data["region"] = f"{region}"
-        master_data = parse_json_obj_as(MasterData, data)
+        assert not (projection and region == Region.JP)
+        export_files = [
+            f
+            for f in AtlasExportFile
+            if f.value in MasterData.model_fields
+            and not (projection and f.value not in MAPPING_EXPORT_FILES)
+        ]
+        master_data = None
+        if self.payload.cache_master_data:
+            master_data = load_master_data_snapshot(region, projection)
+            if master_data is not None:
+                for f in export_files:
+                    EXPORTS.put(
+                        region, f, getattr(master_data, f.value), projection=projection
+                    )
+        if master_data is None:
+            data = {}
+            for f in export_files:
+                v = EXPORTS.get(region, f, projection=projection)
+                if v:
+                    data[f.value] = v
+            data["region"] = f"{region}"
+            master_data = parse_json_obj_as(MasterData, data)
+            del data
+            if self.payload.cache_master_data:
+                save_master_data_snapshot(region, master_data, projection)
 
         if region == Region.JP:
             entity_ids = {x.id for x in master_data.basic_svt}
@@ -305,8 +336,6 @@ class MainParser:
             #     assert extra_svt is not None and extra_svt.profile
             #     master_data.nice_servant_lore.append(extra_svt)
 
-        if region == Region.NA:
-            self.jp_data.all_quests_na = master_data.quest_dict
         for svt in master_data.nice_servant_lore:
             master_data.remainedQuestIds.update(svt.relateQuestIds)
             master_data.remainedQuestIds.update(svt.trialQuestIds)
@@ -344,6 +373,9 @@ class MainParser:
             self.stopwatch.log(f"master data [{region}] no trigger")
             return master_data
 
+        trigger_skill_ids: set[int] = set()
+        trigger_td_ids: set[int] = set()
+
         def _add_trigger_skill(
             buff: NiceBuff | None, skill_ids: Iterable[int], is_td=False
         ):
@@ -351,13 +383,18 @@ class MainParser:
                 master_data.mappingData.func_popuptext.setdefault(
                     buff.type.value, MappingStr()
                 )
-            for skill_id in set(skill_ids):
-                self._add_trigger(master_data, skill_id, is_td)
+            (trigger_td_ids if is_td else trigger_skill_ids).update(skill_ids)
 
-        worker = Worker(f"base_skill_{region}", _add_trigger_skill)
-        for skill in master_data.skill_list_no_cache():
-            for branch in skill.script.condBranchSkillInfo or []:
-                self._add_trigger(master_data, branch.skillId)
+        # functions of branch skills are checked below
+        self._add_triggers(
+            master_data,
+            [
+                branch.skillId
+                for skill in master_data.skill_list_no_cache()
+                for branch in skill.script.condBranchSkillInfo or []
+            ],
+            [],
+        )
 
         for func in master_data.func_list_no_cache():
             if func.svals and func.svals[0].DependFuncId:
@@ -375,16 +412,16 @@ class MainParser:
                 continue
             buff = func.buffs[0]
             if buff.type == NiceBuffType.npattackPrevBuff:
-                worker.add_default(buff, get_all_func_val(func, "SkillID"))
+                _add_trigger_skill(buff, get_all_func_val(func, "SkillID"))
             elif buff.type == NiceBuffType.counterFunction:
                 # this is TD
-                worker.add_default(buff, get_all_func_val(func, "CounterId"), True)
+                _add_trigger_skill(buff, get_all_func_val(func, "CounterId"), True)
             elif buff.type == NiceBuffType.substituteInstantDeath:
                 # this is TD
-                worker.add_default(
+                _add_trigger_skill(
                     buff, get_all_func_val(func, "SubstituteSkillId"), True
                 )
-                worker.add_default(buff, get_all_func_val(func, "ResistSkillId"), True)
+                _add_trigger_skill(buff, get_all_func_val(func, "ResistSkillId"), True)
             elif buff.type in {
                 NiceBuffType.delayFunction,
                 NiceBuffType.deadFunction,
@@ -429,7 +466,7 @@ class MainParser:
                 NiceBuffType.multiGutsBeforeFunction,
                 NiceBuffType.lastSelfturnprogressFunction,
             } or buff.type.name.endswith("Function"):
-                worker.add_default(buff, get_all_func_val(func, "Value"))
+                _add_trigger_skill(buff, get_all_func_val(func, "Value"))
         skillIds = set()
         for svt in master_data.nice_servant_lore:
             for skills in (svt.script.SkillRankUp or {}).values():
@@ -438,13 +475,13 @@ class MainParser:
                 skillIds.update(skills)
             for skills in svt.ascensionAdd.overwriteClassPassive.costume.values():
                 skillIds.update(skills)
-        worker.add_default(None, skillIds)
+        _add_trigger_skill(None, skillIds)
         # trigger in trigger or some weird trigger
         # 世界樹への生贄, マンドリカルド-間際の一撃, クロエx2
-        worker.add_default(None, [966447, 970405, 970412, 970413])
+        _add_trigger_skill(None, [966447, 970405, 970412, 970413])
         # grand board
-        worker.add_default(None, [994725, 5009002])
-        worker.add_default(
+        _add_trigger_skill(None, [994725, 5009002])
+        _add_trigger_skill(
             None,
             [
                 item.value
@@ -453,51 +490,52 @@ class MainParser:
             ],
         )
 
-        worker.wait()
+        self._add_triggers(master_data, trigger_skill_ids, trigger_td_ids)
         logger.info(
             f"{region}: loaded {len(master_data.base_skills)} trigger skills, {len(master_data.base_tds)} trigger TD"
         )
 
-        if region != Region.JP:
-            jp_item_ids = {item.id for item in self.jp_data.nice_item}
-            for item in master_data.nice_item:
-                if (
-                    item.type in (NiceItemType.friendshipUpItem,)
-                    and item.id not in jp_item_ids
-                ):
-                    self.jp_data.nice_item.append(item)
-
         self.stopwatch.log(f"master data [{region}]")
         return master_data
 
+    def _add_region_items(self, master_data: MasterData):
+        """Items only released in other regions, run in the main process"""
+        jp_item_ids = {item.id for item in self.jp_data.nice_item}
+        for item in master_data.nice_item:
+            if (
+                item.type in (NiceItemType.friendshipUpItem,)
+                and item.id not in jp_item_ids
+            ):
+                self.jp_data.nice_item.append(item)
+
     @classmethod
-    def _add_trigger(
-        cls, master_data: MasterData, skill_id: int | None, is_td: bool = False
+    def _add_triggers(
+        cls,
+        master_data: MasterData,
+        skill_ids: Iterable[int | None],
+        td_ids: Iterable[int | None],
     ):
         region = master_data.region
-        if not skill_id:
-            return
-        if is_td:
-            if skill_id in master_data.base_tds:
-                return
-            td = AtlasApi.api_model(
-                f"/nice/{region}/NP/{skill_id}",
-                NiceBaseTd,
-                expire_after=3600 * 24 * 7,
-            )
-            if td:
-                master_data.base_tds[skill_id] = td
-
-        else:
-            if skill_id in master_data.base_skills:
-                return
-            skill = AtlasApi.api_model(
-                f"/nice/{region}/skill/{skill_id}",
-                NiceBaseSkill,
-                expire_after=3600 * 24 * 7,
-            )
+        skill_ids = sorted(
+            {x for x in skill_ids if x and x not in master_data.base_skills}
+        )
+        td_ids = sorted({x for x in td_ids if x and x not in master_data.base_tds})
+        skills = AtlasApi.api_models(
+            [f"/nice/{region}/skill/{skill_id}" for skill_id in skill_ids],
+            NiceBaseSkill,
+            expire_after=3600 * 24 * 7,
+        )
+        for skill_id, skill in zip(skill_ids, skills):
             if skill:
                 master_data.base_skills[skill_id] = skill
+        tds = AtlasApi.api_models(
+            [f"/nice/{region}/NP/{td_id}" for td_id in td_ids],
+            NiceBaseTd,
+            expire_after=3600 * 24 * 7,
+        )
+        for td_id, td in zip(td_ids, tds):
+            if td:
+                master_data.base_tds[td_id] = td
 
     def event_field_trait(self):
         # field_indiv: warId[]
@@ -551,6 +589,18 @@ class MainParser:
     ) -> FileVersion:
         if _fn is None:
             _fn = f"{key}.json"
+        fingerprint: str | None = None
+        if _bytes is None and last_version and self.dist_fingerprints.enabled:
+            fingerprint = self.dist_fingerprints.compute(
+                obj, key, _fn, "custom" if encoder else self.encoder.state_key()
+            )
+            last_fv = self.dist_fingerprints.reuse(_fn, fingerprint, last_version)
+            if last_fv:
+                if encoder is None:
+                    self.encoder.collect_bases(obj)
+                self.dist_fingerprints.update(_fn, fingerprint, reused=True)
+                logger.info(f"[version] reuse {key}: {_fn}")
+                return last_fv
         if _bytes is None:
             _text = dump_json(
                 obj,
@@ -580,12 +630,12 @@ class MainParser:
                 last_fv.minHash,
             ):
                 fv.timestamp = last_fv.timestamp
-        _fp = settings.output_dist.joinpath(_fn)
-        _fp.write_bytes(_bytes)
-        beautify_file(_fp)
-        _bytes = _fp.read_bytes()
+        _bytes = beautify_json(_bytes)
+        settings.output_dist.joinpath(_fn).write_bytes(_bytes)
         fv.hash = hashlib.md5(_bytes).hexdigest()[:6]
         fv.size = len(_bytes)
+        if fingerprint:
+            self.dist_fingerprints.update(_fn, fingerprint)
         logger.info(f"[version] dump {key}: {_fn}")
         return fv
 
@@ -614,6 +664,7 @@ class MainParser:
             )
         except:  # noqa
             _last_version = cur_version.model_copy(deep=True)
+        self.dist_fingerprints.load()
 
         def _normal_dump(
             obj,
@@ -621,9 +672,10 @@ class MainParser:
             _fn: str | None = None,
             encoder=None,
             _bytes: bytes | None = None,
-        ):
+        ) -> FileVersion:
             fv = self._normal_dump(obj, key, _fn, encoder, _bytes, _last_version)
             cur_version.files[fv.filename] = fv
+            return fv
 
         def _dump_by_count(
             obj: list, count: int, key: str, base_fn: str | None = None, encoder=None
@@ -677,7 +729,8 @@ class MainParser:
             data.mappingData, _last_version
         )
         # delete files after old mappings read
-        if not settings.is_debug:
+        # incremental build keeps them for reuse and removes stale ones at the end
+        if not settings.is_debug and not self.dist_fingerprints.enabled:
             for f in settings.output_dist.glob("**/*"):
                 if f.name in ("addData.json", "gametop.json"):
                     continue
@@ -690,8 +743,10 @@ class MainParser:
 
         _normal_dump(data.nice_item, "items")
         self.encoder.item = True
-        _normal_dump(data.basic_svt, "entities")
+        fv_entities = _normal_dump(data.basic_svt, "entities")
         self.encoder.basic_svt = True
+        # BasicServant is encoded as diff against entities from now on
+        self.dist_fingerprints.context["entities"] = fv_entities.minHash
         _normal_dump(data.nice_bgm, "bgms")
         self.encoder.bgm = True
         _dump_by_count(servants, 100, "servants")
@@ -784,6 +839,9 @@ class MainParser:
         base_functions = list(self.jp_data.base_functions.values())
         base_functions.sort(key=lambda x: x.funcId)
         _normal_dump(base_functions, "baseFunctions")
+        if self.dist_fingerprints.enabled:
+            self._remove_stale_dist_files(cur_version)
+        self.dist_fingerprints.save()
         self.stopwatch.log("save end")
 
         changed = False
@@ -812,6 +870,15 @@ class MainParser:
             logger.exception("update gametop failed")
             discord.text(f"Update gametop failed: {e}")
 
+    @staticmethod
+    def _remove_stale_dist_files(cur_version: DataVersion):
+        for f in settings.output_dist.glob("**/*"):
+            if f.name in ("addData.json", "gametop.json", "version.json"):
+                continue
+            if f.is_file() and f.name not in cur_version.files:
+                logger.info(f"[version] remove stale file {f.name}")
+                f.unlink()
+
     @staticmethod
     def _replace_dw_chars(content: _T) -> _T:
         # '魔{jin}剑', 鯖江
@@ -896,10 +963,35 @@ class MainParser:
     def merge_all_mappings(self):
         logger.info("merge all mappings")
         if not self.payload.skip_mapping:
+            regions = [Region.CN, Region.NA, Region.TW, Region.KR]
+            if self.payload.concurrent_mapping_load:
+                # loaded concurrently, merged in order
+                pool = ProcessPoolExecutor(
+                    len(regions), mp_context=multiprocessing.get_context("spawn")
+                )
+                futures = {
+                    region: pool.submit(
+                        _load_mapping_data, region, self.payload, None, len(regions)
+                    )
+                    for region in regions
+                }
+            else:
+                pool = None
+                futures = {}
+
+            def _load(region: Region) -> MasterData:
+                if region in futures:
+                    data, lapse = futures.pop(region).result()
+                else:
+                    data, lapse = _load_mapping_data(region, self.payload, self)
+                    # only used once, don't keep them alive after merging
+                    EXPORTS.clear(region)
+                self.stopwatch.log(f"load {region} for mappings", lapse)
+                self._add_region_items(data)
+                return data
+
             # CN
-            merge_official_mappings(
-                self.jp_data, self.load_master_data(Region.CN), self.wiki_data
-            )
+            merge_official_mappings(self.jp_data, _load(Region.CN), self.wiki_data)
             merge_wiki_translation(
                 self.jp_data,
                 Region.CN,
@@ -909,9 +1001,10 @@ class MainParser:
             )
             self._fix_cn_translation()
             # NA
-            merge_official_mappings(
-                self.jp_data, self.load_master_data(Region.NA), self.wiki_data
-            )
+            na_data = _load(Region.NA)
+            self.jp_data.all_quests_na = na_data.quest_dict
+            merge_official_mappings(self.jp_data, na_data, self.wiki_data)
+            del na_data
             self.jp_data.mappingData = merge_atlas_na_mapping(self.jp_data.mappingData)
             merge_wiki_translation(
                 self.jp_data,
@@ -921,13 +1014,11 @@ class MainParser:
                 ),
             )
             # TW
-            merge_official_mappings(
-                self.jp_data, self.load_master_data(Region.TW), self.wiki_data
-            )
+            merge_official_mappings(self.jp_data, _load(Region.TW), self.wiki_data)
             # KR
-            merge_official_mappings(
-                self.jp_data, self.load_master_data(Region.KR), self.wiki_data
-            )
+            merge_official_mappings(self.jp_data, _load(Region.KR), self.wiki_data)
+            if pool:
+                pool.shutdown()
         self.event_field_trait()
         self._add_enum_mappings()
         self._merge_repo_mapping()
@@ -1124,3 +1215,24 @@ class MainParser:
             assert data.timestamp and data.dataVer and data.appVer, data
 
         dump_json({data.region: data for data in region_data}, fp)
+
+
+def _load_mapping_data(
+    region: Region,
+    payload: PayloadSetting,
+    parser: MainParser | None = None,
+    processes: int = 1,
+) -> tuple[MasterData, float]:
+    """Load region data for mappings, also used by spawned processes.
+
+    Every process has its own limiter, `processes` share the Atlas rate limit
+    and burst capacity.
+    """
+    t0 = time.perf_counter()
+    if processes > 1:
+        AtlasApi.limiter = AtlasApi.limiter.split(processes)
+    if parser is None:
+        parser = MainParser()
+        parser.payload = payload
+    data = parser.load_master_data(region, projection=True)
+    return data, time.perf_counter() - t0
@@ -0,0 +1,298 @@
+"""
+Pure parsers of wiki page text, run in spawned processes.
+
+Pages are fetched beforehand by the rate limited WikiTool, then `parse_pages`
+maps a parser over the pages in a `PagePool` shared by all calls of a parser. Template params memoized in
+the wiki cache are sent along with the page texts, only the missing ones are
+parsed in workers and memoized by the main process afterwards. Parsers only
+return plain records, which are merged into WikiData on the main thread in
+input order, so shared state is never mutated concurrently.
+"""
+
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import repeat
+from typing import Callable, Iterator, TypeVar
+
+from mwparserfromhell.wikicode import Wikicode
+
+from ...utils.log import logger
+from ...wiki.template import Params, find_tabber, mwparse, parse_template_list
+from ...wiki.wiki_tool import WikiTool
+
+
+_R = TypeVar("_R")
+
+
+class PageSource:
+    """Texts of a page and its memoized template params.
+
+    `texts[0]` is the page whose params are memoized, the others are extra pages
+    like the gallery. Params missing in `memo` are parsed on first use and kept
+    in `parsed`.
+    """
+
+    def __init__(self, texts: tuple[str, ...], memo: dict[str, list[dict[str, str]]]):
+        self.texts = texts
+        self.memo = memo
+        self.parsed: dict[str, list[dict[str, str]]] = {}
+        self._wikitext: Wikicode | None = None
+
+    @property
+    def wikitext(self) -> Wikicode:
+        if self._wikitext is None:
+            self._wikitext = mwparse(self.texts[0])
+        return self._wikitext
+
+    def params_list(self, matches: str) -> list[Params]:
+        """Same as `WikiTool.get_page_params_list`"""
+        if not self.texts[0]:
+            return []
+        values = self.memo.get(matches)
+        if values is None:
+            templates = parse_template_list(self.wikitext, matches)
+            values = [dict(params) for params in templates]
+            self.memo[matches] = self.parsed[matches] = values
+        return [Params(params) for params in values]
+
+    def params(self, matches: str) -> Params:
+        params = self.params_list(matches)
+        return params[0] if params else Params()
+
+
+def _parse_job(
+    fn: Callable[[PageSource], _R],
+    texts: tuple[str, ...],
+    memo: dict[str, list[dict[str, str]]],
+) -> tuple[_R, dict[str, list[dict[str, str]]]]:
+    source = PageSource(texts, memo)
+    return fn(source), source.parsed
+
+
+class PagePool:
+    """Spawned processes shared by all `parse_pages` calls.
+
+    Workers are started on first use, so the parsers are imported once per
+    worker instead of once per call. Spawned workers only get picklable texts,
+    none of the locks, threads or sqlite connections of this process.
+    """
+
+    def __init__(self, processes: int = 0):
+        self.processes = processes or os.cpu_count() or 1
+        self._executor: ProcessPoolExecutor | None = None
+
+    def map(self, fn: Callable[..., _R], *iterables, count: int) -> Iterator[_R]:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                self.processes, mp_context=multiprocessing.get_context("spawn")
+            )
+        chunksize = max(1, count // (self.processes * 4))
+        return self._executor.map(fn, *iterables, chunksize=chunksize)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> "PagePool":
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+
+def parse_pages(
+    fn: Callable[[PageSource], _R],
+    wiki: WikiTool,
+    names: list[tuple[str, ...]],
+    pool: PagePool | None = None,
+    name: str = "",
+) -> list[_R]:
+    """Results of `fn` for every tuple of page names in order, serial without pool"""
+    texts = [tuple(wiki.get_page_text(n) for n in page_names) for page_names in names]
+    memos = [
+        wiki.get_params_memo(page_names[0], page_texts[0]) if page_texts[0] else {}
+        for page_names, page_texts in zip(names, texts)
+    ]
+    t0 = time.perf_counter()
+    if pool is None or pool.processes <= 1 or len(names) <= 1:
+        processes = 1
+        outputs = [_parse_job(fn, *args) for args in zip(texts, memos)]
+    else:
+        processes = pool.processes
+        outputs = list(pool.map(_parse_job, repeat(fn), texts, memos, count=len(names)))
+    logger.info(
+        f"[{name}] parsed {len(names)} pages in {time.perf_counter() - t0:.2f}s, "
+        f"{processes} processes"
+    )
+    results: list[_R] = []
+    for page_names, page_texts, (result, parsed) in zip(names, texts, outputs):
+        for matches, values in parsed.items():
+            wiki.set_params_memo(page_names[0], page_texts[0], matches, values)
+        results.append(result)
+    return results
+
+
+def mc_svt_af_files(params: Params) -> list[str]:
+    filenames: list[str] = []
+    # FGL
+    for index in range(1, 15):
+        if "Grail League" in (params.get(f"立绘{index}") or ""):
+            illustration = params.get(f"文件{index}")
+            if illustration:
+                filenames.append(f"{illustration}.png")
+    # riyo-old
+    for index in range(1, 15):
+        if "愚人节（背景变更前）" in (params.get(f"立绘{index}") or ""):
+            illustration = params.get(f"文件{index}")
+            if illustration:
+                filenames.append(f"{illustration}.png")
+    return filenames
+
+
+def mc_svt_sprite_files(source: PageSource) -> list[str]:
+    filenames: list[str] = []
+    for params in source.params_list(r"^{{战斗形象"):
+        for key, value in params.items():
+            if ("模型" in key or "灵衣" in key) and str(value).endswith(".png"):
+                filenames.append(value)
+    return filenames
+
+
+@dataclass
+class McSvtPage:
+    svt_names: list[tuple[str, str]] = field(default_factory=list)  # (jp, cn)
+    nicknames: list[str] = field(default_factory=list)
+    obtain: str | None = None  # 获取途径
+    af_files: list[str] = field(default_factory=list)
+    april_profile_jp: list[str] = field(default_factory=list)
+    april_profile_cn: list[str] = field(default_factory=list)
+    profiles: dict[int, list[str]] = field(default_factory=dict)
+    skill_names: list[tuple[str, str]] = field(default_factory=list)
+    td_names: list[tuple[str, str]] = field(default_factory=list)
+    td_ruby: list[tuple[str, str]] = field(default_factory=list)
+    sprite_files: list[str] = field(default_factory=list)
+
+
+def parse_mc_svt(source: PageSource) -> McSvtPage:
+    page = McSvtPage()
+    params = source.params(r"^{{基础数值")
+    for prefix in ("", "战斗", "卡面"):
+        for idx in ("", 1, 2, 3, 4, 5):
+            name_cn = params.get2(f"中文{prefix}名{idx}")
+            name_jp = params.get2(f"日文{prefix}名{idx}")
+            if name_cn and name_jp:
+                page.svt_names.append((name_jp, name_cn))
+    page.nicknames = re.split(r"[,，&]", params.get2("昵称") or "")
+    page.obtain = params.get2("获取途径")
+    page.af_files = mc_svt_af_files(params)
+
+    for params in source.params_list(r"^{{愚人节资料"):
+        text_jp, text_cn = params.get2("日文"), params.get2("中文")
+        if text_jp:
+            page.april_profile_jp.append(text_jp)
+        if text_cn:
+            page.april_profile_cn.append(text_cn)
+
+    for params in source.params_list(r"^{{个人资料"):
+        for index in range(8):
+            prefix = "详情" if index == 0 else f"资料{index}"
+            comment = params.get2(prefix) or ""
+            if comment:
+                page.profiles.setdefault(index, []).append(comment)
+
+    for params in source.params_list(r"^{{持有技能"):
+        text_cn, text_jp = params.get2(2), params.get2(3)
+        if text_cn and text_jp:
+            page.skill_names.append((text_jp, text_cn))
+
+    for params in source.params_list(r"^{{宝具"):
+        td_name_cn, td_ruby_cn = params.get2("中文名"), params.get2("国服上标")
+        td_name_jp, td_ruby_jp = params.get2("日文名"), params.get2("日服上标")
+        if td_name_cn and td_name_jp:
+            page.td_names.append((td_name_jp, td_name_cn))
+        if td_ruby_cn and td_ruby_jp:
+            page.td_ruby.append((td_ruby_jp, td_ruby_cn))
+    page.sprite_files = mc_svt_sprite_files(source)
+    return page
+
+
+@dataclass
+class McCePage:
+    name_cn: str | None = None
+    name_jp: str | None = None
+    profile_cn: str | None = None
+    charas: list[str] = field(default_factory=list)  # unresolved 出场角色
+    obtain: str | None = None  # 礼装分类
+    skill_des: str | None = None
+
+
+def parse_mc_ce(source: PageSource) -> McCePage:
+    params = source.params(r"^{{概念礼装")
+    page = McCePage(
+        name_cn=params.get2("名称"),
+        name_jp=params.get2("日文名称"),
+        profile_cn=params.get2("解说"),
+        obtain=params.get2("礼装分类"),
+        skill_des=params.get2("持有技能"),
+    )
+    for index in range(20):
+        key = "出场角色" if index == 0 else index
+        chara = params.get2(key)
+        if chara:
+            page.charas.append(chara)
+    return page
+
+
+@dataclass
+class FandomSvtPage:
+    collection_no: int | None = None
+    profiles: dict[int, list[str]] = field(default_factory=dict)
+    april_profiles: list[str] = field(default_factory=list)
+    sprite_files: list[str] = field(default_factory=list)
+
+
+def parse_fandom_svt(source: PageSource) -> FandomSvtPage:
+    info_param = source.params(r"^{{CharactersNew")
+    page = FandomSvtPage(collection_no=info_param.get_cast("id", int))
+    if not page.collection_no:
+        return page
+
+    for params in source.params_list(r"^{{Biography"):
+        for index in range(8):
+            if index == 0:
+                suffix = "def"
+            elif index == 6:
+                suffix = "ex"
+            else:
+                suffix = f"b{index}"
+            comment = params.get2("n" + suffix) or params.get2(suffix) or ""
+            if comment:
+                page.profiles.setdefault(index, []).append(comment)
+        apex = params.get2("apex")
+        if apex:
+            page.april_profiles.append(apex)
+
+    sprites_text = str(
+        mwparse(mwparse(source.texts[1]).get_sections(levels=[2], matches="Sprites"))
+    )
+    sprites_text = sprites_text.strip()
+    if not sprites_text:
+        images_section = source.wikitext.get_sections(levels=[2], matches="Images")
+        sprites_text = find_tabber(images_section, "Sprites")
+
+    if sprites_text:
+        for line in sprites_text.split("\n"):
+            cells = [c.strip() for c in line.strip().split("|")]
+            if len(cells) != 2:
+                continue
+            fn, name = cells
+            if "Command Card" in name or "NP Logo" in name:
+                continue
+            if fn:
+                page.sprite_files.append(fn)
+    return page
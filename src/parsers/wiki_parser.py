@@ -8,6 +8,7 @@ Summon: wiki_data/summons.json + MC data
 import binascii
 import re
 from collections import defaultdict
+from collections.abc import Iterable
 from datetime import datetime
 from urllib.parse import urlparse
 
@@ -18,6 +19,7 @@ from app.schemas.nice import NiceEquip, NiceEvent, NiceLoreComment, NiceServant
 
 from ..config import PayloadSetting, settings
 from ..schemas.common import (
+    AtlasExportFile,
     CEObtain,
     DataVersion,
     MappingStr,
@@ -49,16 +51,21 @@ from ..utils.helper import (
     sort_dict,
 )
 from ..wiki import FANDOM, MOONCELL
-from ..wiki.template import (
-    find_tabber,
-    mwparse,
-    parse_template,
-    parse_template_list,
-    remove_tag,
-)
+from ..wiki.template import mwparse, parse_template_list, remove_tag
 from ..wiki.wiki_tool import KnownTimeZone
 from .core.aa_export import update_exported_files
+from .core.export_store import EXPORTS
 from .wiki import replace_banner_url
+from .wiki.pages import (
+    FandomSvtPage,
+    McCePage,
+    McSvtPage,
+    PagePool,
+    parse_fandom_svt,
+    parse_mc_ce,
+    parse_mc_svt,
+    parse_pages,
+)
 
 ENEMY_COLLECTION_IDS = (83, 149, 151, 152, 168, 240, 333, 411, 412, 436, 443, 460)
 
@@ -77,23 +84,16 @@ class _WikiTemp:
             self._load_events()
 
     def _load_svts(self):
-        servants = parse_json_file_as(
-            list[NiceServant],
-            f"{settings.atlas_export_dir}/{self.region}/nice_servant_lore.json",
+        servants = EXPORTS.get_list(
+            self.region, AtlasExportFile.nice_servant_lore, NiceServant
         )
         self.released_svts = {e.collectionNo: e for e in servants}
 
-        ces = parse_json_file_as(
-            list[NiceEquip],
-            f"{settings.atlas_export_dir}/{self.region}/nice_equip_lore.json",
-        )
+        ces = EXPORTS.get_list(self.region, AtlasExportFile.nice_equip_lore, NiceEquip)
         self.released_ces = {e.collectionNo: e for e in ces}
 
     def _load_events(self):
-        events = parse_json_file_as(
-            list[NiceEvent],
-            f"{settings.atlas_export_dir}/{self.region}/nice_event.json",
-        )
+        events = EXPORTS.get_list(self.region, AtlasExportFile.nice_event, NiceEvent)
         self.events = {e.id: e for e in events}
 
 
@@ -107,6 +107,8 @@ class WikiParser:
         self._fandom = _WikiTemp(Region.NA)
         self._jp = _WikiTemp(Region.JP)
         self.payload = PayloadSetting()
+        # shared by all `parse_pages` calls of `start`, serial if None
+        self.page_pool: PagePool | None = None
 
     @property
     def mc_transl(self) -> WikiTranslation:
@@ -128,8 +130,9 @@ class WikiParser:
         self._jp.init()
         self._mc.init()
         self._fandom.init()
-        MOONCELL.load(payload.clear_wiki_empty)
-        FANDOM.load(payload.clear_wiki_empty)
+        EXPORTS.log_stats()
+        MOONCELL.load(payload.clear_wiki_empty, payload.wiki_checkpoint_every)
+        FANDOM.load(payload.clear_wiki_empty, payload.wiki_checkpoint_every)
         if payload.clear_cache_wiki or payload.clear_cache_mc:
             logger.warning("clear all Mooncell wiki caches")
             MOONCELL.clear()
@@ -139,6 +142,7 @@ class WikiParser:
                 payload.clear_wiki_moved,
                 payload.clear_wiki_deleted,
                 payload.mc_pages_to_clear,
+                payload.clear_wiki_by_revid,
             )
 
         if payload.clear_cache_wiki or payload.clear_cache_mc:
@@ -150,37 +154,40 @@ class WikiParser:
                 payload.clear_wiki_moved,
                 payload.clear_wiki_deleted,
                 payload.fandom_pages_to_clear,
+                payload.clear_wiki_by_revid,
             )
 
-        self.init_wiki_data()
-        logger.info("[MC] parsing servant data")
-        self.mc_svt()
-        logger.info("[MC] parsing craft essence data")
-        self.mc_ce()
-        logger.info("[MC] parsing command code data")
-        self.mc_cc()
-        logger.info("[MC] parsing mystic code data")
-        self.mc_mystic()
-        logger.info("[MC] parsing campaign")
-        self.mc_campaigns()
-        logger.info("[MC] parsing event/war/quest data")
-        self.mc_events()
-        self.mc_wars()
-        self.mc_quests()
-        logger.info("[MC] parsing summon data")
-        self.mc_summon()
-        logger.info("[MC] parsing extra data")
-        self.mc_extra()
-        logger.info("[Fandom] parsing servant data")
-        self.fandom_svt()
-        logger.info("[Fandom] parsing craft essence data")
-        self.fandom_ce()
-        logger.info("[Fandom] parsing command code data")
-        self.fandom_cc()
-        logger.info("[Fandom] parsing quest from main story")
-        self.fandom_quests()
-        logger.info("[Fandom] parsing extra data")
-        self.fandom_extra()
+        self.page_pool = PagePool(payload.wiki_parse_processes)
+        with self.page_pool:
+            self.init_wiki_data()
+            logger.info("[MC] parsing servant data")
+            self.mc_svt()
+            logger.info("[MC] parsing craft essence data")
+            self.mc_ce()
+            logger.info("[MC] parsing command code data")
+            self.mc_cc()
+            logger.info("[MC] parsing mystic code data")
+            self.mc_mystic()
+            logger.info("[MC] parsing campaign")
+            self.mc_campaigns()
+            logger.info("[MC] parsing event/war/quest data")
+            self.mc_events()
+            self.mc_wars()
+            self.mc_quests()
+            logger.info("[MC] parsing summon data")
+            self.mc_summon()
+            logger.info("[MC] parsing extra data")
+            self.mc_extra()
+            logger.info("[Fandom] parsing servant data")
+            self.fandom_svt()
+            logger.info("[Fandom] parsing craft essence data")
+            self.fandom_ce()
+            logger.info("[Fandom] parsing command code data")
+            self.fandom_cc()
+            logger.info("[Fandom] parsing quest from main story")
+            self.fandom_quests()
+            logger.info("[Fandom] parsing extra data")
+            self.fandom_extra()
 
         self.check_invalid_wikilinks()
         logger.info("[wiki] official banner")
@@ -275,7 +282,16 @@ class WikiParser:
         if no_index_ids:
             logger.info(f"svt not in index: {no_index_ids}")
 
-        def _parse_one(col_no: int):
+        def _set_link(col_no: int) -> str | None:
+            svt_add = self.wiki_data.get_svt(col_no)
+            svt_add.mcLink = extra_pages.get(col_no) or svt_add.mcLink
+            if svt_add.mcLink:
+                svt_add.mcLink = (
+                    MOONCELL.moved_pages.get(svt_add.mcLink) or svt_add.mcLink
+                )
+            return svt_add.mcLink
+
+        def _merge_one(col_no: int, page: McSvtPage | None):
             svt_add = self.wiki_data.get_svt(col_no)
 
             svt = self._jp.released_svts[col_no]
@@ -283,7 +299,6 @@ class WikiParser:
 
             record = index_data.get(col_no)
             nicknames: set[str] = set()
-            svt_add.mcLink = extra_pages.get(col_no) or svt_add.mcLink
             if record:
                 nicknames.update([s.strip() for s in record["name_other"].split("&")])
                 obtains: list[SvtObtain] = []
@@ -295,20 +310,13 @@ class WikiParser:
                 obtains = list(set(obtains))
                 svt_add.obtains = sorted(obtains)
 
-            if not svt_add.mcLink:
+            if page is None:
                 return
-            svt_add.mcLink = MOONCELL.moved_pages.get(svt_add.mcLink) or svt_add.mcLink
 
             # profile
-            wikitext = mwparse(MOONCELL.get_page_text(svt_add.mcLink))
-            params = parse_template(wikitext, r"^{{基础数值")
-            for prefix in ("", "战斗", "卡面"):
-                for idx in ("", 1, 2, 3, 4, 5):
-                    name_cn = params.get2(f"中文{prefix}名{idx}")
-                    name_jp = params.get2(f"日文{prefix}名{idx}")
-                    if name_cn and name_jp:
-                        self.mc_transl.svt_names[name_jp] = name_cn
-            nicknames.update(re.split(r"[,，&]", params.get2("昵称") or ""))
+            for name_jp, name_cn in page.svt_names:
+                self.mc_transl.svt_names[name_jp] = name_cn
+            nicknames.update(page.nicknames)
             if svt_add.nicknames.CN:
                 nicknames.update(svt_add.nicknames.CN)
             nicknames = {s for s in nicknames if s}
@@ -318,9 +326,8 @@ class WikiParser:
                 svt_add.nicknames.CN = None
 
             if not svt_add.obtains:
-                detail_obtain = params.get2("获取途径")
-                if detail_obtain:
-                    obtain = SvtObtain.from_cn2(detail_obtain)
+                if page.obtain:
+                    obtain = SvtObtain.from_cn2(page.obtain)
                     svt_add.obtains.append(obtain)
 
             EXTERNAL_BASE = "https://static.atlasacademy.io/JP/External"
@@ -377,65 +384,28 @@ class WikiParser:
                 af_assets.append(MOONCELL.get_image_url("083所罗门愚人节.png"))
             if svt_add.collectionNo == 150:
                 af_assets.append(MOONCELL.get_image_url("梅林-愚人节2021.png"))
-            # FGL - mc
-            for index in range(1, 15):
-                if "Grail League" in (params.get(f"立绘{index}") or ""):
-                    illustration = params.get(f"文件{index}")
-                    if illustration:
-                        af_assets.append(MOONCELL.get_image_url(f"{illustration}.png"))
-            # riyo-old mc
-            for index in range(1, 15):
-                if "愚人节（背景变更前）" in (params.get(f"立绘{index}") or ""):
-                    illustration = params.get(f"文件{index}")
-                    if illustration:
-                        af_assets.append(MOONCELL.get_image_url(f"{illustration}.png"))
-
-            april_profile_jp, april_profile_cn = [], []
-            for params in parse_template_list(wikitext, r"^{{愚人节资料"):
-                text_jp, text_cn = params.get2("日文"), params.get2("中文")
-                if text_jp:
-                    april_profile_jp.append(text_jp)
-                if text_cn:
-                    april_profile_cn.append(text_cn)
-            if april_profile_jp:
-                svt_add.aprilFoolProfile.JP = "\n\n".join(april_profile_jp)
-            if april_profile_cn:
-                svt_add.aprilFoolProfile.CN = "\n\n".join(april_profile_cn)
+            # FGL - mc, riyo-old mc
+            for filename in page.af_files:
+                af_assets.append(MOONCELL.get_image_url(filename))
+
+            if page.april_profile_jp:
+                svt_add.aprilFoolProfile.JP = "\n\n".join(page.april_profile_jp)
+            if page.april_profile_cn:
+                svt_add.aprilFoolProfile.CN = "\n\n".join(page.april_profile_cn)
 
             need_profile = self._need_wiki_profile(Region.CN, svt_add.collectionNo)
             if need_profile:
-                for params in parse_template_list(wikitext, r"^{{个人资料"):
-                    for index in range(8):
-                        prefix = "详情" if index == 0 else f"资料{index}"
-                        comment = params.get2(prefix) or ""
-                        if comment:
-                            profiles = svt_add.mcProfiles.setdefault(index, [])
-                            profiles.append(comment)
-
-            for params in parse_template_list(wikitext, r"^{{持有技能"):
-                text_cn, text_jp = params.get2(2), params.get2(3)
-                if text_cn and text_jp:
-                    self.mc_transl.skill_names[text_jp] = text_cn
-            # for params in parse_template_list(wikitext, r"^{{职阶技能"):
-            #     for i in range(len(params.keys()) // 5):
-            #         text_cn, text_jp = params.get2(5 * i + 2), params.get2(5 * i + 3)
-            #         rank = params.get2(5 * i + 4)
-            #         if text_cn and text_jp:
-            #             if rank:
-            #                 text_cn, text_jp = f"{text_jp} {rank}", f"{text_cn} {rank}"
-            #             self.mc_transl.skill_names[text_jp] = text_cn
-
-            for params in parse_template_list(wikitext, r"^{{宝具"):
-                td_name_cn, td_ruby_cn = params.get2("中文名"), params.get2("国服上标")
-                td_name_jp, td_ruby_jp = params.get2("日文名"), params.get2("日服上标")
-                if td_name_cn and td_name_jp:
-                    self.mc_transl.td_names[td_name_jp] = td_name_cn
-                if td_ruby_cn and td_ruby_jp:
-                    self.mc_transl.td_ruby[td_ruby_jp] = td_ruby_cn
-            for params in parse_template_list(wikitext, r"^{{战斗形象"):
-                for key, value in params.items():
-                    if ("模型" in key or "灵衣" in key) and str(value).endswith(".png"):
-                        svt_add.mcSprites.append(MOONCELL.get_image_name(value))
+                for index, comments in page.profiles.items():
+                    svt_add.mcProfiles.setdefault(index, []).extend(comments)
+
+            for text_jp, text_cn in page.skill_names:
+                self.mc_transl.skill_names[text_jp] = text_cn
+            for td_name_jp, td_name_cn in page.td_names:
+                self.mc_transl.td_names[td_name_jp] = td_name_cn
+            for td_ruby_jp, td_ruby_cn in page.td_ruby:
+                self.mc_transl.td_ruby[td_ruby_jp] = td_ruby_cn
+            for filename in page.sprite_files:
+                svt_add.mcSprites.append(MOONCELL.get_image_name(filename))
 
             # td_av_text = MOONCELL.get_page_text(f"{svt_add.mcLink}/宝具动画")
             # for params in parse_template_list(td_av_text, r"^{{宝具动画"):
@@ -443,17 +413,40 @@ class WikiParser:
             #     p = params.get_cast("p", int) or 1
             #     svt_add.tdAnimations.append(BiliVideo(av=av, p=p))
 
-        worker = Worker.from_map(
-            _parse_one,
+        col_nos = sorted(
             set(self.wiki_data.servants.keys())
             | set(index_data.keys())
-            | set(extra_pages.keys()),
-            name="mc_svt",
+            | set(extra_pages.keys())
         )
-        worker.wait()
+        links = {col_no: _set_link(col_no) for col_no in col_nos}
+        links = {col_no: link for col_no, link in links.items() if link}
+        _mc_prefetch(list(links.values()))
+        pages = dict(
+            zip(
+                links.keys(),
+                parse_pages(
+                    parse_mc_svt,
+                    MOONCELL,
+                    [(link,) for link in links.values()],
+                    self.page_pool,
+                    "mc_svt",
+                ),
+            )
+        )
+        image_names = [
+            "玛修·基列莱特-卡面-y.png",
+            "083所罗门愚人节.png",
+            "梅林-愚人节2021.png",
+        ]
+        for page in pages.values():
+            image_names += page.af_files + page.sprite_files
+        MOONCELL.prefetch_images(image_names)
+        for col_no in col_nos:
+            _merge_one(col_no, pages.get(col_no))
         for i in range(ord("A"), ord("Z") + 1):
-            wikitext = MOONCELL.get_page(f"技能一览/职阶技能/{chr(i)}")
-            for params in parse_template_list(wikitext, r"{{职阶技能一览"):
+            for params in MOONCELL.get_page_params_list(
+                f"技能一览/职阶技能/{chr(i)}", r"{{职阶技能一览"
+            ):
                 skill_cn, skill_jp = params.get2(1), params.get2(2)
                 if skill_cn and skill_jp:
                     self.mc_transl.skill_names.setdefault(skill_jp, skill_cn)
@@ -528,11 +521,17 @@ class WikiParser:
             logger.info(f"ce not in index: {no_index_ids}")
         region_campaign_ces = {k for v in ADD_CES.values() for k in v}
 
-        def _parse_one(ce_id: int):
+        def _set_link(ce_id: int) -> str | None:
+            ce_add = self.wiki_data.get_ce(ce_id)
+            ce_add.mcLink = extra_pages.get(ce_id) or ce_add.mcLink
+            if ce_add.mcLink:
+                ce_add.mcLink = MOONCELL.moved_pages.get(ce_add.mcLink) or ce_add.mcLink
+            return ce_add.mcLink
+
+        def _merge_one(ce_id: int, page: McCePage | None):
             ce_add = self.wiki_data.get_ce(ce_id)
             if ce_id in region_campaign_ces:
                 ce_add.obtain = CEObtain.campaign
-            ce_add.mcLink = extra_pages.get(ce_id) or ce_add.mcLink
 
             record = index_data.get(ce_id)
             if record:
@@ -547,36 +546,25 @@ class WikiParser:
                     des_max = remove_tag(des_max).replace("\n", "").strip()
                     self.mc_transl.ce_skill_des_max[ce_add.collectionNo] = des_max
 
-            if not ce_add.mcLink:
+            if page is None:
                 return
-            ce_add.mcLink = MOONCELL.moved_pages.get(ce_add.mcLink) or ce_add.mcLink
 
-            wikitext = mwparse(MOONCELL.get_page_text(ce_add.mcLink))
-            params = parse_template(wikitext, r"^{{概念礼装")
-            name_cn = params.get2("名称")
-            name_jp = params.get2("日文名称")
-            if name_cn and name_jp:
-                self.mc_transl.ce_names[name_jp] = name_cn
-            profile_cn = params.get2("解说")
-            if profile_cn:
-                ce_add.profile.CN = profile_cn
+            if page.name_cn and page.name_jp:
+                self.mc_transl.ce_names[page.name_jp] = page.name_cn
+            if page.profile_cn:
+                ce_add.profile.CN = page.profile_cn
             ce_add.characters = []
             ce_add.unknownCharacters = []
-            for index in range(20):
-                key = "出场角色" if index == 0 else index
-                chara = params.get2(key)
-                if not chara:
-                    continue
+            for chara in page.charas:
                 known_, unknown_ = self._parse_chara(chara)
                 ce_add.characters.extend(known_)
                 ce_add.unknownCharacters.extend(unknown_)
             ce_add.characters = sorted(set(ce_add.characters))
             ce_add.unknownCharacters = sorted(set(ce_add.unknownCharacters))
-            detail_obtain = params.get2("礼装分类")
-            if ce_add.obtain == CEObtain.unknown and detail_obtain:
-                ce_add.obtain = CEObtain.from_cn2(detail_obtain)
+            if ce_add.obtain == CEObtain.unknown and page.obtain:
+                ce_add.obtain = CEObtain.from_cn2(page.obtain)
 
-            skill_des = params.get2("持有技能")
+            skill_des = page.skill_des
             if skill_des and skill_des != "无效果" and not jp_chars.search(skill_des):
                 lines = skill_des.splitlines()
                 if len(lines) == 2 and "最大解放" in skill_des:
@@ -591,15 +579,29 @@ class WikiParser:
                         ce_add.collectionNo, lines[0].strip()
                     )
 
-        worker = Worker.from_map(
-            _parse_one,
+        ce_ids = sorted(
             set(self.wiki_data.craftEssences.keys())
             | set(index_data.keys())
             | set(extra_pages.keys())
-            | region_campaign_ces,
-            name="mc_ce",
+            | region_campaign_ces
         )
-        worker.wait()
+        links = {ce_id: _set_link(ce_id) for ce_id in ce_ids}
+        links = {ce_id: link for ce_id, link in links.items() if link}
+        _mc_prefetch(list(links.values()))
+        pages = dict(
+            zip(
+                links.keys(),
+                parse_pages(
+                    parse_mc_ce,
+                    MOONCELL,
+                    [(link,) for link in links.values()],
+                    self.page_pool,
+                    "mc_ce",
+                ),
+            )
+        )
+        for ce_id in ce_ids:
+            _merge_one(ce_id, pages.get(ce_id))
 
     def mc_cc(self):
         index_data = _mc_index_data("指令纹章图鉴/数据")
@@ -631,8 +633,7 @@ class WikiParser:
                 return
             cc_add.mcLink = MOONCELL.moved_pages.get(cc_add.mcLink) or cc_add.mcLink
 
-            wikitext = mwparse(MOONCELL.get_page_text(cc_add.mcLink))
-            params = parse_template(wikitext, r"^{{指令纹章")
+            params = MOONCELL.get_page_params(cc_add.mcLink, r"^{{指令纹章")
             name_cn = params.get2("名称")
             name_jp = params.get2("日文名称")
             if name_cn and name_jp and cc_add.collectionNo != 113:
@@ -657,6 +658,10 @@ class WikiParser:
             cc_add.characters = sorted(set(cc_add.characters))
             cc_add.unknownCharacters = sorted(set(cc_add.unknownCharacters))
 
+        _mc_prefetch(
+            list(extra_pages.values())
+            + [cc.mcLink for cc in self.wiki_data.commandCodes.values()]
+        )
         worker = Worker.from_map(
             _parse_one,
             set(self.wiki_data.commandCodes.keys())
@@ -698,8 +703,7 @@ class WikiParser:
             if chara in self._svt_id_cache:
                 known.append(self._svt_id_cache[chara])
             else:
-                svt_text = MOONCELL.get_page_text(chara)
-                param_svt = parse_template(svt_text, r"^{{基础数值")
+                param_svt = MOONCELL.get_page_params(chara, r"^{{基础数值")
                 svt_no = param_svt.get_cast("序号", cast=int)
                 if svt_no:
                     self._svt_id_cache[chara] = svt_no
@@ -717,20 +721,19 @@ class WikiParser:
         cache = self._svt_id_cache if is_svt else self._ce_id_cache
 
         def _get_id(_chara: str) -> int | None:
-            page_text = MOONCELL.get_page_text(_chara)
             if is_svt:
                 match = re.match(r"^从者(\d+)$", _chara)
                 if match:
                     _card_id = int(str(match.group(1)).lstrip("0"))
                 else:
-                    param_svt = parse_template(page_text, r"^{{基础数值")
+                    param_svt = MOONCELL.get_page_params(_chara, r"^{{基础数值")
                     _card_id = param_svt.get_cast("序号", cast=int)
             else:
                 match = re.match(r"^礼装(\d+)$", _chara)
                 if match:
                     _card_id = int(str(match.group(1)).lstrip("0"))
                 else:
-                    param_svt = parse_template(page_text, r"^{{概念礼装")
+                    param_svt = MOONCELL.get_page_params(_chara, r"^{{概念礼装")
                     _card_id = param_svt.get_cast("礼装id", cast=int)
             if _card_id is None and "･" in _chara:
                 _card_id = _get_id(_chara.replace("･", "・"))
@@ -777,93 +780,64 @@ class WikiParser:
         return known, unknown
 
     def fandom_svt(self):
-        def _parse_one(link: str):
-            text = mwparse(FANDOM.get_page_text(link))
-            info_param = parse_template(text, r"^{{CharactersNew")
-            collection_no = info_param.get_cast("id", int)
-            if not collection_no:
+        def _merge_one(link: str, page: FandomSvtPage):
+            if not page.collection_no:
                 return
-            svt_add: ServantW = self.wiki_data.get_svt(collection_no)
+            svt_add: ServantW = self.wiki_data.get_svt(page.collection_no)
             svt_add.fandomLink = link
-            text = mwparse(FANDOM.get_page_text(link))
 
             need_profile = self._need_wiki_profile(Region.NA, svt_add.collectionNo)
-            for params in parse_template_list(text, r"^{{Biography"):
-                if need_profile:
-                    for index in range(8):
-                        if index == 0:
-                            suffix = "def"
-                        elif index == 6:
-                            suffix = "ex"
-                        else:
-                            suffix = f"b{index}"
-                        comment = params.get2("n" + suffix) or params.get2(suffix) or ""
-                        if comment:
-                            profiles = svt_add.fandomProfiles.setdefault(index, [])
-                            profiles.append(comment)
-                apex = params.get2("apex")
-                if apex:
-                    if svt_add.aprilFoolProfile.NA:
-                        svt_add.aprilFoolProfile.NA += f"\n\n{apex}"
-                    else:
-                        svt_add.aprilFoolProfile.NA = apex
-
-            sprites = []
-            sprites_text = ""
-
-            images_section = FANDOM.get_page_text(f"Sub:{link}/Gallery")
-            sprites_text = str(
-                mwparse(
-                    mwparse(images_section).get_sections(levels=[2], matches="Sprites")
-                )
-            )
-            sprites_text = sprites_text.strip()
-            if not sprites_text:
-                images_section = text.get_sections(levels=[2], matches="Images")
-                sprites_text = find_tabber(images_section, "Sprites")
-
-            if sprites_text:
-                for line in sprites_text.split("\n"):
-                    cells = [c.strip() for c in line.strip().split("|")]
-                    if len(cells) != 2:
-                        continue
-                    fn, name = cells
-                    if "Command Card" in name or "NP Logo" in name:
-                        continue
-                    if fn:
-                        sprites.append(FANDOM.get_image_name(fn))
-            svt_add.fandomSprites = sprites
+            if need_profile:
+                for index, comments in page.profiles.items():
+                    svt_add.fandomProfiles.setdefault(index, []).extend(comments)
+            for apex in page.april_profiles:
+                if svt_add.aprilFoolProfile.NA:
+                    svt_add.aprilFoolProfile.NA += f"\n\n{apex}"
+                else:
+                    svt_add.aprilFoolProfile.NA = apex
+
+            svt_add.fandomSprites = [
+                FANDOM.get_image_name(fn) for fn in page.sprite_files
+            ]
 
-        worker = Worker("fandom_svt")
         subpages = self._get_fandom_list_page_sub(
             "Sub:Servant_List_by_ID/1-100", r"Sub\:Servant_List_by_ID/(\d+\-\d+)"
         )
         subpages.insert(0, "1-100")
+        links: list[str] = []
         for page in subpages:
             html_text = FANDOM.request(
                 f"https://fategrandorder.fandom.com/wiki/Sub:Servant_List_by_ID/{page}?action=render"
             )
-            links: list[str] = parse_html_xpath(
+            page_links: list[str] = parse_html_xpath(
                 html_text,
                 '//div[@class="mw-parser-output"]/table[2]/tbody/tr/td[2]/a/@href',
             )
             prefix = "https://fategrandorder.fandom.com/wiki/"
-            for link in links:
+            for link in page_links:
                 assert link.startswith(prefix), link
-                worker.add(_parse_one, FANDOM.norm_key(link[len(prefix) :]))
-        worker.wait()
+            links += [FANDOM.norm_key(link[len(prefix) :]) for link in page_links]
+        FANDOM.get_pages(links + [f"Sub:{link}/Gallery" for link in links])
+        pages = parse_pages(
+            parse_fandom_svt,
+            FANDOM,
+            [(link, f"Sub:{link}/Gallery") for link in links],
+            self.page_pool,
+            "fandom_svt",
+        )
+        for link, page in zip(links, pages):
+            _merge_one(link, page)
 
     def fandom_ce(self):
         def _parse_one(link: str):
-            wikitext = mwparse(FANDOM.get_page_text(link))
-            info_params = parse_template(wikitext, r"^{{Infoboxce2")
+            info_params = FANDOM.get_page_params(link, r"^{{Infoboxce2")
             collection_no = info_params.get_cast("id", int)
             if not collection_no:
                 return
 
             ce_add = self.wiki_data.get_ce(collection_no)
             ce_add.fandomLink = link
-            params = parse_template(wikitext, r"^{{Craftlore")
+            params = FANDOM.get_page_params(link, r"^{{Craftlore")
             profile = params.get2("na") or params.get2("en")
             if profile:
                 ce_add.profile.NA = profile
@@ -875,7 +849,7 @@ class WikiParser:
             if effect2 and effect2.upper() != "N/A":
                 self.fandom_transl.ce_skill_des_max[ce_add.collectionNo] = effect2
 
-        worker = Worker("fandom_ce")
+        worker = Worker("fandom_ce", pool="network")
 
         subpages = self._get_fandom_list_page_sub(
             "Craft_Essence_List/By_ID/1-100", r"Craft_Essence_List/By_ID/(\d+\-\d+)"
@@ -890,7 +864,10 @@ class WikiParser:
             prefix = "https://fategrandorder.fandom.com/wiki/"
             for link in links:
                 assert link.startswith(prefix), link
-                worker.add(_parse_one, FANDOM.norm_key(link[len(prefix) :]))
+            links = [FANDOM.norm_key(link[len(prefix) :]) for link in links]
+            FANDOM.get_pages(links)
+            for link in links:
+                worker.add(_parse_one, link)
         worker.wait()
 
     def fandom_cc(self):
@@ -908,21 +885,28 @@ class WikiParser:
             )
             logger.debug(f"Fandom: ({page}) {len(pages)} command codes")
             prefix = "https://fategrandorder.fandom.com/wiki/"
+            FANDOM.get_pages(
+                [
+                    FANDOM.norm_key(str(link)[len(prefix) :])
+                    for link in pages
+                    if str(link).startswith(prefix)
+                ]
+            )
             for page_link in pages:
                 page_link = str(page_link)
                 assert page_link.startswith(prefix), page_link
                 fa_link = FANDOM.norm_key(page_link[len(prefix) :])
-                wikitext = mwparse(FANDOM.get_page_text(fa_link))
+                wikitext = FANDOM.get_page_text(fa_link)
                 assert fa_link and wikitext, fa_link
                 if not fa_link or not wikitext:
                     continue
-                infoboxcc = parse_template(wikitext, r"^{{Infoboxcc")
+                infoboxcc = FANDOM.get_page_params(fa_link, r"^{{Infoboxcc")
                 collection_no = infoboxcc.get_cast("id", cast=int)
                 if not collection_no or not infoboxcc:
                     continue
                 cc_add = self.wiki_data.get_cc(collection_no)
                 cc_add.fandomLink = fa_link
-                params = parse_template(wikitext, r"^{{Craftlore")
+                params = FANDOM.get_page_params(fa_link, r"^{{Craftlore")
                 cc_add.profile.NA = params.get2("na") or params.get2("en")
 
                 effect1 = infoboxcc.get2("effect1", strip=True)
@@ -947,8 +931,7 @@ class WikiParser:
         titles = [x["fulltext"] for x in MOONCELL.ask_query("[[EventType::Campaign]]")]
         campaigns: list[CampaignEvent] = []
         for title in titles:
-            text = MOONCELL.get_page_text(title)
-            params = parse_template(text, r"^{{活动信息")
+            params = MOONCELL.get_page_params(title, r"^{{活动信息")
             name_jp = params.get2("名称jp")
             start_jp, end_jp = params.get("开始时间jp"), params.get("结束时间jp")
             if not name_jp or not start_jp or not end_jp:
@@ -1020,7 +1003,7 @@ class WikiParser:
                     f'Mooncell event page not found, may be moved: "{event.mcLink}"'
                 )
                 return
-            params = parse_template(text, r"^{{活动信息")
+            params = MOONCELL.get_page_params(event.mcLink, r"^{{活动信息")
             name_jp = params.get2("名称jp")
             name_cn = params.get2s("名称cn", "名称ha")
             if name_jp and name_cn:
@@ -1048,6 +1031,17 @@ class WikiParser:
 
             self.wiki_data.events[event.id] = event
 
+        events = self.wiki_data.events.values()
+        _mc_prefetch_banners(
+            _mc_prefetch([event.mcLink for event in events]), r"^{{活动信息"
+        )
+        FANDOM.get_pages(
+            [
+                FANDOM.moved_pages.get(FANDOM.norm_key(link), link)
+                for event in events
+                if (link := event.fandomLink)
+            ]
+        )
         worker = Worker.from_map(
             _parse_one, self.wiki_data.events.values(), name="mc_events"
         )
@@ -1076,7 +1070,7 @@ class WikiParser:
                     f'Mooncell main story page not found, may be moved: "{war.mcLink}"'
                 )
                 return
-            params = parse_template(text, r"^{{活动信息")
+            params = MOONCELL.get_page_params(war.mcLink, r"^{{活动信息")
 
             war.titleBanner.CN = MOONCELL.get_image_url_null(
                 params.get("标题图文件名cn")
@@ -1090,6 +1084,9 @@ class WikiParser:
             war.noticeLink.update(Region.JP, params.get2s("公告链接jp", "官网链接jp"))
             self.wiki_data.wars[war.id] = war
 
+        wars = self.wiki_data.wars.values()
+        _mc_prefetch_banners(_mc_prefetch([war.mcLink for war in wars]), r"^{{活动信息")
+        FANDOM.get_pages([war.fandomLink for war in wars if war.fandomLink])
         worker = Worker.from_map(
             _parse_one, self.wiki_data.wars.values(), name="mc_war"
         )
@@ -1097,8 +1094,7 @@ class WikiParser:
 
     def mc_quests(self):
         def _parse_one(title: str):
-            wikitext = mwparse(MOONCELL.get_page_text(title))
-            for params in parse_template_list(wikitext, r"^{{关卡配置"):
+            for params in MOONCELL.get_page_params_list(title, r"^{{关卡配置"):
                 quest_jp = params.get2("名称jp")
                 quest_cn = params.get2("名称cn")
                 if quest_jp and quest_cn:
@@ -1134,6 +1130,7 @@ class WikiParser:
             svt_add = self.wiki_data.servants.get(svt.collectionNo)
             if svt_add and svt_add.mcLink:
                 titles.add(f"{svt_add.mcLink}/从者任务")
+        MOONCELL.get_pages(sorted(titles))
         for title in sorted(titles):
             worker.add(_parse_one, title)
         worker.wait()
@@ -1171,12 +1168,12 @@ class WikiParser:
 
         def _parse_one(title: str):
             logger.info(f'[summon] parsing "{title}"...')
-            wikitext = mwparse(MOONCELL.get_page_text(title))
-            params = parse_template(wikitext, r"^{{卡池信息")
+            params = MOONCELL.get_page_params(title, r"^{{卡池信息")
             key = _gen_jp_notice_key(params.get("公告链接jp"))
             if not key:
+                wikitext = MOONCELL.get_page_text(title)
                 logger.info(
-                    f"[summon] [{title}] invalid, {len(str(wikitext))} chars, params={params}"
+                    f"[summon] [{title}] invalid, {len(wikitext)} chars, params={params}"
                 )
                 return
             if key in added_summons:
@@ -1238,8 +1235,7 @@ class WikiParser:
             events = [event for event in events if event]
             summon.relatedEvents = events
 
-            simulator_page = MOONCELL.get_page_text(f"{title}/模拟器")
-            sim_params = parse_template(simulator_page, r"^{{抽卡模拟器")
+            sim_params = MOONCELL.get_page_params(f"{title}/模拟器", r"^{{抽卡模拟器")
             ssr_str = sim_params.get2("福袋")
             if ssr_str:
                 if ssr_str and ssr_str.lower() == "ssrsr":
@@ -1269,11 +1265,13 @@ class WikiParser:
                         t_summon_data_table(table_str, sub_summon)
                         summon.subSummons.append(sub_summon)
 
-        worker = Worker("mc_summon")
+        worker = Worker("mc_summon", pool="network")
         titles = [
             answer["fulltext"] for answer in MOONCELL.ask_query("[[分类:限时召唤]]")
         ]
         logger.info(f"fetched {len(titles)} summons")
+        _mc_prefetch_banners(MOONCELL.get_pages(titles), r"^{{卡池信息")
+        MOONCELL.get_pages(f"{title}/模拟器" for title in titles)
         for title in sorted(titles):
             worker.add(_parse_one, title)
         worker.wait()
@@ -1298,8 +1296,7 @@ class WikiParser:
             discord.mc("Unknown PickUp Card", "\n".join(sorted(unknown_cards)))
 
     def mc_extra(self):
-        costume_page = MOONCELL.get_page_text("灵衣一览")
-        for params in parse_template_list(costume_page, r"^{{灵衣一览"):
+        for params in MOONCELL.get_page_params_list("灵衣一览", r"^{{灵衣一览"):
             name_cn, name_jp = params.get2("中文名"), params.get2("日文名")
             if name_cn and name_jp:
                 self.mc_transl.costume_names[name_jp] = name_cn
@@ -1311,8 +1308,7 @@ class WikiParser:
         # event item names
         item_pages = ["道具一览"] + [f"道具一览/活动道具/{i}" for i in range(1, 11)]
         for title in item_pages:
-            text = MOONCELL.get_page_text(title)
-            for params in parse_template_list(text, r"^{{活动道具表格"):
+            for params in MOONCELL.get_page_params_list(title, r"^{{活动道具表格"):
                 name_cn, name_jp = params.get2("中文名称"), params.get2("日文名称")
                 if name_cn and name_jp:
                     self.mc_transl.item_names[name_jp] = name_cn
@@ -1343,8 +1339,7 @@ class WikiParser:
                     if not is_event or "quest" in str(subtitle).lower():
                         titles.append(f"{title}/{subtitle}")
             for title in titles:
-                text = FANDOM.get_page_text(title)
-                for params in parse_template_list(text, r"^{{Questheader"):
+                for params in FANDOM.get_page_params_list(title, r"^{{Questheader"):
                     spot_jp = params.get2("jpnodename")
                     spot_en = params.get2("ennodename")
                     if spot_jp and spot_en:
@@ -1446,6 +1441,25 @@ class WikiParser:
         )
 
 
+def _mc_prefetch(links: list[str | None]) -> list[str]:
+    """Download pages in batches, returns page keys"""
+    return list(
+        MOONCELL.get_pages(
+            MOONCELL.moved_pages.get(MOONCELL.norm_key(link), link)
+            for link in links
+            if link
+        )
+    )
+
+
+def _mc_prefetch_banners(links: Iterable[str], template: str):
+    image_names: list[str | None] = []
+    for link in links:
+        params = MOONCELL.get_page_params(link, template)
+        image_names += [params.get("标题图文件名cn"), params.get("标题图文件名jp")]
+    MOONCELL.prefetch_images(image_names)
+
+
 def _mc_index_data(page: str) -> dict[int, dict[str, str]]:
     text = MOONCELL.get_page_text(page, allow_cache=settings.is_debug)
     data: dict[int, dict[str, str]] = {}
@@ -9,6 +9,8 @@ class _WikiPageBase(BaseModelORJson):
 class WikiPageInfo(_WikiPageBase):
     redirect: str | None = None
     text: str
+    revid: int | None = None  # lastrevid
+    touched: int | None = None
 
 
 class WikiImageInfo(_WikiPageBase):
@@ -1,3 +1,4 @@
+import threading
 from pathlib import Path
 
 from ..config import settings
@@ -7,21 +8,40 @@ from .log import logger
 from .url import DownUrl
 from .worker import Worker
 
+
 SECS_PER_DAY = 24 * 3600
 
 
-AtlasApi = HttpApiUtil(
-    api_server="https://api.atlasacademy.io",
-    rate_calls=4,
-    rate_period=1,
-    db_path=str(Path(settings.cache_http_cache / "atlas")),
-    expire_after=3600 * 24 * 60,
-)
-
-McApi = HttpApiUtil(
-    api_server="https://fgo.wiki/api.php",
-    rate_calls=3,
-    rate_period=1,
-    db_path=str(Path(settings.cache_http_cache / "mooncell")),
-    expire_after=3600 * 24 * 60,
-)
+# built on first access by `__getattr__`, so importing utils doesn't open the http
+# caches, e.g. in spawned workers
+AtlasApi: HttpApiUtil
+McApi: HttpApiUtil
+
+_API_SETTINGS: dict[str, dict] = {
+    "AtlasApi": dict(
+        api_server="https://api.atlasacademy.io",
+        rate_calls=4,
+        rate_period=1,
+        db_path=str(Path(settings.cache_http_cache / "atlas")),
+        expire_after=3600 * 24 * 60,
+    ),
+    "McApi": dict(
+        api_server="https://fgo.wiki/api.php",
+        rate_calls=3,
+        rate_period=1,
+        db_path=str(Path(settings.cache_http_cache / "mooncell")),
+        expire_after=3600 * 24 * 60,
+    ),
+}
+_apis_lock = threading.Lock()
+
+
+def __getattr__(name: str) -> HttpApiUtil:
+    kwargs = _API_SETTINGS.get(name)
+    if kwargs is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _apis_lock:
+        api = globals().get(name)
+        if api is None:
+            api = globals()[name] = HttpApiUtil(**kwargs)
+    return api
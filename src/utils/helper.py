@@ -1,11 +1,11 @@
 import datetime
+import json
 import os
 import platform
 import re
-import subprocess
 import threading
 import time
-from collections.abc import Callable, Iterable, Sequence
+from collections.abc import Callable, Iterable, Iterator, Sequence
 from decimal import Decimal
 from enum import Enum
 from operator import itemgetter
@@ -37,6 +37,69 @@ def parse_json_obj_as(type: type[_KT], obj) -> _KT:
     return TypeAdapter(type).validate_python(obj)
 
 
+_json_decoder = json.JSONDecoder()
+_json_space = re.compile(r"\s*")
+
+
+def iter_json_array(path: str | Path, chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """Decode elements of a top-level json array one at a time.
+
+    Only a chunk of text and the current element are held in memory instead of
+    the whole file and its decoded tree. Raise ValueError like `json.loads` for
+    invalid json, e.g. `[1,,2]`, `[1,]` or data after the array.
+    """
+    with open(path, encoding="utf-8") as f:
+        buf, chunk = "", " "
+        while chunk and not buf:
+            buf = (chunk := f.read(chunk_size)).lstrip()
+        if not buf.startswith("["):
+            raise ValueError(f"{path}: not a json array")
+        pos, eof, first = 1, False, True
+        while True:
+            pos = _json_space.match(buf, pos).end()  # type: ignore
+            if first and buf[pos : pos + 1] == "]":
+                end = pos + 1
+                break
+            try:
+                obj, end = _json_decoder.raw_decode(buf, pos)
+                # numbers may be truncated by the chunk, e.g. `-2.` of `-2.5`,
+                # so the element is done only if followed by a separator
+                end = _json_space.match(buf, end).end()  # type: ignore
+                sep = buf[end : end + 1]
+                done = sep in (",", "]")
+                if not done and eof:
+                    raise ValueError(f"{path}: invalid json array")
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"{path}: invalid json array, {e.msg}") from e
+                done = False
+            if not done:
+                # read at least the size of the kept buffer, elements larger
+                # than a chunk are decoded again O(log n) times only
+                more = f.read(max(chunk_size, len(buf) - pos))
+                buf, pos, eof = buf[pos:] + more, 0, not more
+                continue
+            yield obj
+            first = False
+            end += 1
+            if sep == "]":
+                break
+            pos = end
+        rest = buf[end:]
+        while rest or not eof:
+            if rest.strip():
+                raise ValueError(f"{path}: extra data after json array")
+            rest = f.read(chunk_size)
+            eof = not rest
+
+
+def iter_json_file_as(type: type[_KT], path: str | Path) -> Iterator[_KT]:
+    """Validate elements of a top-level json array one at a time"""
+    adapter = TypeAdapter(type)
+    for obj in iter_json_array(path):
+        yield adapter.validate_python(obj)
+
+
 def iter_model(
     model: BaseModel,
     # to_dict: bool = False,
@@ -185,9 +248,9 @@ def dump_json_beautify(
     option: int | None = None,
     sort_keys: bool | None = None,
 ) -> str | None:
-    dump_json(
+    text = dump_json(
         obj,
-        fp,
+        None,
         default,
         indent2=False,
         non_str_keys=True,
@@ -195,17 +258,141 @@ def dump_json_beautify(
         option=option,
         sort_keys=sort_keys,
     )
-    beautify_file(fp)
+    fp = Path(fp)
+    if not fp.parent.exists():
+        fp.parent.mkdir(parents=True)
+    fp.write_bytes(beautify_json(text.encode()))
 
 
 def beautify_file(fp: str | Path):
-    result = subprocess.run(["js-beautify", "-r", "-s=2", "-n", str(fp)], check=False)
-    if result.returncode != 0:
-        logger.error(
-            f"beautify run failed, exit={result.returncode}\n"
-            f"{result.stderr}\n{result.stdout}"
-        )
-    result.check_returncode()
+    fp = Path(fp)
+    fp.write_bytes(beautify_json(fp.read_bytes()))
+
+
+def beautify_json(data: bytes | str) -> bytes:
+    """Format json the same way as `js-beautify -s=2 -n` does.
+
+    Objects are always expanded, arrays are kept inline unless an array element
+    starts right after `[` or after another array/object, then the array is
+    expanded with one indent level.
+
+    Like js-beautify, numbers and strings are kept as written. Compact orjson
+    output is formatted from the parsed values, other input token by token.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    obj = orjson.loads(data)
+    if orjson.dumps(obj) != data:
+        obj = _parse_json_tokens(data)
+    out: list[bytes] = []
+    _beautify_value(obj, 0, out)
+    out.append(b"\n")
+    return b"".join(out)
+
+
+_json_token = re.compile(rb'"(?:[^"\\]|\\.)*"|[{}\[\],:]|[^\s{}\[\],:"]+')
+
+
+def _parse_json_tokens(data: bytes):
+    """Objects as tuples of (key, value) pairs, numbers/strings as raw bytes"""
+    tokens = _json_token.findall(data)
+    pos = 0
+
+    def _value():
+        nonlocal pos
+        token = tokens[pos]
+        pos += 1
+        if token == b"{":
+            pairs = []
+            while tokens[pos] != b"}":
+                key = tokens[pos]
+                pos += 2  # key, colon
+                pairs.append((key, _value()))
+                if tokens[pos] == b",":
+                    pos += 1
+            pos += 1
+            return tuple(pairs)
+        if token == b"[":
+            values = []
+            while tokens[pos] != b"]":
+                values.append(_value())
+                if tokens[pos] == b",":
+                    pos += 1
+            pos += 1
+            return values
+        return token
+
+    # valid json, already checked by orjson.loads
+    return _value()
+
+
+_NEW_LINES = [b"\n" + b"  " * i for i in range(32)]
+
+
+def _new_line(level: int) -> bytes:
+    if level < len(_NEW_LINES):
+        return _NEW_LINES[level]
+    return b"\n" + b"  " * level
+
+
+def _dump_token(value) -> bytes:
+    return value if isinstance(value, bytes) else orjson.dumps(value)
+
+
+def _beautify_value(obj, level: int, out: list[bytes]):
+    if isinstance(obj, (dict, tuple)):
+        if not obj:
+            out.append(b"{}")
+            return
+        sep = _new_line(level + 1)
+        out.append(b"{")
+        for k, v in obj.items() if isinstance(obj, dict) else obj:
+            out.append(sep)
+            out.append(_dump_token(k))
+            out.append(b": ")
+            if isinstance(v, (dict, tuple, list)):
+                _beautify_value(v, level + 1, out)
+            else:
+                out.append(_dump_token(v))
+            out.append(b",")
+        out[-1] = _new_line(level)
+        out.append(b"}")
+    elif isinstance(obj, list):
+        if not obj:
+            out.append(b"[]")
+            return
+        # element starts a new line: a list after `[` or after a list/dict
+        breaks: list[bool] = []
+        prev_container = True
+        has_container = False
+        for v in obj:
+            is_list = isinstance(v, list)
+            breaks.append(is_list and prev_container)
+            prev_container = is_list or isinstance(v, (dict, tuple))
+            has_container = has_container or prev_container
+        if not has_container:
+            out.append(b"[" + b", ".join(map(_dump_token, obj)) + b"]")
+            return
+        multiline = any(breaks)
+        inner = level + 1 if multiline else level
+        sep = _new_line(inner)
+        out.append(b"[")
+        for i, v in enumerate(obj):
+            if i > 0:
+                out.append(b",")
+                if not breaks[i]:
+                    out.append(b" ")
+            if breaks[i]:
+                out.append(sep)
+            if isinstance(v, (dict, tuple, list)):
+                _beautify_value(v, inner, out)
+            else:
+                out.append(_dump_token(v))
+        if multiline:
+            out.append(_new_line(level))
+        out.append(b"]")
+    else:
+        out.append(_dump_token(obj))
 
 
 def json_xpath(data: dict | list, path: str | Sequence, default=None):
@@ -2,19 +2,21 @@ import abc
 import asyncio
 import functools
 import re
+import threading
 import time
-from collections.abc import Generator
+from collections.abc import Generator, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from datetime import timedelta
-from typing import TypeVar
+from typing import Any, Callable, Coroutine, NamedTuple, TypeVar
 
 import orjson
 import requests
+import requests.adapters
 import requests_cache
 from app.schemas.common import Region
 from app.schemas.nice import NiceMasterMission, NiceQuestPhase
 from pydantic import ValidationError
-from ratelimit import limits, sleep_and_retry
 from requests import Response
 from requests_cache import CachedSession
 from requests_cache.backends.sqlite import SQLiteCache
@@ -22,8 +24,10 @@ from requests_cache.cache_control import ExpirationTime
 from requests_cache.models.response import CachedResponse
 
 from .helper import parse_json_obj_as
+from .sqlite_cache import IndexedSQLiteCache
+from .worker import ErrorBudget, ErrorBudgetExceeded, TaskStats
 
-__all__ = ["HttpApiUtil"]
+__all__ = ["HttpApiUtil", "QuestPhaseKey"]
 
 from requests_cache.session import FILTER_FN
 
@@ -33,6 +37,16 @@ _T = TypeVar("_T")
 
 FILTER_FN2 = FILTER_FN | bool | None
 
+# server errors retried with backoff, usually gone after a few seconds
+_TRANSIENT_STATUS = (500, 502, 503, 504)
+
+
+class QuestPhaseKey(NamedTuple):
+    quest_id: int
+    phase: int
+    region: Region = Region.JP
+    enemyHash: str | None = None
+
 
 @contextmanager
 def http_cache_enabled(**kwargs) -> Generator[CachedSession, None, None]:
@@ -60,6 +74,97 @@ def http_cache_enabled(**kwargs) -> Generator[CachedSession, None, None]:
         requests_cache.uninstall_cache()
 
 
+class TokenBucket:
+    """Rate limiter shared by threads and coroutines.
+
+    `delay` postpones all following calls, e.g. after 429 Too Many Requests,
+    including the ones already waiting for their reserved token.
+    """
+
+    def __init__(self, rate_calls: int, rate_period: float) -> None:
+        self.capacity = rate_calls
+        self.rate = rate_calls / rate_period
+        self._tokens = float(rate_calls)
+        # in the future while delayed, tokens are refilled from then on
+        self._updated_at = time.monotonic()
+        # total seconds of all delays, moves the waits of reserved tokens
+        self._shift = 0.0
+        self._lock = threading.Lock()
+
+    def split(self, n: int) -> "TokenBucket":
+        """A new bucket for one of `n` processes sharing this rate limit"""
+        calls = max(1, round(self.capacity / n))
+        return TokenBucket(calls, calls * n / self.rate)
+
+    def _refill(self, now: float):
+        if now > self._updated_at:
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+
+    def reserve(self) -> tuple[float, float]:
+        """Take one token, return the time it is ready and the current shift"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            return self._updated_at + max(-self._tokens, 0) / self.rate, self._shift
+
+    def wait_time(self, reservation: tuple[float, float]) -> float:
+        """Seconds to wait before using the reserved token, may grow by `delay`"""
+        ready_at, shift = reservation
+        return ready_at + self._shift - shift - time.monotonic()
+
+    def delay(self, seconds: float):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            push = now + seconds - self._updated_at
+            if push > 0:
+                self._updated_at += push
+                self._shift += push
+            # no burst when the delay is over
+            self._tokens = min(self._tokens, 0)
+
+    def acquire(self):
+        reservation = self.reserve()
+        while (wait := self.wait_time(reservation)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        reservation = self.reserve()
+        while (wait := self.wait_time(reservation)) > 0:
+            await asyncio.sleep(wait)
+
+
+def _get_retry_after(r: Response) -> float:
+    try:
+        header = r.headers.get("Retry-After")
+        match = re.match(r"wait (\d+) second", r.text)
+        if header:
+            return float(header) + 1
+        elif match:
+            return float(match.group(1)) + 1
+    except:  # noqa: E722
+        pass
+    return 6
+
+
+async def _gather_or_cancel(coros: Iterable[Coroutine[Any, Any, _T]]) -> list[_T]:
+    """Like `asyncio.gather`, but cancel the other tasks when one fails.
+
+    Cancelling also drops their requests still queued in the thread executor,
+    requests already sent run to completion in the background.
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
 class HttpApiUtil(abc.ABC):
     def __init__(
         self,
@@ -68,65 +173,116 @@ class HttpApiUtil(abc.ABC):
         rate_period: int = 1,
         db_path: str = "http_cache",
         expire_after=2592000,
+        pool_size: int = 16,
     ):
         self.api_server = api_server
-        self.cache_storage: SQLiteCache = SQLiteCache(db_path=db_path)
+        self.cache_storage = IndexedSQLiteCache(db_path=db_path)
+        self.expire_after = expire_after
+        self.limiter = TokenBucket(rate_calls, rate_period)
+        self.pool_size = pool_size
+        # keep-alive connections shared by all threads and coroutines
+        self.session: CachedSession = CachedSession(
+            backend=self.cache_storage,
+            expire_after=expire_after,
+        )  # pyright: ignore[reportArgumentType]
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(pool_size, thread_name_prefix="http")
 
-        retry_at = 0
+    def _get(self, url, **kwargs) -> Response | CachedResponse:
+        return self.session.get(url, **kwargs)
 
-        @sleep_and_retry
-        @limits(calls=rate_calls, period=rate_period)
-        def _call_api(url, retry_n=5, **kwargs):
-            nonlocal retry_at
-            origin_kwargs = dict(kwargs)
+    def _handle_429(self, r: Response) -> bool:
+        if r.status_code != 429:
+            return False
+        logger.warning(r.text)
+        retry_after = _get_retry_after(r)
+        self.limiter.delay(retry_after)
+        logger.debug(f"retry after {int(retry_after)} seconds")
+        return True
+
+    def _limit_api_func(
+        self, url, retry_n=5, transient_n=2, **kwargs
+    ) -> Response | CachedResponse:
+        backoff = 1
+        while True:
+            self.limiter.acquire()
             t0 = time.time()
-            if t0 < retry_at:
-                time.sleep(retry_at - t0)
-                t0 = time.time()
-
-            cache_session: CachedSession = CachedSession(
-                backend=self.cache_storage,
-                expire_after=kwargs.pop("expire_after", expire_after),
-            )  # pyright: ignore[reportArgumentType]
-            r = cache_session.get(url, **kwargs)
-            if r.status_code == 429:
-                logger.warning(r.text)
-                try:
-                    header = r.headers.get("Retry-After")
-                    match = re.match(r"wait (\d+) second", r.text)
-                    if header:
-                        retry_after = float(header) + 1
-                    elif match:
-                        retry_after = float(match.group(1)) + 1
-                    else:
-                        retry_after = 6
-                except:  # noqa: E722
-                    retry_after = 6
-                retry_at = max(retry_at, time.time() + retry_after)
-                logger.debug(f"retry after {int(retry_after)} seconds")
-                time.sleep(retry_after)
-                return _call_api(url, retry_n - 1, **origin_kwargs)
+            r = self._get(url, **kwargs)
+            if self._handle_429(r) and retry_n > 0:
+                retry_n -= 1
+                continue
+            if r.status_code in _TRANSIENT_STATUS and transient_n > 0:
+                logger.warning(f"{r.status_code}, retry in {backoff}s: {url}")
+                time.sleep(backoff)
+                transient_n -= 1
+                backoff *= 2
+                continue
             logger.debug(f"GOT url: {time.time() - t0:.3f}s: {url}")
             return r
 
-        self._limit_api_func = _call_api
-
-    def call_api(
+    async def _limit_api_func_async(
         self,
         url,
-        expire_after: ExpirationTime = None,
-        filter_fn: FILTER_FN2 = None,
+        retry_n=5,
+        transient_n=2,
+        error_budget: ErrorBudget | None = None,
         **kwargs,
     ) -> Response | CachedResponse:
         """
-        :param url: only path or full url
-        :param filter_fn: if return True, it should ignore cache and fetch again
-        :param kwargs:
-        :return:
+        :param error_budget: every response and connection error is recorded,
+            raise ErrorBudgetExceeded before a request once exceeded
         """
-        url = self.full_url(url)
-        key = self.cache_storage.create_key(url=url, method="GET")  # pyright: ignore[reportArgumentType]
-        resp = self.cache_storage.get_response(key)
+        loop = asyncio.get_running_loop()
+        backoff = 1
+        while True:
+            await self.limiter.acquire_async()
+            if error_budget is not None and error_budget.exceeded:
+                raise ErrorBudgetExceeded(f"{self.api_server}: {error_budget}")
+            t0 = time.time()
+            try:
+                r = await loop.run_in_executor(
+                    self._executor, functools.partial(self._get, url, **kwargs)
+                )
+            except requests.RequestException:
+                if error_budget is not None:
+                    error_budget.record(False)
+                raise
+            if error_budget is not None:
+                error_budget.record(r.status_code < 500)
+            if self._handle_429(r) and retry_n > 0:
+                retry_n -= 1
+                continue
+            if r.status_code in _TRANSIENT_STATUS and transient_n > 0:
+                logger.warning(f"{r.status_code}, retry in {backoff}s: {url}")
+                await asyncio.sleep(backoff)
+                transient_n -= 1
+                backoff *= 2
+                continue
+            logger.debug(f"GOT url: {time.time() - t0:.3f}s: {url}")
+            return r
+
+    def _get_cached(
+        self,
+        url: str,
+        expire_after: ExpirationTime = None,
+        filter_fn: FILTER_FN2 = None,
+    ) -> CachedResponse | None:
+        resp = self.cache_storage.get_response(self._url_key(url))
+        return self._check_cached(url, resp, expire_after, filter_fn)
+
+    def _check_cached(
+        self,
+        url: str,
+        resp: CachedResponse | None,
+        expire_after: ExpirationTime = None,
+        filter_fn: FILTER_FN2 = None,
+        stale: list[str] | None = None,
+    ) -> CachedResponse | None:
+        """:param stale: collect urls to delete instead of deleting them now"""
         should_delete = False
         if resp and resp.is_expired:
             should_delete = True
@@ -147,14 +303,79 @@ class HttpApiUtil(abc.ABC):
             except Exception as e:  # noqa: BLE001
                 logger.error(f"error in filter_fn: {e}")
                 should_delete = True
-        if should_delete and self.cache_storage.has_url(url):
+        if should_delete and resp is not None:
             logger.debug(f"delete matched url:{url}")
-            self.cache_storage.delete_url(url)
+            if stale is None:
+                self.delete_many([url])
+            else:
+                stale.append(url)
             resp = None
+        return resp
+
+    def _url_key(self, url: str) -> str:
+        return self.cache_storage.create_key(
+            url=url, method="GET"  # pyright: ignore[reportArgumentType]
+        )
+
+    def get_many(self, urls: Iterable[str]) -> dict[str, CachedResponse]:
+        """Read cached responses of urls in bulk, expiration is not checked"""
+        keys: dict[str, str] = {self._url_key(self.full_url(url)): url for url in urls}
+        try:
+            responses = self.cache_storage.get_responses(keys)
+        except Exception as e:  # noqa: BLE001
+            logger.warning(f"bulk cache read failed, read one by one: {e!r}")
+            responses = {}
+            for key in keys:
+                resp = self.cache_storage.get_response(key)
+                if resp:
+                    responses[key] = resp
+        return {keys[key]: resp for key, resp in responses.items()}
+
+    def delete_many(self, urls: Iterable[str]):
+        self.cache_storage.bulk_delete(
+            [self._url_key(self.full_url(url)) for url in urls]
+        )
+
+    def has_url(self, url: str) -> bool:
+        return self.cache_storage.has_url(self.full_url(url))
+
+    def sweep_expired(self, expire_after: int | None = None, vacuum: bool = False):
+        """Delete expired responses using the index, bodies are not unpickled"""
+        n = self.cache_storage.delete_expired(expire_after, vacuum)
+        logger.info(f"removed {n} expired responses from {self.api_server} cache")
+        return n
+
+    def call_api(
+        self,
+        url,
+        expire_after: ExpirationTime = None,
+        filter_fn: FILTER_FN2 = None,
+        **kwargs,
+    ) -> Response | CachedResponse:
+        """
+        :param url: only path or full url
+        :param filter_fn: if return True, it should ignore cache and fetch again
+        :param kwargs:
+        :return:
+        """
+        url = self.full_url(url)
+        resp = self._get_cached(url, expire_after, filter_fn)
         if resp is None:
-            resp = self._limit_api_func(url, **kwargs)
+            return self._limit_api_func(url, **kwargs)
+        return resp
 
-        return resp  # type: ignore
+    async def call_api_async(
+        self,
+        url,
+        expire_after: ExpirationTime = None,
+        filter_fn: FILTER_FN2 = None,
+        **kwargs,
+    ) -> Response | CachedResponse:
+        url = self.full_url(url)
+        resp = self._get_cached(url, expire_after, filter_fn)
+        if resp is None:
+            return await self._limit_api_func_async(url, **kwargs)
+        return resp
 
     def api_json(
         self,
@@ -177,29 +398,173 @@ class HttpApiUtil(abc.ABC):
     ) -> _T | None:
         url = self.full_url(url)
         response = self.call_api(url, expire_after, filter_fn, **kwargs)
+        try:
+            return self._parse_model(url, response, model)
+        except ValidationError as e:
+            logger.warning(f"validation error, delete and retry: {url}\n{e}")
+            self.delete_many([url])
+            response = self._limit_api_func(url, **kwargs)
+            return self._parse_model(url, response, model)
+
+    async def api_model_async(
+        self,
+        url,
+        model: type[_T],
+        expire_after: ExpirationTime = None,
+        filter_fn: FILTER_FN2 = None,
+        error_budget: ErrorBudget | None = None,
+        **kwargs,
+    ) -> _T | None:
+        url = self.full_url(url)
+        if error_budget is not None:
+            kwargs["error_budget"] = error_budget
+        response = await self.call_api_async(url, expire_after, filter_fn, **kwargs)
+        try:
+            return self._parse_model(url, response, model)
+        except ValidationError as e:
+            logger.warning(f"validation error, delete and retry: {url}\n{e}")
+            self.delete_many([url])
+            response = await self._limit_api_func_async(url, **kwargs)
+            return self._parse_model(url, response, model)
+
+    async def api_models_async(
+        self,
+        urls: Iterable[str],
+        model: type[_T],
+        expire_after: ExpirationTime = None,
+        filter_fn: FILTER_FN2 = None,
+        error_budget: ErrorBudget | None = None,
+        **kwargs,
+    ) -> list[_T | None]:
+        """Fetch urls concurrently, results are in the same order as urls.
+
+        At most `pool_size` urls are in progress at once. Fail fast when
+        `error_budget` (default `new_error_budget()`) is exceeded, requests not
+        started yet are cancelled.
+        """
+        stats = TaskStats(f"api_models_{model.__name__}")
+        budget = error_budget or self.new_error_budget()
+        limit = asyncio.Semaphore(self.pool_size)
+        results = await _gather_or_cancel(
+            self._timed_model_async(
+                stats, budget, limit, url, model, expire_after, filter_fn, **kwargs
+            )
+            for url in urls
+        )
+        stats.log()
+        return results
+
+    @staticmethod
+    def new_error_budget() -> ErrorBudget:
+        # every failed attempt counts, a short outage is retried but a down
+        # server fails after about 200 requests instead of all of them
+        return ErrorBudget(max_rate=0.5, min_samples=200)
+
+    async def _timed_model_async(
+        self,
+        stats: TaskStats,
+        budget: ErrorBudget,
+        limit: asyncio.Semaphore,
+        url: str,
+        model: type[_T],
+        expire_after: ExpirationTime = None,
+        filter_fn: FILTER_FN2 = None,
+        **kwargs,
+    ) -> _T | None:
+        # tokens are only reserved once started, so a `delay` of the limiter
+        # applies to the urls still queued here
+        async with limit:
+            t0 = time.perf_counter()
+            try:
+                return await self.api_model_async(
+                    url, model, expire_after, filter_fn, budget, **kwargs
+                )
+            finally:
+                stats.add(time.perf_counter() - t0, url)
 
-        def _parse_model(_response: Response, retry=False):
-            if _response.status_code == 200:
+    def api_models(
+        self,
+        urls: Iterable[str],
+        model: type[_T],
+        expire_after: ExpirationTime = None,
+        filter_fn: FILTER_FN2 = None,
+        error_budget: ErrorBudget | None = None,
+        **kwargs,
+    ) -> list[_T | None]:
+        """Blocking version of `api_models_async`"""
+        return asyncio.run(
+            self.api_models_async(
+                urls, model, expire_after, filter_fn, error_budget, **kwargs
+            )
+        )
+
+    @staticmethod
+    def _parse_model(url: str, response: Response, model: type[_T]) -> _T | None:
+        if response.status_code == 200:
+            return parse_json_obj_as(model, orjson.loads(response.content))
+        elif response.status_code == 404:
+            return None
+        else:
+            logger.error(
+                f"parsing api model failed: {url}, {(response.status_code, response.content)}"
+            )
+            # raise (_response.status_code, _response.content)
+            return None
+
+    def prefetch_models(
+        self,
+        urls: dict[str, ExpirationTime],
+        model: type[_T],
+    ) -> dict[str, _T | None]:
+        """Resolve cache hits in one bulk read, then fetch the misses concurrently.
+
+        :param urls: url -> expire_after
+        :return: full url -> model
+        """
+        urls = {self.full_url(url): expire for url, expire in urls.items()}
+        cached = self.get_many(urls.keys())
+        results: dict[str, _T | None] = {}
+        misses: dict[str, ExpirationTime] = {}
+        stale: list[str] = []
+        for url, expire_after in urls.items():
+            resp = self._check_cached(url, cached.get(url), expire_after, stale=stale)
+            if resp is not None:
                 try:
-                    return parse_json_obj_as(model, orjson.loads(_response.content))
-                except ValidationError as e:
-                    print(e)
-                    if not retry:
-                        raise
-                    print("validation error, delete and retry:", url)
-                    self.cache_storage.delete_url(url)
-                    # todo: not called
-                    return _parse_model(self._limit_api_func(url, **kwargs), False)  # type: ignore
-            elif _response.status_code == 404:
-                return None
-            else:
-                logger.error(
-                    f"parsing api model failed: {(_response.status_code, _response.content)}"
+                    results[url] = self._parse_model(url, resp, model)
+                    continue
+                except ValidationError:
+                    stale.append(url)
+            misses[url] = expire_after
+        del cached
+        if stale:
+            # before fetching, otherwise they are found and deleted one by one
+            self.delete_many(stale)
+        if misses:
+            logger.debug(f"prefetch: {len(results)} cached, {len(misses)} to fetch")
+
+            stats = TaskStats(f"prefetch_{model.__name__}")
+            budget = self.new_error_budget()
+
+            async def _fetch_all():
+                limit = asyncio.Semaphore(self.pool_size)
+                return await _gather_or_cancel(
+                    self._timed_model_async(
+                        stats, budget, limit, url, model, expire_after
+                    )
+                    for url, expire_after in misses.items()
                 )
-                # raise (_response.status_code, _response.content)
-                return None
 
-        return _parse_model(response, True)
+            for url, result in zip(misses, asyncio.run(_fetch_all())):
+                results[url] = result
+            stats.log()
+        return results
+
+    @staticmethod
+    def quest_phase_url(key: QuestPhaseKey) -> str:
+        url = f"/nice/{key.region}/quest/{key.quest_id}/{key.phase}"
+        if key.enemyHash:
+            url += f"?hash={key.enemyHash}"
+        return url
 
     def quest_phase(
         self,
@@ -211,9 +576,7 @@ class HttpApiUtil(abc.ABC):
         filter_fn: FILTER_FN2 = None,
         **kwargs,
     ):
-        url = f"/nice/{region}/quest/{quest_id}/{phase}"
-        if enemyHash:
-            url += f"?hash={enemyHash}"
+        url = self.quest_phase_url(QuestPhaseKey(quest_id, phase, region, enemyHash))
         return self.api_model(
             url,
             NiceQuestPhase,
@@ -222,6 +585,20 @@ class HttpApiUtil(abc.ABC):
             **kwargs,
         )
 
+    def prefetch_quest_phases(
+        self,
+        keys: Iterable[QuestPhaseKey],
+        expire_policy: Callable[[QuestPhaseKey], ExpirationTime],
+    ) -> dict[QuestPhaseKey, NiceQuestPhase | None]:
+        """Duplicated keys are fetched once"""
+        urls: dict[str, QuestPhaseKey] = {}
+        for key in keys:
+            urls.setdefault(self.full_url(self.quest_phase_url(key)), key)
+        results = self.prefetch_models(
+            {url: expire_policy(key) for url, key in urls.items()}, NiceQuestPhase
+        )
+        return {key: results.get(url) for url, key in urls.items()}
+
     def master_mission(
         self,
         mm_id: int,
@@ -241,13 +618,17 @@ class HttpApiUtil(abc.ABC):
         return urljoin(self.api_server, _path)
 
     def remove(self, filter_fn: FILTER_FN):
+        storage = self.cache_storage
+        loads = storage.responses.serializer.loads  # pyright: ignore
         keys = []
-        for key in self.cache_storage.responses:
-            resp = self.cache_storage.get_response(key)
-            if resp and filter_fn(resp):
-                keys.append(key)
+        with storage.responses.connection() as con:
+            rows = con.execute(f"SELECT key, value FROM {storage.responses.table_name}")
+            for key, value in rows:
+                resp = loads(value)
+                if isinstance(resp, CachedResponse) and filter_fn(resp):
+                    keys.append(key)
         print(f"removing {len(keys)} keys")
-        self.cache_storage.bulk_delete(keys)
+        storage.bulk_delete(keys)
 
 
 # FandomApi
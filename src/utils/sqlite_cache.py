@@ -0,0 +1,206 @@
+"""
+SQLiteCache with an index table for bulk lookups and expiry sweeps.
+
+`response_index` keeps url, created_at and expires of every response, so
+expired responses are found without unpickling bodies. Rows are written in
+`save_response`, responses cached before the index existed are indexed once
+on the first sweep or url lookup.
+"""
+
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Iterable
+
+from requests_cache.backends.sqlite import SQLiteCache
+from requests_cache.models.response import CachedResponse
+
+from .log import logger
+
+
+_CHUNK_SIZE = 500
+
+
+def _chunks(values: list[str]) -> Iterable[list[str]]:
+    for i in range(0, len(values), _CHUNK_SIZE):
+        yield values[i : i + _CHUNK_SIZE]
+
+
+def _utc_timestamp(dt: datetime | None) -> float | None:
+    # requests-cache stores naive utc datetimes
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+class IndexedSQLiteCache(SQLiteCache):
+    index_table = "response_index"
+
+    def __init__(self, db_path="http_cache", **kwargs):
+        super().__init__(db_path, **kwargs)
+        self._indexed = False
+        self._init_index()
+
+    def _init_index(self):
+        with self.responses.connection(commit=True) as con:
+            con.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.index_table} "
+                "(key TEXT PRIMARY KEY, url TEXT, created_at REAL, expires REAL)"
+            )
+            for column in ("url", "created_at", "expires"):
+                con.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self.index_table}_{column} "
+                    f"ON {self.index_table} ({column})"
+                )
+
+    @staticmethod
+    def _request_url(response) -> str:
+        return getattr(response.request, "url", None) or response.url
+
+    def save_response(self, response, cache_key=None, expires=None):
+        cache_key = cache_key or self.create_key(response.request)
+        super().save_response(response, cache_key, expires)
+        created_at = time.time()
+        with self.responses.connection(commit=True) as con:
+            con.execute(
+                f"INSERT OR REPLACE INTO {self.index_table} VALUES (?,?,?,?)",
+                (
+                    cache_key,
+                    self._request_url(response),
+                    created_at,
+                    _utc_timestamp(expires),
+                ),
+            )
+
+    def ensure_index(self):
+        """Index responses saved before the index table existed.
+
+        Only keys are read up front, bodies are unpickled one chunk at a time.
+        """
+        if self._indexed:
+            return
+        table = self.responses.table_name
+        loads = self.responses.serializer.loads  # pyright: ignore
+        with self.responses.connection() as con:
+            keys = [
+                row[0]
+                for row in con.execute(
+                    f"SELECT key FROM {table} WHERE key NOT IN "
+                    f"(SELECT key FROM {self.index_table})"
+                )
+            ]
+        if keys:
+            logger.info(f"indexing {len(keys)} cached responses")
+        for chunk in _chunks(keys):
+            index_rows = []
+            with self.responses.connection() as con:
+                rows = con.execute(
+                    f"SELECT key, value FROM {table} "
+                    f"WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for key, value in rows:
+                    try:
+                        response = loads(value)
+                    except Exception:  # noqa: BLE001
+                        response = None
+                    if isinstance(response, CachedResponse):
+                        index_rows.append(
+                            (
+                                key,
+                                self._request_url(response),
+                                _utc_timestamp(response.created_at),
+                                _utc_timestamp(response.expires),
+                            )
+                        )
+                    else:
+                        # invalid responses expire immediately
+                        index_rows.append((key, None, 0, 0))
+            with self.responses.connection(commit=True) as con:
+                con.executemany(
+                    f"INSERT OR REPLACE INTO {self.index_table} VALUES (?,?,?,?)",
+                    index_rows,
+                )
+        self._indexed = True
+
+    def get_responses(self, keys: Iterable[str]) -> dict[str, CachedResponse]:
+        """Read multiple responses in bulk, redirects are not followed"""
+        loads = self.responses.serializer.loads  # pyright: ignore
+        results: dict[str, CachedResponse] = {}
+        with self.responses.connection() as con:
+            for chunk in _chunks(list(keys)):
+                rows = con.execute(
+                    f"SELECT key, value FROM {self.responses.table_name} "
+                    f"WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, value in rows:
+                    response = loads(value)
+                    if isinstance(response, CachedResponse):
+                        response.cache_key = key
+                        results[key] = response
+        return results
+
+    def bulk_delete(self, keys: Iterable[str]):
+        """Delete responses, their redirects and index rows, without VACUUM"""
+        keys = list(keys)
+        if not keys:
+            return
+        with self.responses.connection(commit=True) as con:
+            for chunk in _chunks(keys):
+                marks = ",".join("?" * len(chunk))
+                for table in (self.responses.table_name, self.index_table):
+                    con.execute(f"DELETE FROM {table} WHERE key IN ({marks})", chunk)
+        with self.redirects.connection(commit=True) as con:
+            for chunk in _chunks(keys):
+                marks = ",".join("?" * len(chunk))
+                con.execute(
+                    f"DELETE FROM {self.redirects.table_name} "
+                    f"WHERE key IN ({marks}) OR value IN ({marks})",
+                    chunk + chunk,
+                )
+
+    def has_url(  # pyright: ignore[reportIncompatibleMethodOverride]
+        self, url: str, method: str = "GET", **kwargs
+    ) -> bool:
+        if method != "GET" or kwargs:
+            return super().has_url(url, method, **kwargs)
+        self.ensure_index()
+        with self.responses.connection() as con:
+            row = con.execute(
+                f"SELECT 1 FROM {self.index_table} WHERE url=? LIMIT 1", (url,)
+            ).fetchone()
+        return row is not None
+
+    def expired_keys(self, expire_after: int | None = None) -> list[str]:
+        """Keys of responses past `expires` or older than `expire_after` seconds"""
+        self.ensure_index()
+        now = time.time()
+        query = f"SELECT key FROM {self.index_table} WHERE expires <= ?"
+        params: list[float] = [now]
+        if expire_after is not None and expire_after >= 0:
+            query += " OR created_at <= ?"
+            params.append(now - expire_after)
+        with self.responses.connection() as con:
+            return [row[0] for row in con.execute(query, params)]
+
+    def delete_expired(
+        self, expire_after: int | None = None, vacuum: bool = False
+    ) -> int:
+        keys = self.expired_keys(expire_after)
+        self.bulk_delete(keys)
+        if vacuum and keys:
+            try:
+                self.responses.vacuum()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"vacuum http cache failed: {e}")
+        return len(keys)
+
+    def clear(self):
+        super().clear()
+        with self.responses.connection(commit=True) as con:
+            con.execute(f"DROP TABLE IF EXISTS {self.index_table}")
+        self._init_index()
+        self._indexed = False
@@ -23,12 +23,14 @@ class Stopwatch:
         self.start_time = _get_time()
         self.records.clear()
 
-    def log(self, action: str):
+    def log(self, action: str, lapse: float | None = None):
+        """lapse: measured elsewhere, e.g. in another process"""
         t = _get_time()
-        if self.records:
-            lapse = t.timestamp() - self.records[-1].time.timestamp()
-        else:
-            lapse = 0
+        if lapse is None:
+            if self.records:
+                lapse = t.timestamp() - self.records[-1].time.timestamp()
+            else:
+                lapse = 0
         self.records.append(_StopwatchRecord(t, action, lapse))
 
     def output(self):
@@ -1,11 +1,214 @@
-from concurrent.futures import Future, ThreadPoolExecutor, as_completed
-from typing import Callable
+import bisect
+import heapq
+import itertools
+import math
+import queue
+import reprlib
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from enum import Enum
+from pathlib import PurePath
+from typing import Callable, NamedTuple
+
+import orjson
 
 from ..config import settings
 from .log import logger
 
 
-_executor = ThreadPoolExecutor()
+# max workers of named pools, None for the ThreadPoolExecutor default
+POOL_SIZES: dict[str, int | None] = {
+    "default": None,
+    "network": 16,
+    "cpu": None,
+}
+_executors: dict[str, ThreadPoolExecutor] = {}
+_executors_lock = threading.Lock()
+
+# upper bounds of latency histogram buckets, in seconds
+_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+
+def get_executor(pool: str = "default") -> ThreadPoolExecutor:
+    with _executors_lock:
+        executor = _executors.get(pool)
+        if executor is None:
+            executor = _executors[pool] = ThreadPoolExecutor(
+                POOL_SIZES.get(pool), thread_name_prefix=f"worker_{pool}"
+            )
+        return executor
+
+
+def set_pool_size(pool: str, max_workers: int | None):
+    """Later tasks of the pool run in a new executor of the given size"""
+    with _executors_lock:
+        POOL_SIZES[pool] = max_workers
+        executor = _executors.pop(pool, None)
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def _fmt_secs(secs: float) -> str:
+    return f"{secs * 1000:.0f}ms" if secs < 1 else f"{secs:g}s"
+
+
+class _ArgRepr(reprlib.Repr):
+    """Bounded reprs of task arguments, large objects are never formatted"""
+
+    def __init__(self):
+        super().__init__()
+        self.maxlevel = 2
+        self.maxstring = 40
+
+    def repr_bytes(self, x: bytes, level: int) -> str:
+        return f"<bytes len={len(x)}>"
+
+    def repr_instance(self, x, level: int) -> str:
+        if x is None or isinstance(x, (bool, float, Enum, PurePath)):
+            return super().repr_instance(x, level)
+        # e.g. pydantic models, their repr is as large as the data
+        return f"<{type(x).__qualname__}>"
+
+
+_arg_repr = _ArgRepr()
+
+
+def _task_label(fn, args: tuple, kwargs: dict) -> str:
+    name = getattr(fn, "__qualname__", None) or repr(fn)
+    params = [_arg_repr.repr(arg) for arg in args]
+    params += [f"{k}={_arg_repr.repr(v)}" for k, v in kwargs.items()]
+    label = f"{name}({', '.join(params)})"
+    return label if len(label) <= 120 else label[:117] + "..."
+
+
+class TaskStats:
+    """Latencies of finished tasks, thread safe"""
+
+    def __init__(self, name: str | None = None):
+        self.name = name
+        self._lock = threading.Lock()
+        self._records: list[tuple[float, str]] = []
+
+    def add(self, secs: float, label: str):
+        with self._lock:
+            self._records.append((secs, label))
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def percentile(self, q: float) -> float:
+        """Nearest-rank percentile, q in 0..100"""
+        with self._lock:
+            values = sorted(secs for secs, _ in self._records)
+        if not values:
+            return 0
+        rank = max(1, math.ceil(q / 100 * len(values)))
+        return values[rank - 1]
+
+    def histogram(self) -> dict[str, int]:
+        labels = [f"<{_fmt_secs(bound)}" for bound in _BUCKETS]
+        labels.append(f">={_fmt_secs(_BUCKETS[-1])}")
+        counts = [0] * len(labels)
+        with self._lock:
+            for secs, _ in self._records:
+                counts[bisect.bisect_right(_BUCKETS, secs)] += 1
+        return dict(zip(labels, counts))
+
+    def slowest(self, n: int = 5) -> list[tuple[float, str]]:
+        with self._lock:
+            return sorted(self._records, reverse=True)[:n]
+
+    def summary(self, slowest: int = 5) -> dict:
+        with self._lock:
+            values = [secs for secs, _ in self._records]
+        total = sum(values)
+        return {
+            "name": self.name,
+            "count": len(values),
+            "total": round(total, 4),
+            "mean": round(total / len(values), 4) if values else 0,
+            "p50": round(self.percentile(50), 4),
+            "p95": round(self.percentile(95), 4),
+            "p99": round(self.percentile(99), 4),
+            "max": round(max(values), 4) if values else 0,
+            "histogram": self.histogram(),
+            "slowest": [
+                {"task": label, "secs": round(secs, 4)}
+                for secs, label in self.slowest(slowest)
+            ],
+        }
+
+    def to_json(self, slowest: int = 5) -> str:
+        return orjson.dumps(self.summary(slowest)).decode()
+
+    def log(self, slowest: int = 5):
+        if not self._records:
+            return
+        summary = self.summary(slowest)
+        name = f"({self.name})" if self.name else ""
+        logger.info(
+            f"Tasks{name}: {summary['count']} tasks, p50={summary['p50']}s, "
+            f"p95={summary['p95']}s, p99={summary['p99']}s, max={summary['max']}s"
+        )
+        for item in summary["slowest"]:
+            logger.debug(f"  {item['secs']:8.3f}s  {item['task']}")
+        logger.debug(f"Tasks{name} stats: {orjson.dumps(summary).decode()}")
+
+
+class ErrorBudgetExceeded(RuntimeError):
+    pass
+
+
+class ErrorBudget:
+    """Fail fast after `max_errors` errors or an error rate above `max_rate`"""
+
+    def __init__(
+        self,
+        max_errors: int | None = None,
+        max_rate: float | None = None,
+        min_samples: int = 20,  # results needed before checking max_rate
+    ):
+        self.max_errors = max_errors
+        self.max_rate = max_rate
+        self.min_samples = min_samples
+        self.count = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def record(self, ok: bool):
+        with self._lock:
+            self.count += 1
+            if not ok:
+                self.errors += 1
+
+    @property
+    def exceeded(self) -> bool:
+        if self.max_errors is not None and self.errors >= self.max_errors:
+            return True
+        return (
+            self.max_rate is not None
+            and self.count >= self.min_samples
+            and self.errors / self.count > self.max_rate
+        )
+
+    def __str__(self) -> str:
+        return f"{self.errors}/{self.count} errors"
+
+
+def is_transient(error: BaseException) -> bool:
+    """False for http client errors, retrying a 404 gives the same result"""
+    # requests.HTTPError is an OSError with the response attached
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if not isinstance(status, int) or status in (408, 429):
+        return True
+    return not 400 <= status < 500
+
+
+class _Task(NamedTuple):
+    fn: Callable
+    args: tuple
+    kwargs: dict
 
 
 class Worker:
@@ -16,48 +219,182 @@ class Worker:
         name: str | None = None,
         func: Callable | None = None,
         fake_mode: bool | None = None,
+        pool: str = "default",
+        max_in_flight: int | None = None,  # block `add` beyond it, None=unbounded
+        slowest: int = 5,  # slowest tasks reported in `wait`
+        max_errors: int | None = None,  # cancel pending tasks after n errors
+        max_error_rate: float | None = None,  # or above the rate, 0~1
+        retries: int = 0,  # resubmit tasks failed with transient `retry_on`
+        retry_on: tuple[type[BaseException], ...] = (OSError,),
+        retry_delay: float = 1,  # doubled on every retry
     ) -> None:
         self.name: str | None = name
         self.func: Callable | None = func
-        self._tasks: list[Future] = []
         self._fake_count = 0
         self.fake_mode: bool = Worker.fake_mode if fake_mode is None else fake_mode
+        self.pool = pool
+        self._in_flight = (
+            threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        )
+        self.slowest = slowest
+        self.stats = TaskStats(name)
+        self.budget = ErrorBudget(max_errors, max_error_rate)
+        self.retries = retries
+        self.retry_on = retry_on
+        self.retry_delay = retry_delay
+        # set when failing fast, long tasks may check it to stop early
+        self.cancelled = threading.Event()
+
+        self._total = 0
+        self._finished = 0
+        self._errors: list[BaseException] = []
+        # future -> (task, attempt)
+        self._pending: dict[Future, tuple[_Task, int]] = {}
+        # (ready_at, seq, task, attempt)
+        self._retry_queue: list[tuple[float, int, _Task, int]] = []
+        self._seq = itertools.count()
+        self._done: queue.SimpleQueue[Future] = queue.SimpleQueue()
+        self._show_progress = False
+        self._step = 1
+
+    @property
+    def _label(self) -> str:
+        return f"Worker({self.name})" if self.name else "Worker"
+
+    def _run(self, fn, args: tuple, kwargs: dict):
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.stats.add(time.perf_counter() - t0, _task_label(fn, args, kwargs))
+
+    def _on_done(self, future: Future):
+        if self._in_flight is not None:
+            self._in_flight.release()
+        self._done.put(future)
+
+    def _submit(self, task: _Task, attempt: int = 0):
+        if self._in_flight is not None:
+            self._in_flight.acquire()
+        try:
+            future = get_executor(self.pool).submit(self._run, *task)
+        except BaseException:
+            if self._in_flight is not None:
+                self._in_flight.release()
+            raise
+        self._pending[future] = (task, attempt)
+        future.add_done_callback(self._on_done)
 
     def add(self, fn, *args, **kwargs):
         if self.fake_mode:
             self._fake_count += 1
-            fn(*args, **kwargs)
-        else:
-            self._tasks.append(_executor.submit(fn, *args, **kwargs))
+            self._run(fn, args, kwargs)
+            return
+        if self.cancelled.is_set():
+            raise ErrorBudgetExceeded(f"{self._label} cancelled: {self.budget}")
+        self._drain()
+        self._total += 1
+        self._submit(_Task(fn, args, kwargs))
 
     def add_default(self, *args, **kwargs):
         assert self.func is not None
         self.add(self.func, *args, **kwargs)
 
+    def _drain(self, timeout: float | None = 0):
+        """Resubmit due retries and handle finished futures, block up to `timeout`"""
+        now = time.monotonic()
+        while self._retry_queue and self._retry_queue[0][0] <= now:
+            _, _, task, attempt = heapq.heappop(self._retry_queue)
+            self._submit(task, attempt)
+        while True:
+            try:
+                f = self._done.get(block=timeout != 0, timeout=timeout)
+            except queue.Empty:
+                return
+            timeout = 0
+            if f in self._pending:
+                self._handle(f, *self._pending.pop(f))
+
+    def _handle(self, f: Future, task: _Task, attempt: int):
+        error = f.exception()
+        if (
+            error
+            and attempt < self.retries
+            and isinstance(error, self.retry_on)
+            and is_transient(error)
+        ):
+            delay = self.retry_delay * 2**attempt
+            logger.warning(
+                f"{self._label}: retry {attempt + 1}/{self.retries} in {delay}s: {error!r}"
+            )
+            heapq.heappush(
+                self._retry_queue,
+                (time.monotonic() + delay, next(self._seq), task, attempt + 1),
+            )
+            return
+        if error:
+            logger.error(error)
+            self._errors.append(error)
+        self.budget.record(error is None)
+        self._finished += 1
+        self._log_progress()
+        if self.budget.exceeded:
+            cancelled, running = self.cancel()
+            self.stats.log(self.slowest)
+            msg = (
+                f"{self._label} failed fast: {self.budget}, "
+                f"{self._finished}/{self._total} finished, "
+                f"{cancelled} cancelled, {running} still running"
+            )
+            logger.error(msg)
+            raise ErrorBudgetExceeded(msg)
+
+    def _log_progress(self):
+        if not self._show_progress:
+            return
+        finished, total = self._finished, self._total
+        if finished % self._step == 0:
+            logger.debug(f"{self._label}: {finished}/{total}   ")
+        elif settings.is_debug:
+            print(f"\r{self._label}: {finished}/{total}   ", end="")
+
+    def cancel(self) -> tuple[int, int]:
+        """Cancel pending tasks and retries, running tasks may check `cancelled`.
+
+        Returns the count of cancelled tasks and of tasks still running, results
+        of running or already done tasks are discarded.
+        """
+        self.cancelled.set()
+        cancelled = len(self._retry_queue)
+        running = 0
+        for future in self._pending:
+            if future.cancel():
+                cancelled += 1
+            elif not future.done():
+                running += 1
+        self._pending.clear()
+        self._retry_queue.clear()
+        return cancelled, running
+
     def wait(self, show_progress=True):
-        name = f"({self.name})" if self.name else ""
-        finished = 0
-        steps = [i for i in (2, 5, 10, 20, 50, 100) if i <= len(self._tasks) // 5]
-        step = steps[-1] if steps else 1
-        errors = []
+        total = self._total
+        steps = [i for i in (2, 5, 10, 20, 50, 100) if i <= total // 5]
+        self._step = steps[-1] if steps else 1
+        self._show_progress = show_progress
         if self._fake_count > 0:
             logger.debug(
-                f"Worker{name}: {self._fake_count} fake tasks, {len(self._tasks)} futures  "
+                f"{self._label}: {self._fake_count} fake tasks, {total} futures  "
             )
-        for f in as_completed(self._tasks):
-            error = f.exception()
-            if error:
-                logger.error(error)
-                errors.append(error)
-            finished += 1
-            if show_progress:
-                if finished % step == 0:
-                    logger.debug(f"Worker{name}: {finished}/{len(self._tasks)}   ")
-                elif settings.is_debug:
-                    print(f"\rWorker{name}: {finished}/{len(self._tasks)}   ", end="")
-        msg = f"Worker{name} finished: {finished}/{len(self._tasks)}.  "
+        while self._pending or self._retry_queue:
+            timeout = None
+            if self._retry_queue:
+                timeout = max(0.001, self._retry_queue[0][0] - time.monotonic())
+            self._drain(timeout)
+        self.stats.log(self.slowest)
+        errors = self._errors
+        msg = f"{self._label} finished: {self._finished}/{total}.  "
         if errors:
-            msg += f"{len(errors)}/{len(self._tasks)} errors!"
+            msg += f"{len(errors)}/{total} errors!"
             logger.error(msg)
             raise RuntimeError(msg)
         else:
@@ -72,8 +409,10 @@ class Worker:
             self.add(fn, *args)  # type: ignore
 
     @staticmethod
-    def from_map(fn, *iterables, name: str | None = None) -> "Worker":
-        worker = Worker(name)
+    def from_map(
+        fn, *iterables, name: str | None = None, pool: str = "default"
+    ) -> "Worker":
+        worker = Worker(name, pool=pool)
         worker.map_add(fn, *iterables)
         return worker
 
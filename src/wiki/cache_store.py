@@ -0,0 +1,633 @@
+"""
+SQLite backend of WikiTool's page and image cache.
+
+Page text is content-addressed in `blobs` (sha1 -> text), pages only keep the
+hash, so the database is read through sqlite's mmap and a page is loaded when
+it is first accessed. Only entries changed since the last flush are written.
+
+A legacy `{host}.json` cache is imported once when the database is created.
+
+Every change is appended to `{host}.journal` before it reaches the database.
+`checkpoint` writes the changes and drops their journal, it runs in the
+background every `checkpoint_every` changes and at the end. Changes are taken
+under the lock and written through a separate connection without it, so pages
+are read and downloaded while writing. The journal left by a crashed run is
+replayed on open, so downloaded pages are not lost. Texts and params of removed
+pages are deleted once on close.
+
+Template params extracted from a page are memoized in `params`, keyed by the
+page and the template pattern and validated by the hash of the parsed text, so
+unchanged pages are not parsed again in later runs. Params are derived data,
+they are not journaled.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections.abc import Callable, Iterator, MutableMapping
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Generic, TypeVar
+
+import orjson
+
+from ..schemas.wiki_cache import WikiCache, WikiImageInfo, WikiPageInfo
+from ..utils.helper import load_json, parse_json_obj_as
+from ..utils.log import logger
+
+
+_T = TypeVar("_T", WikiPageInfo, WikiImageInfo)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, text TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS pages (
+    key TEXT PRIMARY KEY, name TEXT, redirect TEXT, updated INTEGER, hash TEXT,
+    revid INTEGER, touched INTEGER
+);
+CREATE INDEX IF NOT EXISTS pages_hash ON pages (hash);
+CREATE INDEX IF NOT EXISTS pages_updated ON pages (updated);
+CREATE TABLE IF NOT EXISTS images (
+    key TEXT PRIMARY KEY, name TEXT, updated INTEGER, info BLOB
+);
+CREATE INDEX IF NOT EXISTS images_updated ON images (updated);
+CREATE TABLE IF NOT EXISTS params (
+    key TEXT, pattern TEXT, hash TEXT, value BLOB, PRIMARY KEY (key, pattern)
+);
+"""
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class _Database:
+    def __init__(self, fp: Path):
+        self.fp = fp
+        self.lock = threading.RLock()
+        # one checkpoint at a time, it writes through `writer`
+        self.write_lock = threading.Lock()
+        self.con = sqlite3.connect(fp, check_same_thread=False)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA mmap_size=1073741824")
+        self.con.executescript(_SCHEMA)
+        columns = {row[1] for row in self.con.execute("PRAGMA table_info(pages)")}
+        for column in ("revid", "touched"):
+            if column not in columns:
+                self.con.execute(f"ALTER TABLE pages ADD COLUMN {column} INTEGER")
+        self.writer = sqlite3.connect(fp, check_same_thread=False)
+
+    def execute(self, sql: str, params=()) -> list[tuple]:
+        with self.lock:
+            return self.con.execute(sql, params).fetchall()
+
+
+class _Journal:
+    def __init__(self, fp: Path):
+        self.fp = fp
+        # changes of the running checkpoint, removed once they are committed
+        self.fp_flushing = fp.with_name(fp.name + ".1")
+        self._file = None
+
+    def append(self, record: list):
+        if self._file is None:
+            self._file = self.fp.open("ab")
+        self._file.write(orjson.dumps(record) + b"\n")
+        self._file.flush()
+
+    def replay(self) -> Iterator[list]:
+        for fp in (self.fp_flushing, self.fp):
+            if not fp.exists():
+                continue
+            with fp.open("rb") as f:
+                for line in f:
+                    try:
+                        yield orjson.loads(line)
+                    except orjson.JSONDecodeError:
+                        # the line written at a crash may be cut
+                        continue
+
+    def rotate(self):
+        """Move changes to the flushing file, new changes start a new journal"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not self.fp.exists():
+            return
+        if not self.fp_flushing.exists():
+            self.fp.rename(self.fp_flushing)
+            return
+        # the last checkpoint failed, its changes go first
+        data = self.fp_flushing.read_bytes()
+        if data and not data.endswith(b"\n"):
+            data += b"\n"
+        self.fp_flushing.write_bytes(data + self.fp.read_bytes())
+        self.fp.unlink()
+
+    def commit(self):
+        self.fp_flushing.unlink(missing_ok=True)
+
+
+_OnChange = Callable[[str, str, str | None, dict[str, Any] | None], None]
+
+
+class _StoreDict(MutableMapping[str, _T], Generic[_T]):
+    """dict of one table, rows are loaded on first access and written on flush.
+
+    Changes are guarded by the database lock. A flush takes them with
+    `take_changes` under the lock, writes them without it and ends with
+    `end_changes`, failed changes are taken again by the next flush.
+    """
+
+    model: type[_T]
+
+    def __init__(
+        self,
+        db: _Database,
+        table: str,
+        eager: bool = False,
+        on_change: _OnChange | None = None,
+    ):
+        self._db = db
+        self._table = table
+        self._on_change = on_change
+        self._loaded: dict[str, _T] = {}
+        self._dirty: set[str] = set()
+        self._deleted: set[str] = set()
+        self._cleared = False
+        # changes being written, None for deleted keys
+        self._flushing: dict[str, _T | None] = {}
+        self._flushing_cleared = False
+        if eager:
+            for row in db.execute(f"SELECT * FROM {table}"):
+                self._loaded[row[0]] = self._from_row(row[1:])
+            self._keys = set(self._loaded)
+        else:
+            self._keys = {row[0] for row in db.execute(f"SELECT key FROM {table}")}
+
+    def _from_row(self, row: tuple) -> _T:
+        raise NotImplementedError
+
+    def _select_row(self, key: str) -> tuple | None:
+        rows = self._db.execute(f"SELECT * FROM {self._table} WHERE key=?", (key,))
+        return rows[0][1:] if rows else None
+
+    def _write(self, con: sqlite3.Connection, items: list[tuple[str, _T]]):
+        raise NotImplementedError
+
+    def __getitem__(self, key: str) -> _T:
+        value = self._loaded.get(key)
+        if value is not None:
+            return value
+        if key not in self._keys:
+            raise KeyError(key)
+        row = self._select_row(key)
+        if row is None:
+            self._keys.discard(key)
+            raise KeyError(key)
+        value = self._loaded[key] = self._from_row(row)
+        return value
+
+    def __setitem__(self, key: str, value: _T):
+        with self._db.lock:
+            if self._on_change:
+                self._on_change(self._table, "set", key, value.model_dump())
+            self._loaded[key] = value
+            self._keys.add(key)
+            self._dirty.add(key)
+            self._deleted.discard(key)
+
+    def __delitem__(self, key: str):
+        with self._db.lock:
+            if key not in self._keys:
+                raise KeyError(key)
+            if self._on_change:
+                self._on_change(self._table, "del", key, None)
+            self._keys.discard(key)
+            self._loaded.pop(key, None)
+            self._dirty.discard(key)
+            self._deleted.add(key)
+
+    def __contains__(self, key) -> bool:
+        return key in self._keys
+
+    def __iter__(self) -> Iterator[str]:
+        with self._db.lock:
+            return iter(list(self._keys))
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def clear(self):
+        with self._db.lock:
+            if self._on_change:
+                self._on_change(self._table, "clear", None, None)
+            self._keys.clear()
+            self._loaded.clear()
+            self._dirty.clear()
+            self._deleted.clear()
+            self._cleared = True
+
+    def replay(self, op: str, key: str | None, value: dict[str, Any] | None):
+        if op == "set" and key is not None and value is not None:
+            self[key] = self.model.model_validate(value)
+        elif op == "del" and key in self:
+            del self[key]
+        elif op == "clear":
+            self.clear()
+
+    def take_changes(self):
+        """Called with the database lock held"""
+        changes: dict[str, _T | None] = dict.fromkeys(self._deleted)
+        for key in self._dirty:
+            if key in self._loaded:
+                changes[key] = self._loaded[key]
+        self._flushing, self._flushing_cleared = changes, self._cleared
+        self._dirty.clear()
+        self._deleted.clear()
+        self._cleared = False
+
+    def write_changes(self, con: sqlite3.Connection) -> int:
+        if self._flushing_cleared:
+            con.execute(f"DELETE FROM {self._table}")
+        con.executemany(
+            f"DELETE FROM {self._table} WHERE key=?",
+            [(key,) for key, value in self._flushing.items() if value is None],
+        )
+        self._write(
+            con,
+            [
+                (key, value)
+                for key, value in self._flushing.items()
+                if value is not None
+            ],
+        )
+        return len(self._flushing)
+
+    def end_changes(self, committed: bool):
+        """Called with the database lock held"""
+        if not committed:
+            self._cleared = self._cleared or self._flushing_cleared
+            for key, value in self._flushing.items():
+                if value is None:
+                    if key not in self._keys:
+                        self._deleted.add(key)
+                elif self._loaded.get(key) is value:
+                    self._dirty.add(key)
+        self._flushing = {}
+        self._flushing_cleared = False
+
+
+class _PageDict(_StoreDict[WikiPageInfo]):
+    model = WikiPageInfo
+
+    def __init__(self, db: _Database, table: str, **kwargs):
+        super().__init__(db, table, **kwargs)
+        # revids of pages which are not rewritten
+        self._revids: dict[str, int] = {}
+        self._flushing_revids: dict[str, int] = {}
+
+    def _from_row(self, row: tuple) -> WikiPageInfo:
+        name, redirect, updated, text, revid, touched = row
+        return WikiPageInfo(
+            name=name,
+            redirect=redirect,
+            updated=updated,
+            text=text,
+            revid=revid,
+            touched=touched,
+        )
+
+    def _select_row(self, key: str) -> tuple | None:
+        rows = self._db.execute(
+            "SELECT name, redirect, updated, text, revid, touched FROM pages "
+            "LEFT JOIN blobs ON pages.hash=blobs.hash WHERE key=?",
+            (key,),
+        )
+        if not rows or rows[0][3] is None:
+            return None
+        return rows[0]
+
+    def _write(self, con: sqlite3.Connection, items: list[tuple[str, WikiPageInfo]]):
+        rows = []
+        for key, page in items:
+            text_hash = _text_hash(page.text)
+            con.execute(
+                "INSERT OR IGNORE INTO blobs VALUES (?,?)", (text_hash, page.text)
+            )
+            rows.append(
+                (
+                    key,
+                    page.name,
+                    page.redirect,
+                    page.updated,
+                    text_hash,
+                    page.revid,
+                    page.touched,
+                )
+            )
+        con.executemany(
+            "INSERT OR REPLACE INTO pages "
+            "(key, name, redirect, updated, hash, revid, touched) "
+            "VALUES (?,?,?,?,?,?,?)",
+            rows,
+        )
+
+    def take_changes(self):
+        super().take_changes()
+        self._flushing_revids, self._revids = self._revids, {}
+
+    def write_changes(self, con: sqlite3.Connection) -> int:
+        # before the rows, a page rewritten later keeps its own revid
+        con.executemany(
+            "UPDATE pages SET revid=? WHERE key=?",
+            [(revid, key) for key, revid in self._flushing_revids.items()],
+        )
+        return super().write_changes(con)
+
+    def end_changes(self, committed: bool):
+        if not committed:
+            self._revids = self._flushing_revids | self._revids
+        self._flushing_revids = {}
+        super().end_changes(committed)
+
+    def revisions(self) -> dict[str, tuple[str, int | None]]:
+        """key -> (title, revid) of all pages, without loading text"""
+        with self._db.lock:
+            result: dict[str, tuple[str, int | None]] = {}
+            if not self._cleared:
+                if not self._flushing_cleared:
+                    for key, name, revid in self._db.execute(
+                        "SELECT key, name, revid FROM pages"
+                    ):
+                        result[key] = (name, revid)
+                for key, revid in self._flushing_revids.items():
+                    if key in result:
+                        result[key] = (result[key][0], revid)
+                for key, page in self._flushing.items():
+                    if page is None:
+                        result.pop(key, None)
+                    else:
+                        result[key] = (page.name, page.revid)
+            for key, revid in self._revids.items():
+                if key in result:
+                    result[key] = (result[key][0], revid)
+            for key in self._deleted:
+                result.pop(key, None)
+            for key in self._dirty:
+                page = self._loaded[key]
+                result[key] = (page.name, page.revid)
+            return result
+
+    def set_revid(self, key: str, revid: int):
+        """Record revid of a cached page without rewriting it"""
+        with self._db.lock:
+            page = self._loaded.get(key)
+            if page is not None:
+                page.revid = revid
+            if key not in self._dirty:
+                self._revids[key] = revid
+
+    def remove_empty(self) -> int:
+        empty_hash = _text_hash("")
+        keys = [
+            row[0]
+            for row in self._db.execute(
+                "SELECT key FROM pages WHERE hash=?", (empty_hash,)
+            )
+        ]
+        for key in keys:
+            if key in self:
+                del self[key]
+        return len(keys)
+
+
+class _ImageDict(_StoreDict[WikiImageInfo]):
+    model = WikiImageInfo
+
+    def _from_row(self, row: tuple) -> WikiImageInfo:
+        name, updated, info = row
+        return WikiImageInfo(name=name, updated=updated, info=orjson.loads(info))
+
+    def _write(self, con: sqlite3.Connection, items: list[tuple[str, WikiImageInfo]]):
+        con.executemany(
+            "INSERT OR REPLACE INTO images VALUES (?,?,?,?)",
+            [
+                (key, img.name, img.updated, orjson.dumps(img.info))
+                for key, img in items
+            ],
+        )
+
+
+class _ParamsMemo:
+    """page key -> pattern -> (text hash, list of template params)"""
+
+    def __init__(self, db: _Database):
+        self._db = db
+        self._loaded: dict[str, dict[str, tuple[str, list[dict[str, str]]]]] = {}
+        self._dirty: set[tuple[str, str]] = set()
+        self._flushing: list[tuple[str, str, str, list[dict[str, str]]]] = []
+
+    def _load(self, key: str) -> dict[str, tuple[str, list[dict[str, str]]]]:
+        # called with the database lock held, all patterns of a page at once
+        entries = self._loaded.get(key)
+        if entries is None:
+            rows = self._db.execute(
+                "SELECT pattern, hash, value FROM params WHERE key=?", (key,)
+            )
+            entries = self._loaded[key] = {
+                pattern: (text_hash, orjson.loads(value))
+                for pattern, text_hash, value in rows
+            }
+        return entries
+
+    def get(
+        self, key: str, pattern: str, text_hash: str
+    ) -> list[dict[str, str]] | None:
+        with self._db.lock:
+            entry = self._load(key).get(pattern)
+        if entry is None or entry[0] != text_hash:
+            return None
+        return entry[1]
+
+    def get_all(self, key: str, text_hash: str) -> dict[str, list[dict[str, str]]]:
+        """pattern -> params of all patterns memoized for the text"""
+        with self._db.lock:
+            entries = self._load(key)
+            return {
+                pattern: value
+                for pattern, (entry_hash, value) in entries.items()
+                if entry_hash == text_hash
+            }
+
+    def set(self, key: str, pattern: str, text_hash: str, value: list[dict[str, str]]):
+        with self._db.lock:
+            self._load(key)[pattern] = (text_hash, value)
+            self._dirty.add((key, pattern))
+
+    def take_changes(self):
+        """Called with the database lock held"""
+        self._flushing = [
+            (key, pattern, *self._loaded[key][pattern]) for key, pattern in self._dirty
+        ]
+        self._dirty.clear()
+
+    def write_changes(self, con: sqlite3.Connection) -> int:
+        con.executemany(
+            "INSERT OR REPLACE INTO params VALUES (?,?,?,?)",
+            [
+                (key, pattern, text_hash, orjson.dumps(value))
+                for key, pattern, text_hash, value in self._flushing
+            ],
+        )
+        return len(self._flushing)
+
+    def end_changes(self, committed: bool):
+        """Called with the database lock held"""
+        if not committed:
+            self._dirty.update((key, pattern) for key, pattern, *_ in self._flushing)
+        self._flushing = []
+
+
+class WikiCacheStore:
+    """Same attributes as `WikiCache`, backed by sqlite"""
+
+    def __init__(self, fp: Path, host: str, checkpoint_every: int = 0):
+        fp.resolve().parent.mkdir(exist_ok=True, parents=True)
+        is_new = not fp.exists()
+        self.fp = fp
+        self._db = _Database(fp)
+        meta = dict(self._db.execute("SELECT key, value FROM meta"))
+        now = int(time.time())
+        self.host: str = host
+        self.created: int = meta.get("created", now)
+        self.updated: int = meta.get("updated", now)
+        if is_new:
+            self._import_json(fp.with_suffix(".json"))
+        self.pages = _PageDict(self._db, "pages")
+        self.images = _ImageDict(self._db, "images", eager=True)
+        self.params = _ParamsMemo(self._db)
+
+        self.checkpoint_every = checkpoint_every
+        self._changes = 0
+        self._written = 0
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="wiki_checkpoint")
+        self._pending: Future | None = None
+        self._journal = _Journal(fp.with_suffix(".journal"))
+        self._replay_journal()
+        self.pages._on_change = self.images._on_change = self._on_change
+
+    def _replay_journal(self):
+        tables = {"pages": self.pages, "images": self.images}
+        count = 0
+        for table, op, key, value in self._journal.replay():
+            tables[table].replay(op, key, value)
+            count += 1
+        if count:
+            logger.info(f"[{self.host}] replayed {count} changes from journal")
+            self.checkpoint()
+
+    def _on_change(
+        self, table: str, op: str, key: str | None, value: dict[str, Any] | None
+    ):
+        # called with the database lock held
+        self._journal.append([table, op, key, value])
+        self._changes += 1
+        if self.checkpoint_every > 0 and self._changes >= self.checkpoint_every:
+            self._changes = 0
+            if self._pending is None or self._pending.done():
+                self._pending = self._executor.submit(self.checkpoint)
+
+    def _import_json(self, json_fp: Path):
+        if not json_fp.exists():
+            return
+        try:
+            cache = parse_json_obj_as(WikiCache, load_json(json_fp))
+        except Exception as e:  # noqa: BLE001
+            logger.error(f"[{self.host}] failed to import {json_fp}: {e}")
+            return
+        self.created, self.updated = cache.created, cache.updated
+        pages = _PageDict(self._db, "pages")
+        images = _ImageDict(self._db, "images")
+        pages.update(cache.pages)
+        images.update(cache.images)
+        pages.take_changes()
+        images.take_changes()
+        with self._db.writer as con:
+            pages.write_changes(con)
+            images.write_changes(con)
+            self._write_meta(con)
+        logger.info(
+            f"[{self.host}] imported {len(cache.pages)} pages and "
+            f"{len(cache.images)} images from {json_fp.name}"
+        )
+
+    def _write_meta(self, con: sqlite3.Connection):
+        con.executemany(
+            "INSERT OR REPLACE INTO meta VALUES (?,?)",
+            [("created", self.created), ("updated", self.updated)],
+        )
+
+    def oldest(self, n: int) -> list[tuple[str, WikiPageInfo | WikiImageInfo]]:
+        """Least recently updated pages and images, unsaved changes included"""
+        self.checkpoint()
+        rows = self._db.execute(
+            "SELECT key, updated, 0 FROM pages UNION ALL "
+            "SELECT key, updated, 1 FROM images ORDER BY updated LIMIT ?",
+            (n,),
+        )
+        return [
+            (key, (self.images if is_image else self.pages)[key])
+            for key, _, is_image in rows
+        ]
+
+    def checkpoint(self) -> int:
+        """Write changed entries and drop their journal, returns the count of
+        written rows.
+
+        Only taking the changes holds the database lock, they are written
+        through the writer connection without it.
+        """
+        stores = (self.pages, self.images, self.params)
+        with self._db.write_lock:
+            with self._db.lock:
+                for store in stores:
+                    store.take_changes()
+                self._journal.rotate()
+                self._changes = 0
+            committed = False
+            try:
+                with self._db.writer as con:
+                    count = self.pages.write_changes(con)
+                    count += self.images.write_changes(con)
+                    self.params.write_changes(con)
+                    self._write_meta(con)
+                committed = True
+            finally:
+                with self._db.lock:
+                    for store in stores:
+                        store.end_changes(committed)
+                    if committed:
+                        self._journal.commit()
+        self._written += count
+        if count:
+            logger.debug(f"[{self.host}] checkpoint: {count} entries")
+        return count
+
+    def _collect_garbage(self):
+        """Delete texts and params of pages which are no longer cached"""
+        with self._db.write_lock, self._db.writer as con:
+            con.execute("DELETE FROM blobs WHERE hash NOT IN (SELECT hash FROM pages)")
+            con.execute("DELETE FROM params WHERE key NOT IN (SELECT key FROM pages)")
+
+    def close(self) -> int:
+        """Wait for the background checkpoint, checkpoint the rest and delete
+        unused texts once"""
+        self._executor.shutdown(wait=True)
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="wiki_checkpoint")
+        count = self.checkpoint()
+        if self._written:
+            self._collect_garbage()
+            self._written = 0
+        return count
@@ -2,7 +2,7 @@ import re
 from typing import Any, Callable, Iterable, TypeVar
 
 import mwparserfromhell
-from mwparserfromhell.nodes import Tag, Template, Wikilink
+from mwparserfromhell.nodes import Comment, Tag, Template, Wikilink
 from mwparserfromhell.nodes.extras import Parameter
 from mwparserfromhell.wikicode import Wikicode
 
@@ -10,6 +10,9 @@ from ..utils import logger
 
 
 Wikitext = str | Wikicode | Template
+# part of the params memo key of WikiTool, bump it whenever the output of
+# `parse_template_list`, `remove_tag` or `Params` changes
+PARAMS_VERSION = 1
 kAllTags = (
     "ref",
     "br",
@@ -86,30 +89,71 @@ class Params(dict[Any, str]):
         return default
 
 
+_FLAGS = re.IGNORECASE | re.DOTALL | re.UNICODE
+# values without these are returned as is, wiki markup tags (lists, hr, tables)
+# are only recognized at the start of a line
+_markup_pattern = re.compile(r"{{|\[\[|<|''|^(?:[*#:;]|----|\s*{\|)", re.MULTILINE)
+
+
+class _Nodes:
+    """All nodes of parsed text by type, in the order of `filter_*`.
+
+    Every node is converted to str once, instead of once per filter call.
+    """
+
+    def __init__(self, code: Wikicode):
+        self.templates: list[tuple[Template, str]] = []
+        self.tags: list[tuple[Tag, str]] = []
+        self.comments: list[str] = []
+        self.wikilinks: list[tuple[Wikilink, str]] = []
+        for node in code.filter():
+            if isinstance(node, Template):
+                self.templates.append((node, str(node)))
+            elif isinstance(node, Tag):
+                self.tags.append((node, str(node)))
+            elif isinstance(node, Comment):
+                self.comments.append(str(node))
+            elif isinstance(node, Wikilink):
+                self.wikilinks.append((node, str(node)))
+
+    def filter_templates(self, matches: str) -> list[tuple[Template, str]]:
+        return [(t, s) for t, s in self.templates if re.search(matches, s, _FLAGS)]
+
+    def filter_tags(self, matches: str) -> list[tuple[Tag, str]]:
+        return [(t, s) for t, s in self.tags if re.search(matches, s, _FLAGS)]
+
+
 def remove_tag(string: str, tags: Iterable[str] = kAllTags, console=False):
     if not string:
         return string
     if tags is True:
         tags = kAllTags
     string = string.strip()
+    if not _markup_pattern.search(string):
+        # nothing to replace
+        return "" if string in ("-", "—") else string
     code = mwparse(string)
+    nodes = _Nodes(code)
+
+    # Each pass replaces the string of matched nodes in the whole text, in this
+    # order. A node whose contents were changed by an earlier pass is left as is.
 
     # html tags
     # REMOVE - ref/comment
     for tag_name in ("ref",):
         if tag_name in tags:
-            for tag in code.filter_tags(matches=r"^<" + tag_name):
-                string = string.replace(str(tag), "")
+            for _, tag_str in nodes.filter_tags(r"^<" + tag_name):
+                string = string.replace(tag_str, "")
     if "comment" in tags:
-        for comment in code.filter_comments():
-            string = string.replace(str(comment), "")
+        for comment_str in nodes.comments:
+            string = string.replace(comment_str, "")
     if "br" in tags:
         string = re.sub(r"<br[\s/\\]*>", "\n", string)
     # Replace with contents - sup/del/noinclude
     for tag_name in ("del", "sup"):
         if tag_name in tags:
-            for tag in code.filter_tags(matches=r"^<" + tag_name):
-                string = string.replace(str(tag), str(tag.contents))
+            for tag, tag_str in nodes.filter_tags(r"^<" + tag_name):
+                string = string.replace(tag_str, str(tag.contents))
 
     if "nowiki" in tags:
         string = re.sub(r"<[\s/]*nowiki[\s/]*>", "", string)
@@ -122,50 +166,44 @@ def remove_tag(string: str, tags: Iterable[str] = kAllTags, console=False):
     # wiki templates
     # just keep 1st
     if "heimu" in tags:
-        for template in code.filter_templates(matches=r"^{{(黑幕|heimu|模糊|修正)"):
+        for template, tmpl_str in nodes.filter_templates(r"^{{(黑幕|heimu|模糊|修正)"):
             params = parse_template(template)
-            string = string.replace(str(template), params.get("1") or "")
-        for template in code.filter_templates(matches=r"^{{color"):
+            string = string.replace(tmpl_str, params.get("1") or "")
+        for template, tmpl_str in nodes.filter_templates(r"^{{color"):
             params = parse_template(template)
-            string = string.replace(str(template), params.get("2") or "")
+            string = string.replace(tmpl_str, params.get("2") or "")
 
     # replace
     if "texing" in tags:
-        for template in code.filter_templates(matches=r"^{{(特性|特攻)"):
+        for template, tmpl_str in nodes.filter_templates(r"^{{(特性|特攻)"):
             params = parse_template(template)
             replace = (params.get("2") or params.get("1") or "").strip("〔〕")
-            string = string.replace(str(template), f"〔{replace}〕")
+            string = string.replace(tmpl_str, f"〔{replace}〕")
     if "ruby" in tags:
-        for template in code.filter_templates(matches=r"^{{ruby"):
+        for template, tmpl_str in nodes.filter_templates(r"^{{ruby"):
             params = parse_template(template)
-            string = string.replace(
-                str(template), f"{params.get('1')}[{params.get('2')}]"
-            )
+            string = string.replace(tmpl_str, f"{params.get('1')}[{params.get('2')}]")
     if "event" in tags:
-        for template in code.filter_templates(matches=r"^{{活动"):
+        for template, tmpl_str in nodes.filter_templates(r"^{{活动"):
             params = parse_template(template)
-            string = string.replace(str(template), f"「{params.get('2')}」")
+            string = string.replace(tmpl_str, f"「{params.get('2')}」")
     if "link" in tags:
         # remove [[File:a.jpg|b|c]] - it show img
         string = re.sub(r"\[\[(文件|File):([^\[\]]*?)]]", "", string)
-        for wiki_link in code.filter_wikilinks():
-            wiki_link: Wikilink
+        for wiki_link, link_str in nodes.wikilinks:
             # [[语音关联从者::somebody]]
             link = re.split(r":+", str(wiki_link.title))[-1]
             shown_text = wiki_link.text
             if shown_text:
                 shown_text = str(shown_text).split("|", maxsplit=1)[0]
-            string = string.replace(str(wiki_link), str(shown_text or link))
+            string = string.replace(link_str, str(shown_text or link))
     if "trja" in tags:
-        for template in code.filter_templates(matches=r"^{{trja"):
+        for template, tmpl_str in nodes.filter_templates(r"^{{trja"):
             params = parse_template(template)
-            string = string.replace(
-                str(template), params.get("1") or params.get("2") or ""
-            )
+            string = string.replace(tmpl_str, params.get("1") or params.get("2") or "")
     if "fandom" in tags:
-        for template in code.filter_templates(matches=r"^{{Seffect"):
-            params = parse_template(template)
-            string = string.replace(str(template), "")
+        for _, tmpl_str in nodes.filter_templates(r"^{{Seffect"):
+            string = string.replace(tmpl_str, "")
     if "html_tag" in tags:
         for tag_node in code.filter_tags(recursive=False):
             string = string.replace(str(tag_node), str(tag_node.contents))
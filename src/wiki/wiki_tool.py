@@ -1,10 +1,12 @@
+import calendar
 import contextlib
 import re
+import sqlite3
 import time
-from collections.abc import Callable
+from collections.abc import Callable, Iterable, Iterator
 from datetime import datetime
 from enum import StrEnum
-from functools import cached_property
+from functools import cached_property, lru_cache
 from hashlib import md5
 from pathlib import Path
 from typing import Any, Literal, cast
@@ -13,20 +15,34 @@ from urllib.parse import unquote
 import mwclient
 import mwclient.page
 import mwparserfromhell
-import orjson
 import pytz
 import requests
+from mwparserfromhell.wikicode import Wikicode
 from ratelimit import limits, sleep_and_retry
 
 from ..config import settings
-from ..schemas.wiki_cache import WikiCache, WikiImageInfo, WikiPageInfo
-from ..utils import dump_json, logger
-from ..utils.helper import (
-    load_json,
-    parse_json_obj_as,
-    retry_decorator,
-    timestamp2datetime,
-)
+from ..schemas.wiki_cache import WikiImageInfo, WikiPageInfo
+from ..utils import logger
+from ..utils.helper import retry_decorator, timestamp2datetime
+from .cache_store import WikiCacheStore
+from .template import PARAMS_VERSION, Params, mwparse, parse_template_list
+
+
+def _parse_touched(touched: str | None) -> int | None:
+    if not touched:
+        return None
+    return int(datetime.fromisoformat(touched.replace("Z", "+00:00")).timestamp())
+
+
+@lru_cache(maxsize=16)
+def _parse_wikitext(text: str) -> Wikicode:
+    # several templates are usually read from the same page in a row
+    return mwparse(text)
+
+
+def _params_hash(text: str) -> str:
+    # memoized params of an older parser never match
+    return md5(f"{PARAMS_VERSION}:{text}".encode()).hexdigest()
 
 
 class KnownTimeZone(StrEnum):
@@ -47,9 +63,7 @@ class WikiTool:
         self.pwd = pwd
         # self.site: mwclient.Site = mwclient.Site(host=host, path=path)
         # self.site2 = pywikibot.Site(url=f"https://{host}/api.php")
-        self._fp = Path(settings.cache_wiki) / f"{norm_host}.json"
-        _now = int(time.time())
-        self.cache = WikiCache(host=norm_host, created=_now, updated=_now)
+        self._fp = Path(settings.cache_wiki) / f"{norm_host}.sqlite"
         self._temp_disabled = False
         self._count = 0
 
@@ -60,32 +74,33 @@ class WikiTool:
     def site(self):
         return mwclient.Site(host=self.host, path=self._path)
 
-    def load(self, clear_empty: bool = False):
-        self._fp.resolve().parent.mkdir(exist_ok=True, parents=True)
-        if self._fp.exists():
-            try:
-                data = load_json(self._fp)
-                self.cache = parse_json_obj_as(WikiCache, data)
-                if clear_empty:
-                    empty_count = 0
-                    for key in list(self.cache.pages.keys()):
-                        if not self.cache.pages[key].text:
-                            self.cache.pages.pop(key)
-                            empty_count += 1
-                    if empty_count > 0:
-                        logger.info(f"{self.host}: Removed {empty_count} empty pages")
-                for key in list(self.cache.images.keys()):
-                    img = self.cache.images[key]
-                    if not img.info or img.info.get("ns") != 6:
-                        self.cache.images.pop(key)
-                self.cache.host = self.host
-                updated = timestamp2datetime(self.cache.updated).isoformat()
-                logger.debug(
-                    f"wiki {self.host}: loaded {len(self.cache.pages)} pages, "
-                    f"{len(self.cache.images)} images, last updated: {updated}"
-                )
-            except Exception as e:  # noqa: BLE001
-                logger.error(f"[{self.host}] failed to load wiki cache: {e}")
+    @cached_property
+    def cache(self) -> WikiCacheStore:
+        try:
+            return WikiCacheStore(self._fp, self.host)
+        except sqlite3.DatabaseError as e:
+            logger.error(f"[{self.host}] failed to open wiki cache: {e}")
+            self._fp.replace(self._fp.with_suffix(".broken"))
+            return WikiCacheStore(self._fp, self.host)
+
+    def load(self, clear_empty: bool = False, checkpoint_every: int = 0):
+        try:
+            self.cache.checkpoint_every = checkpoint_every
+            if clear_empty:
+                empty_count = self.cache.pages.remove_empty()
+                if empty_count > 0:
+                    logger.info(f"{self.host}: Removed {empty_count} empty pages")
+            for key in list(self.cache.images.keys()):
+                img = self.cache.images[key]
+                if not img.info or img.info.get("ns") != 6:
+                    self.cache.images.pop(key)
+            updated = timestamp2datetime(self.cache.updated).isoformat()
+            logger.debug(
+                f"wiki {self.host}: loaded {len(self.cache.pages)} pages, "
+                f"{len(self.cache.images)} images, last updated: {updated}"
+            )
+        except Exception as e:  # noqa: BLE001
+            logger.error(f"[{self.host}] failed to load wiki cache: {e}")
 
     def clear(self):
         self.cache.pages.clear()
@@ -120,7 +135,8 @@ class WikiTool:
                 redirect = redirect.resolve_redirect()
 
         if redirect == page:
-            return WikiPageInfo(name=page.name, text=text, updated=now), None
+            info = WikiPageInfo(name=page.name, text=text, updated=now)
+            return self._set_revision(info, page), None
         else:
             info = WikiPageInfo(
                 name=page.name,
@@ -131,7 +147,14 @@ class WikiTool:
             info2 = WikiPageInfo(
                 name=redirect.name, text=_get_text(redirect), updated=now
             )
-            return info, info2
+            return self._set_revision(info, page), self._set_revision(info2, redirect)
+
+    @staticmethod
+    def _set_revision(info: WikiPageInfo, page: mwclient.page.Page) -> WikiPageInfo:
+        if page.exists:
+            info.revid = page.revision or None
+            info.touched = calendar.timegm(page.touched) if page.touched else None
+        return info
 
     # def _call_page_site2(self, name: str) -> tuple[WikiPageInfo, WikiPageInfo | None]:
     #     name_json = f'"{name}"({len(name)})'
@@ -288,6 +311,101 @@ class WikiTool:
             result = self.get_page_cache(result.name) or result
         return result
 
+    def get_pages(
+        self, names: Iterable[str], allow_cache=True
+    ) -> dict[str, WikiPageInfo | None]:
+        """Fetch cache misses in batches of 50 titles, redirects are resolved by api"""
+        # dict keeps the order of first occurrence
+        keys: dict[str, None] = {}
+        for name in names:
+            key = unquote(self.norm_key(name).strip()) if name else ""
+            if key and not key.startswith("#") and "|" not in key:
+                keys[key] = None
+        missing = [
+            key for key in keys if not allow_cache or self.get_page_cache(key) is None
+        ]
+        if missing:
+            logger.debug(f"[{self.host}] batch downloading {len(missing)} pages")
+        for i in range(0, len(missing), 50):
+            try:
+                self._call_request_pages(missing[i : i + 50])
+            except Exception as e:  # noqa: BLE001
+                # left to get_page
+                logger.warning(f"[{self.host}] batch download failed: {e}")
+        return {key: self.get_page_cache(key) for key in keys}
+
+    @sleep_and_retry
+    @limits(3, 4)
+    def _query(self, params: dict) -> dict:
+        return self.site.get("query", **params)
+
+    def _query_all(self, params: dict) -> Iterator[dict]:
+        """Yield `query` of every continued response"""
+        while True:
+            resp = self._query(params)
+            yield resp.get("query", {})
+            if "continue" not in resp:
+                break
+            params = params | resp["continue"]
+
+    @retry_decorator(retry_times=3, lapse=10)
+    def _call_request_pages(self, names: list[str]):
+        now = int(time.time())
+        params = {
+            "prop": "revisions|info",
+            "rvprop": "content|ids",
+            "rvslots": "main",
+            "titles": "|".join(names),
+            "redirects": 1,
+            "formatversion": 2,
+        }
+        normalized: dict[str, str] = {}
+        redirects: dict[str, str] = {}
+        texts: dict[str, str] = {}
+        infos: dict[str, dict] = {}
+        for query in self._query_all(params):
+            for item in query.get("normalized", []):
+                normalized[item["from"]] = item["to"]
+            for item in query.get("redirects", []):
+                redirects[item["from"]] = item["to"]
+            for page in query.get("pages", []):
+                infos.setdefault(page["title"], page)
+                revisions = page.get("revisions")
+                if revisions:
+                    texts[page["title"]] = revisions[0]["slots"]["main"]["content"]
+                else:
+                    texts.setdefault(page["title"], "")
+
+        for name in names:
+            title = normalized.get(name, name)
+            target = title
+            visited = {title}
+            while target in redirects and redirects[target] not in visited:
+                target = redirects[target]
+                visited.add(target)
+            text = texts.get(target, "")
+            if not text:
+                logger.debug(f'{self.host}: "{name}"({len(name)}) not exists')
+            info = infos.get(target, {})
+            page = WikiPageInfo(
+                name=target,
+                text=text,
+                updated=now,
+                revid=info.get("lastrevid"),
+                touched=_parse_touched(info.get("touched")),
+            )
+            if target == title:
+                self.cache.pages[name] = page
+            else:
+                # revid of redirect pages is not returned with redirects=1
+                self.cache.pages[name] = WikiPageInfo(
+                    name=title,
+                    redirect=target,
+                    text=f"#REDIRECT [[{target}]]",
+                    updated=now,
+                )
+                self.cache.pages[self.norm_key(target)] = page
+
     def get_page_text(self, name: str, allow_cache=True, clear_tag=True) -> str:
         page = self.get_page(name, allow_cache)
         text = page.text if page else ""
@@ -298,6 +416,37 @@ class WikiTool:
             text = re.sub(r"[\u2028\u2029\u200e]", "", text)
         return text
 
+    def get_page_params(self, name: str, matches: str) -> Params:
+        """Params of the first template matching `matches`, memoized"""
+        params = self.get_page_params_list(name, matches)
+        return params[0] if params else Params()
+
+    def get_page_params_list(self, name: str, matches: str) -> list[Params]:
+        """Params of all templates matching `matches`, memoized by page text"""
+        text = self.get_page_text(name)
+        if not text:
+            return []
+        key = self.norm_key(name)
+        text_hash = _params_hash(text)
+        values = self.cache.params.get(key, matches, text_hash)
+        if values is None:
+            templates = parse_template_list(_parse_wikitext(text), matches)
+            values = [dict(params) for params in templates]
+            self.cache.params.set(key, matches, text_hash, values)
+        return [Params(params) for params in values]
+
+    def get_params_memo(self, name: str, text: str) -> dict[str, list[dict[str, str]]]:
+        """Memoized params of every pattern read from the page text"""
+        text_hash = _params_hash(text)
+        return self.cache.params.get_all(self.norm_key(name), text_hash)
+
+    def set_params_memo(
+        self, name: str, text: str, matches: str, values: list[dict[str, str]]
+    ):
+        """Memoize params of `matches` parsed from the page text elsewhere"""
+        text_hash = _params_hash(text)
+        self.cache.params.set(self.norm_key(name), matches, text_hash, values)
+
     def remove_page_cache(self, name: str):
         name = self.norm_key(name)
         page = self.cache.pages.pop(name, None)
@@ -333,6 +482,56 @@ class WikiTool:
             return None
         return image
 
+    def prefetch_images(self, names: Iterable[str | None]):
+        """Fetch image info of cache misses in batches of 50 titles"""
+        keys: list[str] = []
+        for name in names:
+            key = self.norm_img_key(name) if name else ""
+            if (
+                key
+                and "|" not in key
+                and key not in keys
+                and self.get_image_cache(key, skip_exist_check=True) is None
+            ):
+                keys.append(key)
+        if keys:
+            logger.debug(f"[{self.host}] batch downloading {len(keys)} image info")
+        for i in range(0, len(keys), 50):
+            try:
+                self._call_request_imgs(keys[i : i + 50])
+            except Exception as e:  # noqa: BLE001
+                # left to get_image
+                logger.warning(f"[{self.host}] batch image info failed: {e}")
+
+    @retry_decorator(retry_times=3, lapse=10)
+    def _call_request_imgs(self, names: list[str]):
+        now = int(time.time())
+        params = {
+            "prop": "info|imageinfo",
+            "inprop": "protection",
+            "iiprop": "timestamp|user|comment|url|size|sha1|metadata|mime|archivename",
+            "titles": "|".join(f"File:{name}" for name in names),
+        }
+        normalized: dict[str, str] = {}
+        pages: dict[str, dict] = {}
+        for query in self._query_all(params):
+            for item in query.get("normalized", []):
+                normalized[item["from"]] = item["to"]
+            for page in query.get("pages", {}).values():
+                prev = pages.setdefault(page["title"], page)
+                if prev is not page and "imageinfo" not in prev:
+                    prev.update(page)
+
+        for name in names:
+            title = f"File:{name}"
+            page = pages.get(normalized.get(title, title))
+            if page and "missing" not in page and "invalid" not in page:
+                self.cache.images[name] = WikiImageInfo(
+                    name=name, updated=now, info=page
+                )
+            else:
+                logger.debug(f'[{self.host}][image]: "{name}"({len(name)}) not exists')
+
     def get_image_name(self, name: str, allow_cache: bool = True) -> str:
         image = self.get_image(name, allow_cache)
         if not image:
@@ -479,6 +678,7 @@ class WikiTool:
         move_days: float | None = None,
         delete_days: float | None = None,
         clear_pages: list[str] | None = None,
+        by_revid: bool = False,
     ):
         all_updated = True
         _now = int(time.time())
@@ -489,26 +689,32 @@ class WikiTool:
             for page in clear_pages:
                 self.remove_page_cache(page)
                 self.remove_image_cache(page)
-        if not edit_days or edit_days > 0:
-            self.remove_recent_changed(edit_days)
-        else:
-            all_updated = False
-        if not move_days or move_days > 0:
-            self.clear_moved_or_deleted("move", move_days)
-        else:
-            all_updated = False
-        if not delete_days or delete_days > 0:
-            self.clear_moved_or_deleted("delete", delete_days)
-        else:
-            all_updated = False
-        if all_updated:
+        if by_revid:
+            # deleted pages and moved sources are caught by revid,
+            # move logs are still needed for moved_pages
+            self.validate_revisions()
+            if not move_days or move_days > 0:
+                self.clear_moved_or_deleted("move", move_days)
             self.cache.updated = _now
+        else:
+            if not edit_days or edit_days > 0:
+                self.remove_recent_changed(edit_days)
+            else:
+                all_updated = False
+            if not move_days or move_days > 0:
+                self.clear_moved_or_deleted("move", move_days)
+            else:
+                all_updated = False
+            if not delete_days or delete_days > 0:
+                self.clear_moved_or_deleted("delete", delete_days)
+            else:
+                all_updated = False
+            if all_updated:
+                self.cache.updated = _now
 
         # remove last 10 pages
-        remove_last_count = 10
-        pages = list(self.cache.pages.items()) + list(self.cache.images.items())
-        pages.sort(key=lambda x: x[1].updated)
-        for page in pages[:remove_last_count]:
+        remove_last_count = 0 if by_revid else 10
+        for page in self.cache.oldest(remove_last_count):
             if isinstance(page[1], WikiPageInfo):
                 logger.info(f"purge oldest page {page[0]}")
                 self.remove_page_cache(page[0])
@@ -523,6 +729,54 @@ class WikiTool:
             ):
                 self.cache.images.pop(k, None)
 
+    def validate_revisions(self) -> int:
+        """Drop cached pages whose latest revision differs from the cached one.
+
+        Cached titles are queried by 50 per call. A missing page has no
+        lastrevid, like its cache entry. Pages cached with text but without
+        revid only record it.
+        """
+        cached = self.cache.pages.revisions()
+        titles = list(dict.fromkeys(title for title, _ in cached.values() if title))
+        latest: dict[str, int] = {}
+        for i in range(0, len(titles), 50):
+            params = {
+                "prop": "info",
+                "titles": "|".join(titles[i : i + 50]),
+                "formatversion": 2,
+            }
+            normalized: dict[str, str] = {}
+            for query in self._query_all(params):
+                for item in query.get("normalized", []):
+                    normalized[item["to"]] = item["from"]
+                for page in query.get("pages", []):
+                    latest[page["title"]] = page.get("lastrevid", 0)
+            for to, from_ in normalized.items():
+                if to in latest:
+                    latest[from_] = latest[to]
+
+        dropped, recorded = 0, 0
+        for key, (title, revid) in cached.items():
+            latest_revid = latest.get(title)
+            if latest_revid is None:
+                continue
+            if (revid or 0) == latest_revid:
+                continue
+            if revid is None:
+                page = self.cache.pages.get(key)
+                if page is not None and page.text:
+                    self.cache.pages.set_revid(key, latest_revid)
+                    recorded += 1
+                    continue
+            self.remove_page_cache(key)
+            dropped += 1
+            logger.debug(f'{self.host}: drop outdated revision: "{title}"')
+        logger.info(
+            f"[{self.host}] validated {len(cached)} pages by revid: "
+            f"{dropped} outdated, {recorded} recorded"
+        )
+        return dropped
+
     def remove_recent_changed(self, days: float | None = None):
         last_timestamp = self._get_expire_time(2 / 24, days)
         changes = self.recent_changes(
@@ -591,11 +845,11 @@ class WikiTool:
             f"[{self.host}] total cache({len(self.cache.pages)} pages,"
             f" {len(self.cache.images)} images) to {self._fp}"
         )
-        # in multi-threading, saving (dict/list iteration) is not safe
         try:
-            dump_json(self.cache, self._fp, indent2=False)
-        except orjson.JSONEncodeError:
-            logger.exception("dump wiki cache failed")
+            count = self.cache.close()
+            logger.debug(f"[{self.host}] saved {count} changed cache entries")
+        except sqlite3.Error:
+            logger.exception("save wiki cache failed")
 
     @contextlib.contextmanager
     def disable_cache(self):